@@ -4,14 +4,20 @@ Each directory inside courses/ holding an index.json/yaml is a course.
 '''
 from django.conf import settings
 from django.template import loader as django_template_loader
+from concurrent.futures import ProcessPoolExecutor
 import os, time, json, yaml, re
+import hashlib
 import logging
 import copy
+import threading
 
-from util.dict import iterate_kvp_with_dfs, get_rst_as_html
+from util.dict import LazyDict, iterate_kvp_with_dfs, get_rst_as_html
 from util.files import read_meta
 from util.importer import import_named
 from util.static import symbolic_link
+from .snapshot import SnapshotExercises, open_snapshot, read_generation, \
+    snapshot_path, sources_fresh, write_snapshot
+from .watcher import FileWatcher
 
 
 META = "apps.meta"
@@ -50,17 +56,32 @@ class ConfigParser:
         'yaml': yaml.safe_load,
     }
     PROCESSOR_TAG_REGEX = re.compile(r'^(.+)\|(\w+)$')
+    # the grading queue lanes, see asyncjob.models.JobPriority
+    CONTAINER_PRIORITIES = ('low', 'normal', 'high')
     TAG_PROCESSOR_DICT = {
         'i18n': lambda root, parent, value, **kwargs: value.get(kwargs['lang']),
         'rst': lambda root, parent, value, **kwargs: get_rst_as_html(value),
     }
 
-    def __init__(self):
+    def __init__(self, use_snapshots=True, watch_files=True):
         '''
         The constructor.
+
+        @type use_snapshots: C{bool}
+        @param use_snapshots: load courses from compiled snapshots when fresh
+        @type watch_files: C{bool}
+        @param watch_files: watch files for changes if enabled in settings
         '''
         self._courses = {}
         self._dir_mtime = 0
+        self._use_snapshots = use_snapshots
+        self._watch_files = watch_files
+        self._generations = {}
+        self._stats = {}
+        self._watcher = None
+        self._watcher_pid = None
+        # the files included while loading an exercise, per thread
+        self._loading = threading.local()
 
 
     def courses(self):
@@ -72,17 +93,33 @@ class ConfigParser:
         '''
 
         # Find all courses if exercises directory is modified.
-        t = os.path.getmtime(DIR)
+        watcher = self._apply_file_changes()
+        if watcher is not None and self._dir_mtime:
+            t = self._dir_mtime
+        else:
+            if watcher is not None:
+                watcher.watch_directory((None, None), DIR)
+            t = os.path.getmtime(DIR)
         if self._dir_mtime < t:
-            self._courses.clear()
             self._dir_mtime = t
-            LOGGER.debug('Recreating course list.')
-            for item in os.listdir(DIR):
-                try:
-                    self._course_root(item)
-                except ConfigError:
-                    LOGGER.exception("Failed to load course: %s", item)
-                    continue
+            LOGGER.debug('Updating course list.')
+            items = os.listdir(DIR)
+
+            # Drop the removed courses and keep the others with their exercises.
+            for course_key in set(self._courses) - set(items):
+                self._drop_course(course_key)
+
+            if not self._courses and settings.CONFIG_LOAD_JOBS > 1:
+                # Load everything in parallel on a cold start.
+                for error in self.load_courses(items, settings.CONFIG_LOAD_JOBS):
+                    LOGGER.error("Failed to load course configuration: %s", error)
+            else:
+                for item in items:
+                    try:
+                        self._course_root(item)
+                    except ConfigError:
+                        LOGGER.exception("Failed to load course: %s", item)
+                        continue
 
         # Pick course data into list.
         course_list = []
@@ -131,6 +168,28 @@ class ConfigParser:
         return (course_root["data"], exercise_list)
 
 
+    def course_version(self, course_key):
+        '''
+        Gets a version of the course configuration that changes whenever
+        the course or any of its exercise configurations changes.
+
+        @type course_key: C{str}
+        @param course_key: a course key
+        @rtype: C{str}
+        @return: a version string or None if the course does not exist
+        '''
+        course_root = self._course_root(course_key)
+        if course_root is None:
+            return None
+        version = hashlib.sha1()
+        version.update(repr(course_root["mtime"]).encode())
+        for exercise_key in course_root["data"].get("exercises", []):
+            exercise_root = self._exercise_root(course_root, exercise_key)
+            mtime = exercise_root["mtime"] if exercise_root else None
+            version.update(("\0%s:%r" % (exercise_key, mtime)).encode())
+        return version.hexdigest()
+
+
     def exercise_entry(self, course, exercise_key, lang=None):
         '''
         Gets course and exercise entries for their keys.
@@ -165,7 +224,7 @@ class ConfigParser:
                 return course_root["data"], exercise_root["data"][lang]
 
         # Try to find a language in priority order
-        for lang in course_root['langauges']:
+        for lang in course_root['languages']:
             if lang in exercise_root['data']:
                 return course_root['data'], exercise_root['data'][lang]
 
@@ -173,6 +232,90 @@ class ConfigParser:
         return course_root["data"], next(iter(exercise_root["data"].values()), None)
 
 
+    def load_courses(self, course_keys, jobs=1):
+        '''
+        Loads courses and all of their exercises into the cache. Courses
+        without a fresh snapshot are parsed in a pool of worker processes
+        when more than one job is requested. Loading continues past
+        configuration errors.
+
+        @type course_keys: C{list}
+        @param course_keys: course keys to load
+        @type jobs: C{int}
+        @param jobs: the number of parallel worker processes
+        @rtype: C{list}
+        @return: error messages for the courses and exercises that failed to load
+        '''
+        # When every course of the directory is loaded, the course list is
+        # up to date and courses() does not check the courses again.
+        dir_mtime = None
+        if set(course_keys) >= set(os.listdir(DIR)):
+            watcher = self._get_watcher()
+            if watcher is not None:
+                watcher.watch_directory((None, None), DIR)
+            dir_mtime = os.path.getmtime(DIR)
+
+        errors = []
+        generations = {}
+        parse_keys = []
+        for course_key in course_keys:
+            generations[course_key] = self._generation(course_key)
+            if self._use_snapshots and self._load_snapshot(course_key, generations[course_key]):
+                continue
+            parse_keys.append(course_key)
+
+        if jobs > 1 and len(parse_keys) > 1:
+            with ProcessPoolExecutor(max_workers=min(jobs, len(parse_keys))) as pool:
+                for course_key, course_root, course_errors in pool.map(_load_course_files, parse_keys):
+                    errors.extend(course_errors)
+                    if course_root is None:
+                        continue
+                    course_root["exercise_loader"] = self._get_exercise_loader(course_root["data"])
+                    self._stamp(course_root, generations[course_key])
+                    self._count(course_key, "reloads")
+                    for exercise_root in course_root["exercises"].values():
+                        self._stamp(exercise_root, generations[course_key])
+                        self._count(course_key, "reloads")
+                    self._courses[course_key] = course_root
+        else:
+            for course_key in parse_keys:
+                errors.extend(self._load_course_files(course_key)[1])
+        if dir_mtime is not None and self._dir_mtime < dir_mtime:
+            self._dir_mtime = dir_mtime
+        return errors
+
+
+    def _load_course_files(self, course_key):
+        '''
+        Loads a course and all of its exercises, collecting the errors.
+
+        @type course_key: C{str}
+        @param course_key: a course key
+        @rtype: C{tuple}
+        @return: course root or None, list of error messages
+        '''
+        try:
+            course_root = self._course_root(course_key)
+        except Exception as e:
+            return None, ["%s: %s" % (course_key, e)]
+        if course_root is None:
+            return None, []
+        errors = []
+        for exercise_key in course_root["data"].get("exercises", []):
+            try:
+                exercise_root = self._exercise_root(course_root, exercise_key)
+                if exercise_root is None:
+                    errors.append('%s/%s: Invalid exercise key listed in "%s"'
+                        % (course_key, exercise_key, course_root["file"]))
+                    continue
+                # Every language version is created to find their errors.
+                for lang in exercise_root["data"]:
+                    exercise_root["data"][lang]
+            except Exception as e:
+                errors.append("%s/%s: %s" % (course_key, exercise_key, e))
+        return course_root, errors
+
+
     def _course_root(self, course_key):
         '''
         Gets course dictionary root (meta and data).
@@ -184,19 +327,24 @@ class ConfigParser:
         '''
 
         # Try cached version.
+        self._apply_file_changes()
+        generation = self._generation(course_key)
         if course_key in self._courses:
             course_root = self._courses[course_key]
-            try:
-                if course_root["mtime"] >= os.path.getmtime(course_root["file"]):
-                    return course_root
-            except OSError:
-                pass
+            if self._is_fresh((course_key, None), course_root, generation):
+                return course_root
+
+        if self._use_snapshots:
+            course_root = self._load_snapshot(course_key, generation)
+            if course_root is not None:
+                return course_root
 
         LOGGER.debug('Loading course "%s"' % (course_key))
         meta = read_meta(os.path.join(DIR, course_key, META))
         try:
             f = self._get_config(os.path.join(self._conf_dir(DIR, course_key, meta), INDEX))
         except ConfigError:
+            self._drop_course(course_key)
             return None
 
         t = os.path.getmtime(f)
@@ -240,11 +388,6 @@ class ConfigParser:
             data["exercises"] = keys
             data["config_files"] = config
 
-        # Enable course configurable ecercise_loader function.
-        exercise_loader = self._default_exercise_loader
-        if "exercise_loader" in data:
-            exercise_loader = import_named(data, data["exercise_loader"])
-
         languages = data.get('language') or data.get('lang') or DEFAULT_LANG
         if isinstance(languages, str):
             languages = [languages]
@@ -262,13 +405,96 @@ class ConfigParser:
             "data": data,
             'languages': languages,
             'lang': languages[0],
-            "exercise_loader": exercise_loader,
+            "exercise_loader": self._get_exercise_loader(data),
             "exercises": {}
         }
+        self._stamp(course_root, generation)
+        self._count(course_key, "reloads")
         symbolic_link(DIR, data)
         return course_root
 
 
+    def _get_exercise_loader(self, data):
+        '''
+        Gets the exercise loader function for a course.
+
+        @type data: C{dict}
+        @param data: a course configuration
+        @rtype: C{function}
+        @return: the course configured or the default exercise loader
+        '''
+        # Enable course configurable ecercise_loader function.
+        if "exercise_loader" in data:
+            return import_named(data, data["exercise_loader"])
+        return self._default_exercise_loader
+
+
+    def _load_snapshot(self, course_key, generation=None):
+        '''
+        Loads a course root and its exercise roots from a compiled snapshot.
+        With shared snapshots the file is memory mapped and the exercise
+        roots are unpickled on demand. Otherwise, all roots are unpickled
+        at once. Each exercise root is validated against its own files on
+        the first access.
+
+        @type course_key: C{str}
+        @param course_key: a course key
+        @type generation: C{int}
+        @param generation: the course generation read before loading
+        @rtype: C{dict}
+        @return: course root or None if no fresh snapshot exists
+        '''
+        snapshot = open_snapshot(snapshot_path(course_key))
+        if snapshot is None:
+            return None
+        if not sources_fresh(snapshot.sources):
+            LOGGER.debug('Ignoring stale snapshot of course "%s"', course_key)
+            return None
+
+        def unvalidated(exercise_root):
+            exercise_root["checked"] = 0
+            exercise_root["generation"] = None
+
+        LOGGER.debug('Loading course "%s" from snapshot', course_key)
+        course_root = snapshot.course
+        course_root["ptime"] = time.time()
+        course_root["exercise_loader"] = self._get_exercise_loader(course_root["data"])
+        if settings.CONFIG_SHARED_SNAPSHOTS:
+            course_root["exercises"] = SnapshotExercises(snapshot,
+                settings.CONFIG_SHARED_CACHE_SIZE, unvalidated)
+        else:
+            course_root["exercises"] = {}
+            for exercise_key in snapshot.exercise_keys():
+                exercise_root = snapshot.exercise(exercise_key)
+                unvalidated(exercise_root)
+                course_root["exercises"][exercise_key] = exercise_root
+        self._stamp(course_root, generation)
+        self._courses[course_key] = course_root
+        self._count(course_key, "reloads")
+        symbolic_link(DIR, course_root["data"])
+        return course_root
+
+
+    def compile_snapshot(self, course_key):
+        '''
+        Parses a course and all of its exercises from the configuration
+        files and writes them to a snapshot file.
+
+        @type course_key: C{str}
+        @param course_key: a course key
+        @rtype: C{str}
+        @return: path to the written snapshot or None if the course does not exist
+        @raises ConfigError: if the course or an exercise fails to parse
+        '''
+        course_root = self._course_root(course_key)
+        if course_root is None:
+            return None
+        self.exercises(course_key, lang='_root')
+        path = snapshot_path(course_key)
+        write_snapshot(path, course_root)
+        return path
+
+
     def _exercise_root(self, course_root, exercise_key):
         '''
         Gets exercise dictionary root (meta and data).
@@ -282,49 +508,234 @@ class ConfigParser:
         '''
 
         # Try cached version.
+        course_key = course_root["data"]["key"]
+        self._apply_file_changes()
+        generation = self._generation(course_key)
         if exercise_key in course_root["exercises"]:
             exercise_root = course_root["exercises"][exercise_key]
-            try:
-                if exercise_root["mtime"] >= os.path.getmtime(exercise_root["file"]):
-                    return exercise_root
-            except OSError:
-                pass
+            if self._is_fresh((course_key, exercise_key), exercise_root, generation):
+                return exercise_root
 
         LOGGER.debug('Loading exercise "%s/%s"', course_root["data"]["key"], exercise_key)
         file_name = exercise_key
         if "config_files" in course_root["data"]:
             file_name = course_root["data"]["config_files"].get(exercise_key, exercise_key)
-        if file_name.startswith("/"):
-            f, t, data = course_root["exercise_loader"](
-                course_root,
-                file_name[1:],
-                self._conf_dir(DIR, course_root["data"]["key"], {})
-            )
-        else:
-            f, t, data = course_root["exercise_loader"](
-                course_root,
-                file_name,
-                self._conf_dir(DIR, course_root["data"]["key"], course_root["meta"])
-            )
+        # Collect the files included to the exercise configuration.
+        self._loading.included = {}
+        try:
+            if file_name.startswith("/"):
+                f, t, data = course_root["exercise_loader"](
+                    course_root,
+                    file_name[1:],
+                    self._conf_dir(DIR, course_root["data"]["key"], {})
+                )
+            else:
+                f, t, data = course_root["exercise_loader"](
+                    course_root,
+                    file_name,
+                    self._conf_dir(DIR, course_root["data"]["key"], course_root["meta"])
+                )
+            sources = { f: t }
+            sources.update(self._loading.included)
+        finally:
+            self._loading.included = None
         if not data:
             return None
+        t = max(sources.values())
 
         # Process key modifiers and create language versions of the data.
-        data = self._process_exercise_data(course_root, data)
-        for version in data.values():
-            self._check_fields(f, version, ["title", "view_type"])
-            version["key"] = exercise_key
-            version["mtime"] = t
+        self._check_fields(f, self._untagged_keys(data), ["title", "view_type"])
+        self._check_container(f, data)
+        data = self._process_exercise_data(course_root, data,
+            {"key": exercise_key, "mtime": t})
 
         course_root["exercises"][exercise_key] = exercise_root = {
             "file": f,
             "mtime": t,
+            "sources": sources,
             "ptime": time.time(),
             "data": data
         }
+        self._stamp(exercise_root, generation)
+        self._count(course_key, "reloads")
         return exercise_root
 
 
+    def _generation(self, course_key):
+        '''
+        Gets the course generation number when generation checks are enabled.
+        The number is read from the file at most once per revalidate interval.
+
+        @type course_key: C{str}
+        @param course_key: a course key
+        @rtype: C{int}
+        @return: the course generation or None if generation checks are disabled
+        '''
+        if not settings.CONFIG_GENERATION_CHECK:
+            return None
+        now = time.time()
+        generation, read_time = self._generations.get(course_key, (None, 0))
+        if generation is None or now - read_time >= settings.CONFIG_REVALIDATE_INTERVAL:
+            generation = read_generation(course_key)
+            self._generations[course_key] = (generation, now)
+        return generation
+
+
+    def _is_fresh(self, key, root, generation):
+        '''
+        Checks if a cached course or exercise root is up to date. A root
+        watched for file changes is always up to date. Otherwise, the source
+        file modification times are only checked when the course generation
+        has changed or, without generation checks, once per revalidate
+        interval. Watching starts when the files are checked.
+
+        @type key: C{tuple}
+        @param key: a course key and an exercise key or None for the course
+        @type root: C{dict}
+        @param root: a course or exercise root dictionary
+        @type generation: C{int}
+        @param generation: the current course generation or None
+        @rtype: C{bool}
+        @return: True if the cached root can be used
+        '''
+        course_key = key[0]
+        watcher = self._get_watcher()
+        if watcher is not None and watcher.watching(key):
+            trusted = True
+        elif generation is not None:
+            trusted = root["generation"] == generation
+        else:
+            trusted = time.time() - root["checked"] < settings.CONFIG_REVALIDATE_INTERVAL
+        if not trusted:
+            self._count(course_key, "revalidations")
+            sources = root.get("sources") or { root["file"]: root["mtime"] }
+            if watcher is not None:
+                watcher.watch(key, sources)
+            if not sources_fresh(sources):
+                if watcher is not None:
+                    watcher.forget(key)
+                return False
+            self._stamp(root, generation)
+        self._count(course_key, "hits")
+        return True
+
+
+    def _drop_course(self, course_key):
+        '''
+        Removes a course and its exercises from the cache.
+
+        @type course_key: C{str}
+        @param course_key: a course key
+        '''
+        course_root = self._courses.pop(course_key, None)
+        watcher = self._get_watcher()
+        if course_root is not None and watcher is not None:
+            watcher.forget((course_key, None))
+            for exercise_key in course_root["exercises"]:
+                watcher.forget((course_key, exercise_key))
+
+
+    def _get_watcher(self):
+        '''
+        Gets the file watcher of this process when file watching is enabled.
+        Forked processes create their own watcher.
+
+        @rtype: C{FileWatcher}
+        @return: the file watcher or None
+        '''
+        if not self._watch_files or not settings.CONFIG_WATCH_FILES:
+            return None
+        pid = os.getpid()
+        if self._watcher_pid != pid:
+            self._watcher_pid = pid
+            if self._watcher is not None:
+                self._watcher.close()
+            try:
+                self._watcher = FileWatcher()
+            except OSError as e:
+                LOGGER.warning("Falling back to polling course files: %s", e)
+                self._watcher = None
+        return self._watcher
+
+
+    def _apply_file_changes(self):
+        '''
+        Drops the cached roots that depend on changed files.
+
+        @rtype: C{FileWatcher}
+        @return: the file watcher or None
+        '''
+        watcher = self._get_watcher()
+        if watcher is None:
+            return None
+        changed, overflow = watcher.changes()
+        if overflow:
+            LOGGER.warning("Lost course file events, checking all files.")
+            watcher.forget_all()
+            self._dir_mtime = 0
+            return watcher
+        for course_key, exercise_key in changed:
+            if course_key is None:
+                self._dir_mtime = 0
+            elif exercise_key is None:
+                LOGGER.debug('Course "%s" changed', course_key)
+                self._drop_course(course_key)
+                self._count(course_key, "invalidations")
+            else:
+                LOGGER.debug('Exercise "%s/%s" changed', course_key, exercise_key)
+                course_root = self._courses.get(course_key)
+                if course_root is not None and exercise_key in course_root["exercises"]:
+                    del course_root["exercises"][exercise_key]
+                self._count(course_key, "invalidations")
+        return watcher
+
+
+    def _stamp(self, root, generation):
+        '''
+        Marks a course or exercise root validated against its files.
+
+        @type root: C{dict}
+        @param root: a course or exercise root dictionary
+        @type generation: C{int}
+        @param generation: the course generation read before the validation
+        '''
+        root["checked"] = time.time()
+        root["generation"] = generation
+
+
+    def _count(self, course_key, counter):
+        '''
+        Increments a per course cache counter.
+
+        @type course_key: C{str}
+        @param course_key: a course key
+        @type counter: C{str}
+        @param counter: hits, revalidations, reloads or invalidations
+        '''
+        stats = self._stats.get(course_key)
+        if stats is None:
+            self._stats[course_key] = stats = {
+                "hits": 0,
+                "revalidations": 0,
+                "reloads": 0,
+                "invalidations": 0,
+            }
+        stats[counter] += 1
+
+
+    def stats(self):
+        '''
+        Gets the configuration cache counters of this process.
+
+        @rtype: C{dict}
+        @return: course keys mapped to hit, revalidation, reload and invalidation counts
+        '''
+        return {
+            course_key: stats.copy()
+            for course_key, stats in self._stats.items()
+        }
+
+
     def _check_fields(self, file_name, data, field_names):
         '''
         Verifies that a given dict contains a set of keys.
@@ -341,6 +752,35 @@ class ConfigParser:
                 raise ConfigError('Required field "%s" missing from "%s"' % (name, file_name))
 
 
+    def _check_container(self, file_name, data):
+        '''
+        Verifies the container priority of an exercise, which is used only
+        when a submission is graded.
+
+        @type file_name: C{str}
+        @param file_name: a file name for targeted error message
+        @type data: C{dict}
+        @param data: an exercise configuration
+        '''
+        container = data.get("container")
+        if not isinstance(container, dict):
+            return
+        for k, v in container.items():
+            m = self.PROCESSOR_TAG_REGEX.match(k)
+            values = [v]
+            while m:
+                k, tag = m.groups()
+                if tag == 'i18n' and isinstance(v, dict):
+                    values = list(v.values())
+                m = self.PROCESSOR_TAG_REGEX.match(k)
+            if k != "priority":
+                continue
+            for value in values:
+                if str(value).lower() not in self.CONTAINER_PRIORITIES:
+                    raise ConfigError('Invalid container priority "%s" in "%s"'
+                        % (value, file_name))
+
+
     def _conf_dir(self, directory, course_key, meta):
         '''
         Gets configuration directory for the course.
@@ -435,6 +875,9 @@ class ConfigParser:
 
             include_file = self._get_config(os.path.join(course_dir, include_data["file"]))
             loader = self.FORMATS[os.path.splitext(include_file)[1][1:]]
+            included = getattr(self._loading, 'included', None)
+            if included is not None:
+                included[include_file] = os.path.getmtime(include_file)
 
             if "template_context" in include_data:
                 # Load new data from rendered include file string
@@ -448,7 +891,7 @@ class ConfigParser:
                 new_data = loader(rendered)
             else:
                 # Load new data directly from the include file
-                new_data = loader(include_file)
+                new_data = self._parse(include_file, loader)
 
             if "force" in include_data and include_data["force"]:
                 return_data.update(new_data)
@@ -489,21 +932,68 @@ class ConfigParser:
         return config_file, os.path.getmtime(config_file), data
 
 
-    def _process_exercise_data(self, course_root, data):
+    def _untagged_keys(self, data):
+        '''
+        Gets the keys of a dictionary without the processor tags.
+
+        @type data: C{dict}
+        @param data: a config data dictionary
+        @rtype: C{set}
+        @return: the keys without processor tags
+        '''
+        keys = set()
+        for k in data.keys():
+            m = self.PROCESSOR_TAG_REGEX.match(k)
+            while m:
+                k = m.group(1)
+                m = self.PROCESSOR_TAG_REGEX.match(k)
+            keys.add(k)
+        return keys
+
+
+    def _process_exercise_data(self, course_root, data, fields=None):
         '''
         Processes a data dictionary according to embedded processor flags
         and creates a data dict version for each language intercepted.
+        The language versions are created on the first access, so the tags
+        and the i18n dictionaries are checked here, and the errors of the
+        processors only when a version is created (see load_courses).
 
         @type course_root: C{dict}
         @param course_root: a course root dictionary
         @type data: C{dict}
-        @param data: a config data dictionary to process (in-place)
+        @param data: a config data dictionary to process
+        @type fields: C{dict}
+        @param fields: values to add to each language version
+        @rtype: C{LazyDict}
+        @return: language codes mapped to the processed data
         '''
         default_lang = course_root['lang']
         lang_keys = set()
-        tags_processed = []
 
-        def recursion(n, lang, collect_lang=False):
+        def collect(n):
+            t = type(n)
+            if t == dict:
+                for k, v in n.items():
+                    m = self.PROCESSOR_TAG_REGEX.match(k)
+                    raw = True
+                    while m:
+                        k, tag = m.groups()
+                        if tag not in self.TAG_PROCESSOR_DICT:
+                            raise ConfigError('Unsupported processor tag "%s"' % (tag))
+                        if tag == 'i18n' and type(v) == dict:
+                            lang_keys.update(v.keys())
+                        elif tag == 'i18n' and raw:
+                            # Checked here, as the versions are built later.
+                            raise ConfigError('The value of "%s|i18n" is not a dictionary' % (k))
+                        raw = False
+                        m = self.PROCESSOR_TAG_REGEX.match(k)
+                    collect(v)
+            elif t == list:
+                for v in n:
+                    collect(v)
+
+        def recursion(n, lang):
             t = type(n)
             if t == dict:
                 d = {}
@@ -512,30 +1002,42 @@ class ConfigParser:
                     m = self.PROCESSOR_TAG_REGEX.match(k)
                     while m:
                         k, tag = m.groups()
-                        tags_processed.append(tag)
-                        if collect_lang and tag == 'i18n' and type(v) == dict:
-                            lang_keys.update(v.keys())
-                        if tag not in self.TAG_PROCESSOR_DICT:
-                            raise ConfigError('Unsupported processor tag "%s"' % (tag))
                         v = self.TAG_PROCESSOR_DICT[tag](d, n, v, lang=lang)
                         m = self.PROCESSOR_TAG_REGEX.match(k)
-                    d[k] = recursion(v, lang, collect_lang)
+                    d[k] = recursion(v, lang)
                 return d
             elif t == list:
-                return [recursion(v, lang, collect_lang) for v in n]
+                return [recursion(v, lang) for v in n]
             else:
                 return n
 
-        default = recursion(data, default_lang, True)
-        default['lang'] = default_lang
-        root = { default_lang: default }
-        for lang in (lang_keys - set([default_lang])):
+        def version(lang):
             config = recursion(data, lang)
             config['lang'] = lang
-            root[lang] = config
+            if fields:
+                config.update(fields)
+            LOGGER.debug('Processed language version "%s".', lang)
+            return config
 
-        LOGGER.debug('Processed %d tags.', len(tags_processed))
-        return root
+        collect(data)
+        langs = [default_lang] + sorted(lang_keys - set([default_lang]))
+        return LazyDict(langs, version)
+
+
+def _load_course_files(course_key):
+    '''
+    Loads a course and all of its exercises in a worker process.
+
+    @type course_key: C{str}
+    @param course_key: a course key
+    @rtype: C{tuple}
+    @return: course key, picklable course root or None, list of error messages
+    '''
+    parser = ConfigParser(use_snapshots=False, watch_files=False)
+    course_root, errors = parser._load_course_files(course_key)
+    if course_root is not None:
+        del course_root["exercise_loader"]
+    return course_key, course_root, errors
 
 
 # An object that holds on to the latest exercise configuration.
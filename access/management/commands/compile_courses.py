@@ -0,0 +1,48 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from access.config import ConfigError, ConfigParser, DIR
+from access.snapshot import bump_generation
+from util import export
+
+class Command(BaseCommand):
+    help = "Compiles course configurations to snapshots loaded by the grader processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("course_key", nargs='*',
+                help="Course keys to compile. By default all courses are compiled.")
+
+    def handle(self, *args, **options):
+        # Always parse the configuration files instead of old snapshots.
+        config = ConfigParser(use_snapshots=False)
+        course_keys = options["course_key"] or sorted(os.listdir(DIR))
+
+        failed = []
+        for course_key in course_keys:
+            try:
+                path = config.compile_snapshot(course_key)
+            except ConfigError as e:
+                self.stderr.write("Failed to compile %s: %s" % (course_key, e))
+                failed.append(course_key)
+                path = None
+            else:
+                if path is None:
+                    if options["course_key"]:
+                        self.stderr.write("Course not found for key: %s" % (course_key))
+                        failed.append(course_key)
+                    continue
+                self.stdout.write("Compiled %s to %s" % (course_key, path))
+                self.prewarm(config, course_key)
+
+            # Signal the grader processes to revalidate the course files.
+            generation = bump_generation(course_key)
+            self.stdout.write("Generation of %s is %d" % (course_key, generation))
+
+        if failed:
+            raise CommandError("Failed to compile: %s" % (", ".join(failed)))
+
+    def prewarm(self, config, course_key):
+        course = config.course_entry(course_key)
+        for base_url in settings.APLUS_JSON_PREWARM_URLS:
+            export.cached_course_json(export.BaseUrlRequest(base_url), config, course)
+            self.stdout.write("Exported %s for %s" % (course_key, base_url))
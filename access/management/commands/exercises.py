@@ -1,12 +1,50 @@
+import os
+import re
 from django.core.management.base import BaseCommand, CommandError
 from access.views import config
+from util.regex import backtracking_risk
+import access.config
+
+
+def regex_patterns(exercise):
+    '''
+    Lists the regular expressions of an exercise configuration: questionnaire
+    answers and feedback compared as regexps, and submission field patterns.
+    '''
+    for group in exercise.get("fieldgroups", ()):
+        for field in group.get("fields", ()):
+            if "regex" in field:
+                yield field["regex"]
+            elif field.get("compare_method", "").split("-")[0] == "regexp" and "correct" in field:
+                yield field["correct"]
+            for fb in field.get("feedback", ()):
+                if fb.get("compare_regexp", False) and fb.get("value"):
+                    yield fb["value"]
+    for field in exercise.get("fields", ()):
+        if field.get("pattern"):
+            yield field["pattern"]
+
 
 class Command(BaseCommand):
     args = "<course_key</exercise_key>>"
     help = "Tests configuration files syntax."
 
+    def add_arguments(self, parser):
+        parser.add_argument("--jobs", "-j", type=int, default=1, dest="jobs",
+                help="Number of parallel processes used to parse the courses")
+
     def handle(self, *args, **options):
 
+        # Parse courses, in parallel with more jobs, and every language
+        # version of the exercises.
+        if len(args) == 0 or "/" not in args[0]:
+            course_keys = [args[0]] if len(args) > 0 else os.listdir(access.config.DIR)
+            errors = config.load_courses(course_keys, options["jobs"])
+            if errors:
+                for error in errors:
+                    self.stderr.write("Configuration error in %s" % (error))
+                raise CommandError("%d configuration errors found." % (len(errors)))
+
         # Check by arguments.
         if len(args) > 0:
             if "/" in args[0]:
@@ -24,11 +62,13 @@ class Command(BaseCommand):
                 if exercise is None:
                     raise CommandError("Exercise not found for key: %s/%s" % (course_key, exercise_key))
                 self.stdout.write("Configuration syntax ok for: %s/%s" % (course_key, exercise_key))
+                self.check_patterns(course_key, exercise)
 
             else:
                 (_course, exercises) = config.exercises(course_key)
                 for exercise in exercises:
                     self.stdout.write("Configuration syntax ok for: %s/%s" % (course_key, exercise["key"]))
+                    self.check_patterns(course_key, exercise)
 
         # Check all.
         else:
@@ -37,3 +77,16 @@ class Command(BaseCommand):
                 (_course, exercises) = config.exercises(course["key"])
                 for exercise in exercises:
                     self.stdout.write("Configuration syntax ok for: %s/%s" % (course["key"], exercise["key"]))
+                    self.check_patterns(course["key"], exercise)
+
+    def check_patterns(self, course_key, exercise):
+        for pattern in regex_patterns(exercise):
+            try:
+                risk = backtracking_risk(str(pattern))
+            except re.error as e:
+                self.stderr.write("Invalid regular expression in %s/%s: %r: %s"
+                    % (course_key, exercise["key"], pattern, e))
+                continue
+            if risk:
+                self.stderr.write("Regular expression in %s/%s may backtrack catastrophically: %r: %s"
+                    % (course_key, exercise["key"], pattern, risk))
@@ -0,0 +1,76 @@
+import json
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from access.config import ConfigError
+from access.views import config
+from access.types.forms import BulkGrader
+from access.types.stdsync import pointsInRange
+
+
+class Command(BaseCommand):
+    help = ("Grades stored questionnaire answers in bulk. Reads JSON lines like "
+        "{\"id\": 1, \"answers\": {\"field_0\": \"option_1\"}} and writes a JSON line "
+        "of points and feedback for each.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("exercise", help="Exercise as course_key/exercise_key")
+        parser.add_argument("answers", help="JSON lines file of the answers, - for standard input")
+        parser.add_argument("--output", "-o", default="-",
+                help="JSON lines file for the results, standard output by default")
+        parser.add_argument("--lang", default=None,
+                help="Language of the exercise configuration")
+
+    def handle(self, *args, **options):
+        if "/" not in options["exercise"]:
+            raise CommandError("Exercise must be given as course_key/exercise_key")
+        course_key, exercise_key = options["exercise"].split("/", 1)
+        (course, exercise) = config.exercise_entry(course_key, exercise_key, lang=options["lang"])
+        if course is None or exercise is None:
+            raise CommandError("Exercise not found for key: %s/%s" % (course_key, exercise_key))
+        if "fieldgroups" not in exercise:
+            raise CommandError("Exercise %s/%s is not a questionnaire" % (course_key, exercise_key))
+        try:
+            grader = BulkGrader(exercise)
+        except ConfigError as e:
+            raise CommandError(str(e))
+        max_points = exercise.get("max_points", 0)
+
+        source = sys.stdin if options["answers"] == "-" else open(options["answers"], "r")
+        target = self.stdout if options["output"] == "-" else open(options["output"], "w")
+        start = time.time()
+        count = 0
+        try:
+            for line in source:
+                if not line.strip():
+                    continue
+                submission = json.loads(line)
+                answers = submission.get("answers", submission)
+                points, error_groups, error_fields, hints, errors = grader.grade(answers)
+                result = { "id": submission.get("id") }
+                if errors:
+                    # The form would reject the answers without grading.
+                    result["rejected"] = True
+                    result["errors"] = errors
+                else:
+                    # As in access.types.stdsync.createForm.
+                    points = pointsInRange(points, max_points)
+                    if points == 0 and not error_fields:
+                        points = max_points
+                    result.update({
+                        "points": points,
+                        "max_points": max_points,
+                        "error_groups": error_groups,
+                        "error_fields": error_fields,
+                        "feedback": hints,
+                    })
+                target.write(json.dumps(result) + "\n")
+                count += 1
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if target is not self.stdout:
+                target.close()
+
+        self.stderr.write("Graded %d submissions with %d distinct field answers in %.1f s"
+            % (count, grader.graded, time.time() - start))
@@ -0,0 +1,299 @@
+'''
+Compiled course configuration snapshots.
+
+A snapshot is a binary file holding a parsed course: the course root and
+every exercise root with all language versions and processed tags. It also
+records the modification times of the course source files, so that a stale
+snapshot can be detected and ignored. Exercise roots carry their own file
+modification times and are validated one by one as usual.
+
+File layout:
+
+    header (magic, format version, index length)
+    pickled index: course root, course source mtimes and exercise blob offsets
+    pickled exercise roots, one blob each
+
+Each exercise is a separate blob, so the file can be memory mapped and the
+exercises unpickled on demand. The mapped pages are shared by all processes.
+
+The same directory holds a generation number file per course. It is bumped
+whenever the course is updated and tells the grader processes to check the
+cached configuration against the files.
+
+'''
+from collections.abc import MutableMapping
+from django.conf import settings
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+
+from util.cache import InProcessCache
+
+
+MAGIC = b'MGCS'
+VERSION = 2
+HEADER = struct.Struct('!4sHQ')
+SUFFIX = '.snapshot'
+
+
+def snapshot_path(course_key):
+    '''
+    Returns the path of the snapshot file for a course.
+
+    @type course_key: C{str}
+    @param course_key: a course key
+    @rtype: C{str}
+    @return: path to the snapshot file
+    '''
+    return os.path.join(settings.COMPILED_COURSES_PATH, course_key + SUFFIX)
+
+
+def generation_path(course_key):
+    '''
+    Returns the path of the generation number file for a course.
+
+    @type course_key: C{str}
+    @param course_key: a course key
+    @rtype: C{str}
+    @return: path to the generation file
+    '''
+    return os.path.join(settings.COMPILED_COURSES_PATH, course_key + '.generation')
+
+
+def read_generation(course_key):
+    '''
+    Reads the course generation number, which is bumped on course updates.
+
+    @type course_key: C{str}
+    @param course_key: a course key
+    @rtype: C{int}
+    @return: the generation number, 0 if never bumped
+    '''
+    try:
+        with open(generation_path(course_key), 'r') as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def bump_generation(course_key):
+    '''
+    Increments the course generation number to signal the grader processes
+    that the course configuration files must be revalidated.
+
+    @type course_key: C{str}
+    @param course_key: a course key
+    @rtype: C{int}
+    @return: the new generation number
+    '''
+    generation = read_generation(course_key) + 1
+    path = generation_path(course_key)
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(str(generation))
+    os.replace(tmp_path, path)
+    return generation
+
+
+def course_sources(course_root):
+    '''
+    Collects the source files that a course index was parsed from.
+
+    @type course_root: C{dict}
+    @param course_root: a course root dictionary
+    @rtype: C{dict}
+    @return: source file paths mapped to their modification times
+    '''
+    return { course_root["file"]: course_root["mtime"] }
+
+
+def sources_fresh(sources):
+    '''
+    Checks that none of the source files has been modified or removed.
+
+    @type sources: C{dict}
+    @param sources: source file paths mapped to their modification times
+    @rtype: C{bool}
+    @return: True if the recorded times are up to date
+    '''
+    try:
+        for path, mtime in sources.items():
+            if mtime < os.path.getmtime(path):
+                return False
+    except OSError:
+        return False
+    return True
+
+
+def write_snapshot(path, course_root):
+    '''
+    Writes a course root and its loaded exercise roots to a snapshot file.
+    The file is replaced atomically so that readers never see a partial file.
+
+    @type path: C{str}
+    @param path: a path to the snapshot file
+    @type course_root: C{dict}
+    @param course_root: a course root dictionary with all exercises loaded
+    '''
+    course = {
+        k: v for k, v in course_root.items()
+        if k not in ("exercise_loader", "exercises")
+    }
+    blobs = []
+    offsets = {}
+    position = 0
+    for exercise_key, exercise_root in course_root["exercises"].items():
+        blob = pickle.dumps(exercise_root, pickle.HIGHEST_PROTOCOL)
+        offsets[exercise_key] = (position, len(blob))
+        position += len(blob)
+        blobs.append(blob)
+    index = pickle.dumps({
+        "course": course,
+        "sources": course_sources(course_root),
+        "exercises": offsets,
+    }, pickle.HIGHEST_PROTOCOL)
+
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(index)))
+            f.write(index)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+class SnapshotFile:
+    '''
+    A memory mapped snapshot file.
+    '''
+
+    def __init__(self, path):
+        '''
+        Maps a snapshot file and reads its index.
+
+        @type path: C{str}
+        @param path: a path to the snapshot file
+        @raises ValueError: if the file has an unknown format
+        @raises OSError: if the file can not be mapped
+        '''
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError("Truncated snapshot %s" % (path))
+        magic, version, length = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Unknown snapshot format in %s" % (path))
+        self._base = HEADER.size + length
+        index = pickle.loads(self._map[HEADER.size:self._base])
+        self.course = index["course"]
+        self.sources = index["sources"]
+        self._offsets = index["exercises"]
+
+    def exercise_keys(self):
+        return self._offsets.keys()
+
+    def exercise(self, exercise_key):
+        '''
+        Unpickles an exercise root.
+
+        @type exercise_key: C{str}
+        @param exercise_key: an exercise key
+        @rtype: C{dict}
+        @return: a new exercise root
+        @raises KeyError: if the exercise is not in the snapshot
+        '''
+        offset, size = self._offsets[exercise_key]
+        start = self._base + offset
+        return pickle.loads(self._map[start:start + size])
+
+
+class SnapshotExercises(MutableMapping):
+    '''
+    Exercise roots of a course backed by a memory mapped snapshot. Roots are
+    unpickled on access and only a limited number of them is kept in memory.
+    Roots stored to the mapping, i.e. reloaded from the files, override the
+    snapshot.
+    '''
+
+    def __init__(self, snapshot, limit, prepare=None):
+        '''
+        @type snapshot: C{SnapshotFile}
+        @param snapshot: a mapped snapshot
+        @type limit: C{int}
+        @param limit: number of unpickled roots to keep in memory
+        @type prepare: C{function}
+        @param prepare: a function called for each unpickled root
+        '''
+        self._snapshot = snapshot
+        self._loaded = InProcessCache(limit=limit)
+        self._overrides = {}
+        self._removed = set()
+        self._prepare = prepare
+
+    def __getitem__(self, exercise_key):
+        if exercise_key in self._overrides:
+            return self._overrides[exercise_key]
+        if exercise_key in self._removed:
+            raise KeyError(exercise_key)
+        root = self._loaded.get(exercise_key)
+        if root is None:
+            root = self._snapshot.exercise(exercise_key)
+            if self._prepare is not None:
+                self._prepare(root)
+            self._loaded[exercise_key] = root
+        return root
+
+    def __setitem__(self, exercise_key, root):
+        self._overrides[exercise_key] = root
+        self._loaded.pop(exercise_key, None)
+
+    def __delitem__(self, exercise_key):
+        if exercise_key not in self:
+            raise KeyError(exercise_key)
+        self._overrides.pop(exercise_key, None)
+        self._loaded.pop(exercise_key, None)
+        self._removed.add(exercise_key)
+
+    def __contains__(self, exercise_key):
+        return exercise_key in self._overrides or (
+            exercise_key not in self._removed
+            and exercise_key in self._snapshot.exercise_keys()
+        )
+
+    def __iter__(self):
+        for exercise_key in self._snapshot.exercise_keys():
+            if exercise_key not in self._overrides and exercise_key not in self._removed:
+                yield exercise_key
+        for exercise_key in self._overrides:
+            yield exercise_key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def open_snapshot(path):
+    '''
+    Maps a snapshot file.
+
+    @type path: C{str}
+    @param path: a path to the snapshot file
+    @rtype: C{SnapshotFile}
+    @return: the mapped snapshot or None if the file is missing or has an unknown format
+    '''
+    try:
+        return SnapshotFile(path)
+    except (OSError, ValueError):
+        return None
+
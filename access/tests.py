@@ -2,14 +2,15 @@
 '''
 This module holds unit tests. It has nothing to do with the grader tests.
 '''
-import time, os
+import time, os, tempfile, shutil
 from django.conf import settings
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from access.config import ConfigParser
 from util.shell import invoke_script
 
 
+@override_settings(RST_CACHE_PATH=None)
 class ConfigTestCase(TestCase):
 
     TEST_DATA = {
@@ -36,6 +37,43 @@ class ConfigTestCase(TestCase):
         from access.config import get_rst_as_html
         self.assertEqual(get_rst_as_html('A **foobar**.'), '<p>A <strong>foobar</strong>.</p>\n')
 
+    def test_rst_cache(self):
+        from util.dict import get_rst_as_html, _rst_to_html
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        with override_settings(RST_CACHE_PATH=tmp, RST_CACHE_SIZE=100):
+            _rst_to_html.cache_clear()
+            html = get_rst_as_html('A **cached** fragment.')
+            entries = [os.path.join(d, f) for d, _, files in os.walk(tmp) for f in files]
+            self.assertEqual(len(entries), 1)
+
+            # Other processes read the fragment from the file.
+            with open(entries[0], 'w') as f:
+                f.write('<p>from cache</p>')
+            _rst_to_html.cache_clear()
+            self.assertEqual(get_rst_as_html('A **cached** fragment.'), '<p>from cache</p>')
+            self.assertNotEqual(html, '<p>from cache</p>')
+
+            # The least recently used fragments are evicted.
+            for i in range(10):
+                get_rst_as_html('Fragment number %d.' % (i))
+            from util.dict import _get_rst_cache
+            _get_rst_cache().prune()
+            sizes = [os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(tmp) for f in files]
+            self.assertLessEqual(sum(sizes), 100)
+            _rst_to_html.cache_clear()
+
+            # A changed included file is rendered again.
+            included = os.path.join(tmp, 'included.rst')
+            source = 'Text\n\n.. include:: %s\n' % (included)
+            with open(included, 'w') as f:
+                f.write('First version.\n')
+            self.assertIn('First version.', get_rst_as_html(source))
+            with open(included, 'w') as f:
+                f.write('Second version.\n')
+            self.assertIn('Second version.', get_rst_as_html(source))
+            _rst_to_html.cache_clear()
+
     def test_parsing(self):
         course_root = {'lang': 'en'}
         data = self.config._process_exercise_data(course_root, self.TEST_DATA)
@@ -45,6 +83,48 @@ class ConfigTestCase(TestCase):
         self.assertEqual(data["fi"]["title"], "Eräs otsikko")
         self.assertEqual(data["fi"]["nested"]["number"], 2)
 
+    def test_lazy_languages(self):
+        import pickle
+        data = self.config._process_exercise_data({'lang': 'en'}, self.TEST_DATA, {'key': 'x'})
+        self.assertEqual(sorted(data), ["en", "fi"])
+        self.assertEqual(data["fi"]["key"], "x")
+        self.assertEqual(list(data._values), ["fi"])
+        self.assertEqual(pickle.loads(pickle.dumps(data))["en"]["title"], "A Title")
+
+        # Bad i18n values are found before the versions are created.
+        from access.config import ConfigError
+        with self.assertRaises(ConfigError):
+            self.config._process_exercise_data({'lang': 'en'}, {'title|i18n': 'Title'})
+
+    def test_container_priority(self):
+        from access.config import ConfigError
+        self.config._check_container('x.yaml', {'container': {'priority': 'high'}})
+        self.config._check_container('x.yaml',
+            {'container': {'priority|i18n': {'en': 'low', 'fi': 'normal'}}})
+        with self.assertRaises(ConfigError):
+            self.config._check_container('x.yaml', {'container': {'priority': 'urgent'}})
+        with self.assertRaises(ConfigError):
+            self.config._check_container('x.yaml',
+                {'container': {'priority|i18n': {'en': 'low', 'fi': 'urgent'}}})
+
+    def test_lazy_languages_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from util.dict import LazyDict
+
+        calls = []
+
+        def factory(key):
+            calls.append(key)
+            time.sleep(0.01)
+            return key * 2
+
+        # Each value is created once, also by concurrent threads.
+        data = LazyDict(['a', 'b'], factory)
+        with ThreadPoolExecutor(4) as pool:
+            values = list(pool.map(data.__getitem__, ['a', 'b', 'a', 'b']))
+        self.assertEqual(values, ['aa', 'bb', 'aa', 'bb'])
+        self.assertEqual(sorted(calls), ['a', 'b'])
+
     def test_cache(self):
         course_key = self.get_course_key()
 
@@ -73,3 +153,464 @@ class ConfigTestCase(TestCase):
         self.assertGreater(root["mtime"], mtime)
         self.assertGreater(root["ptime"], ptime)
 
+    def test_snapshot(self):
+        course_key = self.get_course_key()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+
+        with override_settings(COMPILED_COURSES_PATH=tmp):
+            ConfigParser(use_snapshots=False).compile_snapshot(course_key)
+
+            # Exercises are loaded together with the course.
+            config = ConfigParser()
+            root = config._course_root(course_key)
+            self.assertIn("arithmetic", root["exercises"])
+            _, exercise = config.exercise_entry(course_key, "hello_python", lang="fi")
+            self.assertEqual(exercise["title"], "Hei Python!")
+            self.assertEqual(config.stats()[course_key]["reloads"], 1)
+
+            # Modified exercise is parsed from the file.
+            time.sleep(0.01)
+            os.utime(root["exercises"]["arithmetic"]["file"])
+            config = ConfigParser()
+            config.exercise_entry(course_key, "hello_python")
+            config.exercise_entry(course_key, "arithmetic")
+            self.assertEqual(config.stats()[course_key]["reloads"], 2)
+
+            # Stale snapshot is ignored.
+            os.utime(root["file"])
+            root = ConfigParser()._course_root(course_key)
+            self.assertEqual(root["exercises"], {})
+
+    def test_shared_snapshot(self):
+        course_key = self.get_course_key()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+
+        with override_settings(COMPILED_COURSES_PATH=tmp,
+                CONFIG_SHARED_SNAPSHOTS=True, CONFIG_SHARED_CACHE_SIZE=1):
+            ConfigParser(use_snapshots=False).compile_snapshot(course_key)
+            config = ConfigParser()
+            _, exercises = config.exercises(course_key)
+            self.assertEqual([e["key"] for e in exercises], ["arithmetic", "hello_python"])
+
+            # Only a limited number of exercises is kept unpickled.
+            exercises = config._course_root(course_key)["exercises"]
+            self.assertEqual(len(exercises._loaded), 1)
+            self.assertEqual(sorted(exercises), ["arithmetic", "hello_python"])
+
+    def test_revalidate_interval(self):
+        course_key = self.get_course_key()
+        root = self.config._course_root(course_key)
+        stats = self.config.stats()[course_key]
+
+        with override_settings(CONFIG_REVALIDATE_INTERVAL=3600):
+            time.sleep(0.01)
+            os.utime(root["file"])
+            self.assertIs(self.config._course_root(course_key), root)
+        self.assertEqual(self.config.stats()[course_key]["reloads"], stats["reloads"])
+        self.assertEqual(self.config.stats()[course_key]["revalidations"], stats["revalidations"])
+
+        # Without the interval, the modification is noticed.
+        self.assertIsNot(self.config._course_root(course_key), root)
+        self.assertEqual(self.config.stats()[course_key]["reloads"], stats["reloads"] + 1)
+
+    def test_config_stats(self):
+        self.assertEqual(self.client.get('/config-stats').status_code, 404)
+        with self.settings(DEBUG=True):
+            response = self.client.get('/config-stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["pid"], os.getpid())
+
+    def test_generation_check(self):
+        from access.snapshot import bump_generation
+        course_key = self.get_course_key()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+
+        with override_settings(COMPILED_COURSES_PATH=tmp, CONFIG_GENERATION_CHECK=True):
+            config = ConfigParser()
+            root = config._course_root(course_key)
+            time.sleep(0.01)
+            os.utime(root["file"])
+            self.assertIs(config._course_root(course_key), root)
+            self.assertEqual(config.stats()[course_key]["revalidations"], 0)
+
+            bump_generation(course_key)
+            self.assertIsNot(config._course_root(course_key), root)
+            self.assertEqual(config.stats()[course_key]["revalidations"], 1)
+
+    def write_include_course(self):
+        import access
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        access.config.DIR = tmp
+        os.mkdir(os.path.join(tmp, 'inc'))
+        files = {
+            'index.yaml': 'name: Include\nmodules:\n  - key: m\n    children:\n'
+                '      - key: ex\n        config: ex.yaml\n',
+            'ex.yaml': 'title: Exercise\ninclude:\n  - file: common.yaml\n',
+            'common.yaml': 'view_type: access.types.stdsync.createForm\nmax_points: 1\n',
+        }
+        for name, content in files.items():
+            with open(os.path.join(tmp, 'inc', name), 'w') as f:
+                f.write(content)
+        return os.path.join(tmp, 'inc', 'common.yaml')
+
+    def check_include_reload(self, config):
+        common = self.write_include_course()
+        _, exercise = config.exercise_entry('inc', 'ex')
+        self.assertEqual(exercise["max_points"], 1)
+        config.exercise_entry('inc', 'ex')
+        with open(common, 'w') as f:
+            f.write('view_type: access.types.stdsync.createForm\nmax_points: 2\n')
+        os.utime(common, (time.time() + 1, time.time() + 1))
+        _, exercise = config.exercise_entry('inc', 'ex')
+        self.assertEqual(exercise["max_points"], 2)
+        return config.stats()['inc']
+
+    def test_include_reload(self):
+        stats = self.check_include_reload(ConfigParser())
+        self.assertEqual(stats["reloads"], 3)
+
+    def test_watch_files(self):
+        from access.watcher import FileWatcher
+        try:
+            FileWatcher().close()
+        except OSError:
+            self.skipTest("inotify is not available")
+        with override_settings(CONFIG_WATCH_FILES=True):
+            config = ConfigParser()
+            stats = self.check_include_reload(config)
+            self.assertEqual(stats["reloads"], 3)
+            self.assertEqual(stats["invalidations"], 1)
+
+            # The reloaded exercise is checked once and then watched.
+            revalidations = stats["revalidations"]
+            config.exercise_entry('inc', 'ex')
+            self.assertEqual(config.stats()['inc']["revalidations"], revalidations + 1)
+            config.exercise_entry('inc', 'ex')
+            self.assertEqual(config.stats()['inc']["revalidations"], revalidations + 1)
+
+    def test_load_courses(self):
+        common = self.write_include_course()
+        bad = os.path.join(os.path.dirname(os.path.dirname(common)), 'bad')
+        shutil.copytree(os.path.dirname(common), bad)
+        with open(os.path.join(bad, 'ex.yaml'), 'w') as f:
+            f.write('title: Broken\n')
+
+        config = ConfigParser()
+        errors = config.load_courses(['inc', 'bad', 'missing'], jobs=2)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith('bad/ex: '))
+        self.assertIn('view_type', errors[0])
+        _, exercise = config.exercise_entry('inc', 'ex')
+        self.assertEqual(exercise["max_points"], 1)
+        self.assertEqual(config.stats()['inc']["reloads"], 2)
+
+        # The loaded courses are not checked again for the course list.
+        revalidations = config.stats()['inc']["revalidations"]
+        self.assertEqual(sorted(c["key"] for c in config.courses()), ['bad', 'inc'])
+        self.assertEqual(config.stats()['inc']["revalidations"], revalidations)
+
+    def test_course_list_update(self):
+        import access
+        source = access.config.DIR
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        access.config.DIR = os.path.join(tmp, 'courses')
+        for key in ('a', 'b'):
+            shutil.copytree(os.path.join(source, 'test_course'), os.path.join(tmp, 'courses', key))
+
+        with override_settings(STATIC_ROOT=tmp):
+            config = ConfigParser()
+            self.assertEqual(sorted(c["key"] for c in config.courses()), ['a', 'b'])
+            root = config._course_root('a')
+            config.exercise_entry('a', 'hello_python')
+            exercise_root = root["exercises"]["hello_python"]
+
+            # Add and remove a course.
+            shutil.copytree(os.path.join(source, 'test_course'), os.path.join(tmp, 'courses', 'c'))
+            shutil.rmtree(os.path.join(tmp, 'courses', 'b'))
+            os.utime(access.config.DIR, (time.time() + 1, time.time() + 1))
+            self.assertEqual(sorted(c["key"] for c in config.courses()), ['a', 'c'])
+
+            # The untouched course keeps its cached exercises.
+            self.assertIs(config._course_root('a'), root)
+            self.assertIs(root["exercises"]["hello_python"], exercise_root)
+            self.assertEqual(config.stats()['a']["reloads"], 2)
+
+    def test_aplus_json_etag(self):
+        from django.core.cache import cache
+        cache.clear()
+        course_key = self.get_course_key()
+        response = self.client.get('/%s/aplus-json' % (course_key))
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn("exercise_info", response.json()["modules"][0]["children"][0])
+
+        response = self.client.get('/%s/aplus-json' % (course_key), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/%s/aplus-json' % (course_key),
+            HTTP_IF_NONE_MATCH='"other", W/%s' % (etag))
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/%s/aplus-json' % (course_key), HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+
+        # The export changes with the configuration and the host.
+        response = self.client.get('/%s/aplus-json' % (course_key), HTTP_HOST='other.example.com')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_aplus_json_stream(self):
+        import json
+        from django.core.cache import cache
+        from django.core.serializers.json import DjangoJSONEncoder
+        from django.test import RequestFactory
+        from access.config import config
+        from util import export
+        course = config.course_entry(self.get_course_key())
+        request = RequestFactory().get('/')
+        self.assertEqual(
+            "".join(export.course_json_chunks(request, config, course)),
+            json.dumps(export.course_document(request, config, course), cls=DjangoJSONEncoder))
+
+        cache.clear()
+        with override_settings(APLUS_JSON_STREAM=True):
+            response = self.client.get('/%s/aplus-json' % (course["key"]))
+            content = b"".join(response.streaming_content)
+            # The second response comes from the cache.
+            response = self.client.get('/%s/aplus-json' % (course["key"]))
+            self.assertEqual(b"".join(response.streaming_content), content)
+            self.assertEqual(json.loads(content.decode('utf-8'))["name"], course["name"])
+
+
+class FormTestCase(TestCase):
+
+    EXERCISE = {
+        'key': 'form',
+        'fieldgroups': [{
+            'pick_randomly': 1,
+            'fields': [
+                {'type': 'radio', 'points': 1, 'options': [
+                    {'label': 'A', 'correct': True}, {'label': 'B'}]},
+                {'type': 'text', 'points': 1, 'correct': 'ok'},
+            ],
+        }],
+    }
+
+    def test_blueprint(self):
+        from django.test import RequestFactory
+        from access.types.forms import GradedForm
+        request = RequestFactory().get('/?uid=1')
+        form = GradedForm(None, exercise=self.EXERCISE, request=request)
+        again = GradedForm(None, exercise=self.EXERCISE, request=request)
+        self.assertIs(form.blueprint, again.blueprint)
+        self.assertEqual(len(form.fields), 1)
+        self.assertNotIn('_fields', self.EXERCISE['fieldgroups'][0])
+
+    def test_blueprint_include(self):
+        from unittest import mock
+        from django.test import RequestFactory
+        from access.types.forms import GradedForm
+        exercise = {'key': 'include', 'fieldgroups': [{'fields': [
+            {'type': 'text', 'key': 'a', 'include': 'more.html'}]}]}
+        request = RequestFactory().get('/?uid=1')
+        # An edited include template is rendered with the same blueprint.
+        with mock.patch('access.types.forms.template_to_str', side_effect=['one', 'two']):
+            form = GradedForm(None, exercise=exercise, request=request)
+            again = GradedForm(None, exercise=exercise, request=request)
+        self.assertIs(form.blueprint, again.blueprint)
+        self.assertEqual(form.fields['a'].more, 'one')
+        self.assertEqual(again.fields['a'].more, 'two')
+
+    GRADING_EXERCISE = {
+        'key': 'grading',
+        'fieldgroups': [{
+            'fields': [
+                {'type': 'radio', 'key': 'radio', 'points': 1, 'options': [
+                    {'label': 'A', 'correct': True}, {'label': 'B', 'hint': 'Not B.'}],
+                    'feedback': [{'value': 'option_1', 'label': 'Really not B.'}]},
+                {'type': 'checkbox', 'key': 'checkbox', 'points': 2, 'partial_points': True, 'options': [
+                    {'label': 'A', 'correct': True}, {'label': 'B', 'correct': True},
+                    {'label': 'C', 'hint': 'Not C.'}, {'label': 'D'}],
+                    'feedback': [{'value': 'option_3', 'label': 'D is tricky.'}]},
+                {'type': 'text', 'key': 'string', 'points': 1, 'correct': '"Hello World"',
+                    'compare_method': 'string-ignorews-ignorequotes', 'hint': 'Greet.',
+                    'feedback': [
+                        {'value': 'hello', 'label': 'Almost.'},
+                        {'value': '^h', 'compare_regexp': True, 'label': 'Starts well.'},
+                        {'value': 'x', 'not': True, 'label': 'No x.'},
+                        {'value': '%100%', 'label': 'Perfect.'}]},
+                {'type': 'text', 'key': 'requirecase', 'points': 1, 'correct': 'ABC',
+                    'compare_method': 'string-requirecase'},
+                {'type': 'text', 'key': 'repl', 'points': 1, 'correct': '[1, 2]',
+                    'compare_method': 'string-ignorerepl-ignorews'},
+                {'type': 'text', 'key': 'paren', 'points': 1, 'correct': 'f(x)',
+                    'compare_method': 'string-ignoreparenthesis'},
+                {'type': 'text', 'key': 'chars', 'points': 1, 'correct': 'abc',
+                    'compare_method': 'unsortedchars'},
+                {'type': 'text', 'key': 'int', 'points': 1, 'correct': '42',
+                    'compare_method': 'int', 'feedback': [{'value': '41', 'label': 'Off by one.'}]},
+                {'type': 'text', 'key': 'float', 'points': 1, 'correct': '3.14',
+                    'compare_method': 'float'},
+                {'type': 'text', 'key': 'regexp', 'points': 1, 'correct': '/^fo+$/',
+                    'compare_method': 'regexp'},
+                {'type': 'text', 'key': 'regex', 'points': 1, 'regex': '\\d{3}', 'hint': 'Three digits.'},
+                {'type': 'text', 'key': 'subdiff', 'points': 1, 'correct': 'kissa|koira',
+                    'compare_method': 'subdiff'},
+                {'type': 'textarea', 'key': 'lines', 'points': 1, 'correct': 'one\ntwo',
+                    'feedback': [{'value': 'one', 'label': 'One line only.'}]},
+                {'type': 'text', 'key': 'free', 'points': 1},
+            ],
+        }],
+    }
+
+    # Answers and their grading before the matchers were compiled.
+    GRADING_RESULTS = [
+        ({'radio': 'option_0', 'checkbox': ['option_0', 'option_1'], 'string': ' "hello  world" ',
+            'requirecase': 'ABC', 'repl': 'x: int = [1,2]', 'paren': 'f x', 'chars': 'cab',
+            'int': '42', 'float': '3.15', 'regexp': 'fooo', 'regex': 'a123', 'subdiff': 'koira',
+            'lines': ' One \r\n two ', 'free': 'anything'},
+            (14, ['paren'], {'string': ['Starts well.', 'No x.', 'Perfect.']})),
+        ({'radio': 'option_1', 'checkbox': ['option_0', 'option_2', 'option_3'], 'string': 'hello',
+            'requirecase': 'abc', 'repl': '[1, 3]', 'paren': 'g(x)', 'chars': 'abd', 'int': '41',
+            'float': '3.5', 'regexp': 'bar', 'regex': '12', 'subdiff': 'kisa', 'lines': 'one',
+            'free': ''},
+            (1, ['radio', 'checkbox', 'string', 'requirecase', 'repl', 'paren', 'chars', 'int',
+                'float', 'regexp', 'regex', 'subdiff', 'lines'],
+            {'radio': ['Not B.', 'Really not B.'], 'checkbox': ['Not C.', 'D is tricky.'],
+                'string': ['Greet.', 'Almost.', 'Starts well.', 'No x.'], 'int': ['Off by one.'],
+                'regex': ['Three digits.'], 'subdiff': ['Multiple correct answers accepted.',
+                'Correct parts in your answer: kis-a', 'Correct parts in your answer: k-i-a'],
+                'lines': ['One line only.']})),
+        ({'radio': 'option_1', 'checkbox': [], 'string': 'xylophone', 'requirecase': 'ABC ',
+            'repl': '[1,2]', 'paren': '(f(x))', 'chars': 'aabbcc', 'int': '', 'float': '',
+            'regexp': 'FOO', 'regex': '999', 'subdiff': 'koira', 'lines': 'one\ntwo\nthree',
+            'free': 'x'},
+            (7, ['radio', 'checkbox', 'string', 'int', 'float', 'regexp', 'lines'],
+            {'radio': ['Not B.', 'Really not B.'], 'string': ['Greet.', 'No x.']})),
+    ]
+
+    def test_grading(self):
+        from django.test import RequestFactory
+        from access.types.forms import GradedForm
+        for answers, (points, error_fields, hints) in self.GRADING_RESULTS:
+            request = RequestFactory().post('/', answers)
+            form = GradedForm(request.POST, exercise=self.GRADING_EXERCISE, request=request)
+            self.assertTrue(form.is_valid(), form.errors)
+            self.assertEqual(form.grade(), (points, ['group_0'], error_fields))
+            self.assertEqual({
+                name: field.hints for name, field in form.fields.items() if field.hints
+            }, hints)
+            self.assertEqual(sorted(form.grade_times), sorted(answers))
+
+    def test_bulk_grading(self):
+        from access.types.forms import BulkGrader
+        grader = BulkGrader(self.GRADING_EXERCISE)
+        for answers, (points, error_fields, hints) in self.GRADING_RESULTS:
+            self.assertEqual(grader.grade(answers), (points, ['group_0'], error_fields, hints, {}))
+        # Each distinct answer to a field is graded once.
+        graded = grader.graded
+        for answers, result in self.GRADING_RESULTS:
+            grader.grade(answers)
+        self.assertEqual(grader.graded, graded)
+        answers = dict(self.GRADING_RESULTS[0][0], int='many')
+        self.assertEqual(list(grader.grade(answers)[4]), ['int'])
+
+    def test_matcher(self):
+        from access.config import ConfigError
+        from access.types.forms import Matcher
+        self.assertTrue(Matcher('string-ignorews', ' a  b\r\n')('ab'))
+        self.assertFalse(Matcher('string-requirecase', 'Ab')('ab'))
+        self.assertTrue(Matcher('regexp-ignoreparenthesis', '/^ab$/')('(ab)'))
+        # Configuration errors surface when answers are graded.
+        matcher = Matcher('nosuch', 'a')
+        self.assertRaises(ConfigError, matcher, 'a')
+        self.assertRaises(ValueError, Matcher('int', 'x'), '1')
+
+    def test_subdiff_hints(self):
+        from access.types.forms import get_subdiff_hints
+        self.assertEqual(get_subdiff_hints('kisa', 'kissa'), ['Correct parts in your answer: kis-a'])
+        # The work on long answers is bounded and the format is kept.
+        start = time.time()
+        hints = get_subdiff_hints('ab' * 25000, 'xa' * 50 + '|' + 'ab' * 60)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(len(hints), 3)
+        self.assertEqual(hints[2], 'Correct parts in your answer: ' + 'ab' * 60)
+
+    def test_subdiff_truncation(self):
+        from access.types.forms import SUBDIFF_MAX_COST, subdiff_blocks
+        # Only the beginning of a long answer is compared.
+        limit = SUBDIFF_MAX_COST // 4
+        self.assertEqual([tuple(m) for m in subdiff_blocks('a' * (limit - 3) + 'xyz', 'xyz')],
+            [(limit - 3, 0, 3), (limit, 3, 0)])
+        self.assertEqual([tuple(m) for m in subdiff_blocks('a' * limit + 'xyz', 'xyz')],
+            [(limit, 3, 0)])
+
+
+class RegexTestCase(TestCase):
+
+    # Patterns and answers that take exponential time to reject.
+    PATHOLOGICAL = [
+        (r'^(a+)+$', 'a' * 40 + 'b'),
+        (r'(a*)*b', 'a' * 40),
+        (r'^(a|aa)+$', 'a' * 60 + 'b'),
+        (r'^(a|a?)+$', 'a' * 40 + 'b'),
+        (r'^(\w+\s?)*$', 'a' * 40 + '!'),
+        (r'(x+x+)+y', 'x' * 40),
+        (r'^(a|ab|b)*c$', 'ab' * 40 + 'x'),
+        (r'^(\d+)*$', '1' * 40 + 'x'),
+    ]
+    SAFE = [
+        r'\d{3}', r'^fo+$', r'(\w+\s)*\w+', r'[a-z]+@[a-z]+\.com', r'(ab|cd)+',
+        r'[-+]?[0-9]*(\.[0-9]+)?([eE][-+]?[0-9]+)?', r'(\d+,)*\d+',
+    ]
+
+    def test_backtracking_risk(self):
+        from util.regex import backtracking_risk
+        for pattern, _ in self.PATHOLOGICAL:
+            self.assertIsNotNone(backtracking_risk(pattern), pattern)
+        for pattern in self.SAFE:
+            self.assertIsNone(backtracking_risk(pattern), pattern)
+
+    def test_timeout(self):
+        from util.regex import RegexTimeout, SafePattern
+        for pattern, answer in self.PATHOLOGICAL:
+            compiled = SafePattern(pattern)
+            compiled.linear = None
+            start = time.time()
+            self.assertRaises(RegexTimeout, compiled.search, answer, timeout=0.05)
+            self.assertLess(time.time() - start, 1, pattern)
+        self.assertIsNotNone(SafePattern(r'^fo+$').search('fooo', timeout=0.05))
+
+    @override_settings(REGEX_TIMEOUT=0.05)
+    def test_grading_timeout(self):
+        from access.types.forms import Matcher
+        from util.regex import compile_safe
+        if compile_safe(r'^(a+)+$').linear is None:
+            start = time.time()
+            self.assertFalse(Matcher('regexp', r'^(a+)+$')('a' * 40 + 'b'))
+            self.assertLess(time.time() - start, 1)
+        self.assertTrue(Matcher('regexp', r'^(a+)+$')('aaa'))
+
+
+class SubmissionTestCase(TestCase):
+
+    def test_pending_orders(self):
+        import subprocess
+        from unittest import mock
+        from util import files
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        self.addCleanup(files.remove_pending_order, 'pendingtest')
+
+        # The order of a running process is not taken over.
+        files.write_pending_order('pendingtest', ['order', 'x'])
+        self.assertNotIn('pendingtest', dict(files.claim_pending_orders()))
+
+        with mock.patch('os.getpid', return_value=exited.pid):
+            files.write_pending_order('pendingtest', ['order', 'x'])
+        self.assertEqual(dict(files.claim_pending_orders())['pendingtest'], ['order', 'x'])
+        self.assertNotIn('pendingtest', dict(files.claim_pending_orders()))
+        files.remove_pending_order('pendingtest')
+        self.assertNotIn('pendingtest', dict(files.claim_pending_orders()))
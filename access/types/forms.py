@@ -3,6 +3,8 @@ import random
 import re
 import json
 import difflib
+import logging
+import time
 
 from django import forms
 from django.conf import settings
@@ -14,6 +16,8 @@ from django.utils.crypto import get_random_string
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext as _
 
+from util.cache import InProcessCache
+from util.regex import RegexTimeout, compile_safe
 from util.templates import template_to_str
 from util import forms as custom_forms
 from .auth import make_hash
@@ -21,6 +25,298 @@ from .auth import user_ids_from_string
 from ..config import ConfigError
 
 
+LOGGER = logging.getLogger('main')
+
+FIELD_TYPES = (
+    "checkbox", "radio", "dropdown", "select", "text", "textarea",
+    "table-radio", "table-checkbox", "static", "file",
+)
+REPL_PROMPT = re.compile(r'(^\w+:\s[\w\.\[\]]+\s=)')
+# Work budget, in compared character pairs, for matching a wrong subdiff answer
+# to the solutions when the correct parts are shown.
+SUBDIFF_MAX_COST = 200000
+
+
+def _good_strip(v):
+    return v.strip().replace("\r","")
+
+
+def _strip_ws(v):
+    return ''.join(v.split())
+
+
+def _strip_quotes(v):
+    if v.startswith("\"") and v.endswith("\""):
+        return v[1:len(v)-1]
+    return v
+
+
+def _strip_parenthesis(v):
+    return v.replace("(","").replace(")","")
+
+
+class Matcher:
+    '''
+    A compiled comparison of answers to a model value. The compare method,
+    e.g. "string-ignorews-requirecase", and the model value are parsed,
+    normalised and compiled once, so that matching an answer only
+    normalises the answer.
+    '''
+    # Note: when adding new compare methods or modifiers, remember to update
+    # _validate_compare_method in a-plus-rst-tools/directives/questionnaire.py
+
+    def __init__(self, method, cmp):
+        '''
+        @type method: C{str}
+        @param method: a compare method with optional modifiers
+        @type cmp: C{object}
+        @param cmp: the model value
+        '''
+        parts = method.split("-")
+        self.type = parts[0]
+        self.mods = frozenset(parts[1:])
+        self.cmp = cmp
+        self.error = None
+        try:
+            self._compile(cmp)
+        except Exception as e:
+            # Bad configuration fails when an answer is graded, as before.
+            self.error = e
+
+    def _compile(self, cmp):
+        t = self.type
+        mods = self.mods
+        if t == "array":
+            return
+        elif t == "int":
+            self.number = int(cmp)
+            return
+        elif t == "float":
+            self.number = float(cmp)
+            return
+
+        cmp = _good_strip(cmp)
+        if "ignorews" in mods or t == "unsortedchars":
+            cmp = _strip_ws(cmp)
+        if "ignorequotes" in mods:
+            cmp = _strip_quotes(cmp)
+        if "ignoreparenthesis" in mods and t != "regexp":
+            cmp = _strip_parenthesis(cmp)
+
+        if t == "unsortedchars":
+            self.chars = set(cmp)
+        elif t == "string":
+            self.lines = None
+            if "\n" in cmp:
+                self.lines = [l.strip() for l in cmp.strip().split("\n")]
+                if "requirecase" not in mods:
+                    self.lines = [l.lower() for l in self.lines]
+            elif "requirecase" not in mods:
+                cmp = cmp.lower()
+            self.value = cmp
+        elif t == "regexp":
+            if cmp.startswith('/') and cmp.endswith('/'):
+                cmp = cmp[1:-1]
+            self.pattern = compile_safe(cmp)
+        else:
+            raise ConfigError("Unknown compare method in form: %s" % (t))
+
+    def __call__(self, val):
+        '''
+        Matches an answer.
+
+        @type val: C{object}
+        @param val: the cleaned answer value
+        @rtype: C{bool}
+        @return: True if the answer matches the model value
+        '''
+        if self.error is not None:
+            raise self.error
+        t = self.type
+        mods = self.mods
+
+        if t == "array":
+            return self.cmp in val
+        elif t == "int":
+            if val is None or val == '':
+                return False
+            return int(val) == self.number
+        elif t == "float":
+            if val is None or val == '':
+                return False
+            return math.isclose(float(val), self.number, rel_tol=0.02)
+
+        val = _good_strip(val)
+        if "ignorerepl" in mods:
+            m = REPL_PROMPT.match(val)
+            if m:
+                val = val[len(m.group(1)):].strip()
+        if "ignorews" in mods or t == "unsortedchars":
+            val = _strip_ws(val)
+        if "ignorequotes" in mods:
+            val = _strip_quotes(val)
+        if "ignoreparenthesis" in mods:
+            val = _strip_parenthesis(val)
+
+        if t == "unsortedchars":
+            return set(val) == self.chars
+        elif t == "string":
+            if self.lines is not None:
+                val_a = [l.strip() for l in val.strip().split("\n")]
+                if len(self.lines) != len(val_a):
+                    return False
+                if "requirecase" in mods:
+                    return all(c==v for c,v in zip(self.lines,val_a))
+                else:
+                    return all(c==v.lower() for c,v in zip(self.lines,val_a))
+            elif "requirecase" in mods:
+                return val == self.value
+            else:
+                return val.lower() == self.value
+        else:
+            try:
+                return bool(self.pattern.search(val))
+            except RegexTimeout:
+                LOGGER.warning("Regular expression %r timed out, the answer fails.", self.pattern.pattern)
+                return False
+
+
+class FormBlueprint:
+    '''
+    The request independent parts of a form for an exercise: the fields
+    with their choices and correct and initial values.
+    Blueprints are compiled once per exercise configuration.
+    '''
+    _cache = InProcessCache(limit=200)
+
+    @classmethod
+    def get(cls, exercise):
+        '''
+        Gets the blueprint for an exercise configuration.
+
+        @type exercise: C{dict}
+        @param exercise: an exercise configuration
+        @rtype: C{FormBlueprint}
+        @return: the cached or a new blueprint
+        '''
+        # The cache holds the configuration, so its id stays unique.
+        cached = cls._cache.get(id(exercise))
+        if cached is not None and cached[0] is exercise:
+            return cached[1]
+        blueprint = cls(exercise)
+        cls._cache[id(exercise)] = (exercise, blueprint)
+        return blueprint
+
+    def __init__(self, exercise):
+        if "fieldgroups" not in exercise:
+            raise ConfigError("Missing required \"fieldgroups\" in exercise configuration")
+        self.specs = {}
+        for group in exercise["fieldgroups"]:
+            if "fields" not in group:
+                raise ConfigError("Missing required \"fields\" in field group configuration")
+            for field in group["fields"]:
+                if "type" not in field:
+                    raise ConfigError("Missing required \"type\" in field configuration for: %s" % (group["name"]))
+                if field["type"] not in FIELD_TYPES:
+                    raise ConfigError("Unknown field type: %s" % (field["type"]))
+                self.specs[id(field)] = self.compile_field(field)
+
+    def compile_field(self, field):
+        choices, initial, correct = create_choices(field)
+        neutral = []
+        for a, opt in enumerate(field.get('options', [])):
+            if opt.get('correct') == 'neutral':
+                neutral.append(option_name(a, opt))
+        if 'extra_info' in field and 'class' in field['extra_info']:
+            html_class = field['extra_info']['class']
+        else:
+            html_class = 'form-group'
+        return {
+            'choices': choices,
+            'initial': initial,
+            'correct': correct,
+            'neutral': neutral,
+            'html_class': html_class,
+            'grading': self.compile_grading(field),
+        }
+
+    def compile_grading(self, field):
+        '''
+        Compiles the matchers that grade a field: the model answer of a text
+        field and the comparisons of the feedback definitions.
+
+        @type field: C{dict}
+        @param field: a field configuration
+        @rtype: C{dict}
+        @return: method, accept, subdiff and feedback
+        '''
+        t = field["type"]
+        accept = None
+        subdiff = None
+        if t == "checkbox":
+            method = 'array'
+        elif t == "text" or t == "textarea":
+            method = field.get('compare_method', 'string')
+            if "regex" in field:
+                accept = field["regex"]
+                method = "regexp"
+            elif "correct" in field:
+                accept = field["correct"]
+                # subdiff method may have multiple correct answers.
+                if method.startswith('subdiff'):
+                    mods = method[7:]
+                    models = accept.split('|') if isinstance(accept, str) else [accept]
+                    subdiff = [Matcher('string' + mods, model) for model in models]
+        else:
+            method = 'string'
+
+        methods = method.split("-")
+        mods = methods[1:]
+        feedback = []
+        for fb in field.get("feedback", []):
+            label = fb.get('label', None)
+            if not label:
+                continue
+            comparison = fb.get('value', '')
+            if comparison == "%100%":
+                matcher = None
+            else:
+                # Freetext questions with 'string', 'subdiff' or 'regexp'
+                # compare method can have reqular expression based hints.
+                if methods[0] in ('string', 'regexp', 'subdiff'):
+                    if fb.get('compare_regexp', False):
+                        methods_used = 'regexp'
+                    else:
+                        methods_used = 'string'
+                    methods_used = '-'.join([methods_used] + mods)
+                else:
+                    methods_used = method
+                matcher = Matcher(methods_used, comparison)
+            feedback.append((label, matcher, fb.get('not', False)))
+
+        return {
+            'method': method,
+            'accept': Matcher(method, accept) if accept is not None and subdiff is None else None,
+            'subdiff': subdiff,
+            'feedback': feedback,
+        }
+
+    def spec(self, field):
+        '''
+        Gets the compiled parts of a field configuration.
+
+        @type field: C{dict}
+        @param field: a field configuration of the exercise
+        @rtype: C{dict}
+        @return: choices, initial, correct, more, neutral, html_class and grading
+        '''
+        spec = self.specs.get(id(field))
+        if spec is None:
+            # Derived configurations, e.g. table rows, are compiled on demand.
+            spec = self.compile_field(field)
+        return spec
+
+
 class GradedForm(forms.Form):
     '''
     A dynamically build form class for an exercise.
@@ -43,21 +339,19 @@ class GradedForm(forms.Form):
         kwargs['auto_id'] = 'exercise-{}-field-%s'.format(random_id)
         super(forms.Form, self).__init__(*args, **kwargs)
 
-        if "fieldgroups" not in self.exercise:
-            raise ConfigError("Missing required \"fieldgroups\" in exercise configuration")
+        self.blueprint = FormBlueprint.get(self.exercise)
 
         self.disabled = self.show_correct
         self.randomized = False
         self.rng = random.Random()
         self.multipart = False
         samples = []
+        self.group_fields = []
         g = 0
         i = 0
 
         # Travel each fields froup.
         for group in self.exercise["fieldgroups"]:
-            if "fields" not in group:
-                raise ConfigError("Missing required \"fields\" in field group configuration")
 
             # Group errors to hide the errorneous fields.
             group_errors = group.get("group_errors", False)
@@ -87,21 +381,21 @@ class GradedForm(forms.Form):
                     self.disabled = True
                 else:
                     samples.append('-'.join([str(i) for i in indexes]))
-                group["_fields"] = [group["fields"][i] for i in indexes]
+                fields = [group["fields"][i] for i in indexes]
             else:
-                group["_fields"] = group["fields"]
+                fields = group["fields"]
+            self.group_fields.append(fields)
 
             j = 0
-            l = len(group["_fields"]) - 1
+            l = len(fields) - 1
 
             # Travel each field in group.
-            for field in group["_fields"]:
-                if "type" not in field:
-                    raise ConfigError("Missing required \"type\" in field configuration for: %s" % (group["name"]))
+            for field in fields:
                 t = field["type"]
 
                 # Create a field by type.
-                choices, initial, correct = self.create_choices(field)
+                spec = self.blueprint.spec(field)
+                choices, initial, correct = spec['choices'], spec['initial'], spec['correct']
                 if t == "checkbox":
                     if 'randomized' in field and args[0] is not None:
                         # grading a randomized question
@@ -190,7 +484,8 @@ class GradedForm(forms.Form):
 
     def add_table_fields(self, i, config, field_class, widget_class, multiple=False):
         fields = []
-        choices, initial, correct = self.create_choices(config)
+        spec = self.blueprint.spec(config)
+        choices, initial, correct = spec['choices'], spec['initial'], spec['correct']
         for row in config.get('rows', []):
 
             if self.show_correct:
@@ -204,7 +499,7 @@ class GradedForm(forms.Form):
             if 'key' in row:
                 row_config['key'] = row['key']
             i, fi = self.add_field(i, row_config,
-                field_class, widget_class, initial, correct, choices, multiple, {})
+                field_class, widget_class, initial, correct, choices, multiple, {}, spec=spec)
             fi[0].row_label = row.get('label', None)
             fields += fi
 
@@ -213,7 +508,7 @@ class GradedForm(forms.Form):
                 more_config = config.copy()
                 more_config['key'] = self.field_name(i, row_config) + '_more'
                 i, fm = self.add_field(i, more_config,
-                    forms.CharField, forms.TextInput)
+                    forms.CharField, forms.TextInput, spec=spec)
                 fm[0].row_label = row.get('label', None)
                 fm[0].table_more = True
                 fields += fm
@@ -224,7 +519,7 @@ class GradedForm(forms.Form):
 
     def add_field(self, i, config, field_class, widget_class,
             initial=None, correct=None, choices=None, multiple=False,
-            widget_attrs={'class': 'form-control'}, post_data=None):
+            widget_attrs={'class': 'form-control'}, post_data=None, spec=None):
         args = {
             'widget': widget_class(attrs=widget_attrs),
             'required': 'required' in config and config['required'],
@@ -272,11 +567,14 @@ class GradedForm(forms.Form):
             elif config.get('initial', False):
                 args['initial'] = config['initial']
 
+        if spec is None:
+            spec = self.blueprint.spec(config)
         field = field_class(**args)
         field.type = config['type']
         field.name = name
         if 'title' in config:
             field.label = mark_safe(config['title'].replace('{#}', str(i + 1)))
+        # The `include` templates may change without the configuration.
         field.more = self.create_more(config)
         field.points = config.get('points', 0)
         field.choice_list = choices is not None and widget_class != forms.Select
@@ -296,54 +594,18 @@ class GradedForm(forms.Form):
             elif config.get('correct', False):
                 field.correct = config['correct']
             if 'options' in config:
-                neutral = []
-                a = 0
-                for opt in config['options']:
-                    if opt.get('correct') == 'neutral':
-                        neutral.append(self.option_name(a, opt))
-                    a += 1
-                field.neutral = neutral
-
-        if 'extra_info' in config and 'class' in config['extra_info']:
-            field.html_class = config['extra_info']['class']
-        else:
-            field.html_class = 'form-group'
+                field.neutral = spec['neutral']
+
+        field.html_class = spec['html_class']
 
         self.fields[field.name] = field
         return (i + 1, [field])
 
     def create_more(self, configuration):
-        '''
-        Creates more instructions by configuration.
-        '''
-        more = ""
-        if "more" in configuration:
-            more += configuration["more"]
-        if "include" in configuration:
-            more += template_to_str(None, None, configuration["include"])
-        return more or None
+        return create_more(configuration)
 
     def create_choices(self, configuration):
-        '''
-        Creates field choices by configuration.
-
-        '''
-        choices = []
-        initial = []
-        correct = []
-        if "options" in configuration:
-            i = 0
-            for opt in configuration["options"]:
-                label = opt.get('label', "")
-                value = self.option_name(i, opt)
-                choices.append((value, mark_safe(label)))
-                if opt.get('correct', False) is True:
-                    # Not always boolean; string "neutral" is a possible value.
-                    correct.append(value)
-                if opt.get('selected', False) or opt.get('initial', False):
-                    initial.append(value)
-                i += 1
-        return choices, initial, correct
+        return create_choices(configuration)
 
     def group_name(self, i):
         return "group_{:d}".format(i)
@@ -352,7 +614,7 @@ class GradedForm(forms.Form):
         return config.get("key", "field_{:d}".format(i))
 
     def option_name(self, i, config):
-        return config.get("value", "option_{:d}".format(i))
+        return option_name(i, config)
 
     def append_hint(self, hints, configuration):
         # The old definition of hint per option.
@@ -420,20 +682,25 @@ class GradedForm(forms.Form):
 
     def grade(self):
         '''
-        Grades form answers.
+        Grades form answers. The grading time of each field, in seconds, is
+        recorded in grade_times by the field name.
         '''
+        self.grade_times = {}
         points = 0
         error_fields = []
         error_groups = []
         g = 0
         i = 0
-        for group in self.exercise["fieldgroups"]:
-            for field in group["_fields"]:
+        for fields in self.group_fields:
+            for field in fields:
                 prev = i
+                start = time.perf_counter()
                 i, ok, p = self.grade_field(i, field)
+                name = self.field_name(prev, field)
+                self.grade_times[name] = time.perf_counter() - start
                 points += p
                 if not ok:
-                    error_fields.append(self.field_name(prev, field))
+                    error_fields.append(name)
                     gname = self.group_name(g)
                     if gname not in error_groups:
                         error_groups.append(gname)
@@ -442,80 +709,8 @@ class GradedForm(forms.Form):
         return (points, error_groups, error_fields)
 
     def compare_values(self, method, val, cmp):
-        # Note: when adding new compare methods or modifiers, remember to update
-        # _validate_compare_method in a-plus-rst-tools/directives/questionnaire.py
-        parts = method.split("-")
-        t = parts[0]
-        mods = parts[1:]
-
-        if t == "array":
-            return cmp in val
-        elif t == "int":
-            if val is None or val == '':
-                return False
-            return int(val) == int(cmp)
-        elif t == "float":
-            if val is None or val == '':
-                return False
-            return math.isclose(float(val), float(cmp), rel_tol=0.02)
-
-        def good_strip(v):
-            return v.strip().replace("\r","")
-        val = good_strip(val)
-        cmp = good_strip(cmp)
-
-        if "ignorerepl" in mods:
-            p = re.compile('(^\w+:\s[\w\.\[\]]+\s=)')
-            m = p.match(val)
-            if m:
-                val = val[len(m.group(1)):].strip()
-
-        if "ignorews" in mods or t == "unsortedchars":
-            def strip_ws(v):
-                return ''.join(v.split())
-            val = strip_ws(val)
-            cmp = strip_ws(cmp)
-
-        if "ignorequotes" in mods:
-            def strip_quotes(v):
-                if v.startswith("\"") and v.endswith("\""):
-                    return v[1:len(v)-1]
-                return v
-            val = strip_quotes(val)
-            cmp = strip_quotes(cmp)
-
-        if "ignoreparenthesis" in mods:
-            def strip_parenthesis(v):
-                return v.replace("(","").replace(")","")
-            if t == "regexp":
-                val = strip_parenthesis(val)
-            else:
-                val = strip_parenthesis(val)
-                cmp = strip_parenthesis(cmp)
-
-        if t == "unsortedchars":
-            return set(val) == set(cmp)
-        if t == "string":
-            if "\n" in cmp:
-                cmp_a = [l.strip() for l in cmp.strip().split("\n")]
-                val_a = [l.strip() for l in val.strip().split("\n")]
-                if len(cmp_a) != len(val_a):
-                    return False
-                if "requirecase" in mods:
-                    return all(c==v for c,v in zip(cmp_a,val_a))
-                else:
-                    return all(c.lower()==v.lower() for c,v in zip(cmp_a,val_a))
-            elif "requirecase" in mods:
-                return val == cmp
-            else:
-                return val.lower() == cmp.lower()
-        elif t == "regexp":
-            if cmp.startswith('/') and cmp.endswith('/'):
-                cmp = cmp[1:-1]
-            p = re.compile(cmp)
-            return bool(p.search(val))
-        else:
-            raise ConfigError("Unknown compare method in form: %s" % (t))
+        # Grading uses the matchers compiled in the blueprint.
+        return Matcher(method, cmp)(val)
 
     def grade_field(self, i, configuration):
         t = configuration["type"]
@@ -587,29 +782,12 @@ class GradedForm(forms.Form):
             earned_points = 0
 
         # Apply new feedback definitions.
-        methods = method.split("-")
-        mods = methods[1:]
-        for fb in configuration.get("feedback", []):
-            new_hint = fb.get('label', None)
-            comparison = fb.get('value', '')
-            if not new_hint:
-                continue
-            add = False
-            if comparison == "%100%":
+        for new_hint, matcher, negate in self.blueprint.spec(configuration)['grading']['feedback']:
+            if matcher is None:
                 add = ok
             else:
-                # Freetext questions with 'string', 'subdiff' or 'regexp'
-                # compare method can have reqular expression based hints.
-                if methods[0] in ('string', 'regexp', 'subdiff'):
-                    if fb.get('compare_regexp', False):
-                        methods_used = 'regexp'
-                    else:
-                        methods_used = 'string'
-                    methods_used = '-'.join([methods_used] + mods)
-                else:
-                    methods_used = method
-                r = self.compare_values(methods_used, value, comparison)
-                add = not r if fb.get('not', False) else r
+                r = matcher(value)
+                add = not r if negate else r
             if add:
                 for j in range(len(hints)):
                     if new_hint.startswith(hints[j]):
@@ -715,29 +893,17 @@ class GradedForm(forms.Form):
 
     def grade_text(self, configuration, value, hints=None):
         hints = hints or []
-        correct = False
-        accept = None
-        method = configuration.get('compare_method', 'string')
-        if "regex" in configuration:
-            accept = configuration["regex"]
-            method = "regexp"
-        elif "correct" in configuration:
-            accept = configuration["correct"]
-            # subdiff method may have multiple correct answers.
-            if method.startswith('subdiff'):
-                mods = method[7:]
-                correct_answers = accept.split('|')
-                for model in correct_answers:
-                    ok = self.compare_values('string' + mods, value, model)
-                    if ok:
-                        correct = True
-                if not correct:
-                    # Show matching parts in the feedback.
-                    for hint in get_subdiff_hints(value, accept):
-                        hints.append(hint)
-                return correct, hints, method
-        if accept is not None:
-            correct = self.compare_values(method, value, accept)
+        grading = self.blueprint.spec(configuration)['grading']
+        method = grading['method']
+        if grading['subdiff'] is not None:
+            correct = any(matcher(value) for matcher in grading['subdiff'])
+            if not correct:
+                # Show matching parts in the feedback.
+                for hint in get_subdiff_hints(value, configuration["correct"]):
+                    hints.append(hint)
+            return correct, hints, method
+        if grading['accept'] is not None:
+            correct = grading['accept'](value)
         else:
             # Answer counts as correct if there is no model solution.
             correct = True
@@ -805,6 +971,188 @@ class GradedForm(forms.Form):
         return selected_choices, correct_choices, initial_choices, random_attributes
 
 
+class BulkGrader:
+    '''
+    Grades stored answers to a questionnaire like GradedForm.grade does
+    for a POST. The form is built once and each distinct answer to a field
+    is validated and graded only once.
+    '''
+
+    def __init__(self, exercise):
+        '''
+        @type exercise: C{dict}
+        @param exercise: an exercise configuration without randomized questions
+        @raises ConfigError: if the questionnaire is randomized
+        '''
+        for group in exercise.get("fieldgroups", ()):
+            if "pick_randomly" in group or any("randomized" in f for f in group.get("fields", ())):
+                raise ConfigError("Randomized questionnaires can not be graded in bulk")
+        self.form = GradedForm(None, exercise=exercise)
+        self.results = {}
+        self.graded = 0
+
+        # The answer names of each field, in the order of grading.
+        self.plan = []
+        i = 0
+        for g, fields in enumerate(self.form.group_fields):
+            for field in fields:
+                if field["type"] in ("table-radio", "table-checkbox"):
+                    rows = field.get("rows", [])
+                    names = [self.form.field_name(i + n, row) for n, row in enumerate(rows)]
+                    step = len(rows)
+                else:
+                    names = [self.form.field_name(i, field)]
+                    step = 1
+                self.plan.append((g, i, field, names))
+                i += step
+
+    def grade(self, answers):
+        '''
+        Grades answers.
+
+        @type answers: C{dict}
+        @param answers: the submitted values by field name
+        @rtype: C{tuple}
+        @return: points, error groups, error fields, hints by field name and
+            validation errors by field name, the answers are rejected if any
+        '''
+        points = 0
+        error_groups = []
+        error_fields = []
+        hints = {}
+        errors = {}
+        for n, (g, i, field, names) in enumerate(self.plan):
+            key = (n,) + tuple(_hashable(answers.get(name)) for name in names)
+            result = self.results.get(key)
+            if result is None:
+                result = self.results[key] = self._grade_field(i, field, names, answers)
+                self.graded += 1
+            ok, p, field_hints, invalid = result
+            if invalid:
+                errors.update(invalid)
+                continue
+            points += p
+            hints.update(field_hints)
+            if not ok:
+                error_fields.append(self.form.field_name(i, field))
+                gname = self.form.group_name(g)
+                if gname not in error_groups:
+                    error_groups.append(gname)
+        return points, error_groups, error_fields, hints, errors
+
+    def _grade_field(self, i, field, names, answers):
+        form = self.form
+        cleaned = {}
+        invalid = {}
+        for name in names:
+            try:
+                cleaned[name] = form.fields[name].clean(answers.get(name))
+            except ValidationError as e:
+                invalid[name] = e.messages
+        if invalid:
+            return False, 0, {}, invalid
+        form.cleaned_data = cleaned
+        for name in names:
+            form.fields[name].hints = None
+        _, ok, points = form.grade_field(i, field)
+        hints = { name: form.fields[name].hints for name in names if form.fields[name].hints }
+        return ok, points, hints, None
+
+
+def _hashable(value):
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    return value
+
+
+def create_more(configuration):
+    '''
+    Creates more instructions by configuration.
+    '''
+    more = ""
+    if "more" in configuration:
+        more += configuration["more"]
+    if "include" in configuration:
+        more += template_to_str(None, None, configuration["include"])
+    return more or None
+
+
+def create_choices(configuration):
+    '''
+    Creates field choices by configuration.
+
+    '''
+    choices = []
+    initial = []
+    correct = []
+    if "options" in configuration:
+        i = 0
+        for opt in configuration["options"]:
+            label = opt.get('label', "")
+            value = option_name(i, opt)
+            choices.append((value, mark_safe(label)))
+            if opt.get('correct', False) is True:
+                # Not always boolean; string "neutral" is a possible value.
+                correct.append(value)
+            if opt.get('selected', False) or opt.get('initial', False):
+                initial.append(value)
+            i += 1
+    return choices, initial, correct
+
+
+def option_name(i, config):
+    return config.get("value", "option_{:d}".format(i))
+
+
+class BoundedSequenceMatcher(difflib.SequenceMatcher):
+    '''
+    A sequence matcher that stops looking for matching blocks when the
+    work budget runs out. Each search for the longest match is charged
+    with its upper bound cost: the characters of the answer region and the
+    positions in the solution that they can match. Regions that would
+    exceed the remaining budget are left unmatched, so the blocks are
+    exactly those of SequenceMatcher whenever the budget suffices.
+    '''
+
+    def __init__(self, a, b, max_cost):
+        super().__init__(None, a, b)
+        self.budget = max_cost
+        self.counts = { c: len(positions) for c, positions in self.b2j.items() }
+
+    def find_longest_match(self, alo, ahi, blo, bhi):
+        if ahi - alo <= self.budget:
+            counts = self.counts
+            self.budget -= (ahi - alo) + sum(counts.get(c, 0) for c in self.a[alo:ahi])
+            if self.budget >= 0:
+                return super().find_longest_match(alo, ahi, blo, bhi)
+        self.budget = -1
+        return difflib.Match(alo, blo, 0)
+
+
+def subdiff_blocks(value, solution, max_cost=SUBDIFF_MAX_COST):
+    '''
+    Finds the matching blocks of an answer and a solution at a bounded cost.
+    Only the first max(4 * len(solution), max_cost // (len(solution) + 1))
+    characters of the answer are compared, so the parts of a long answer
+    after them are not matched, even when they hold the longest match.
+    Within that prefix the blocks are found while max_cost lasts, see
+    BoundedSequenceMatcher.
+
+    @type value: C{str}
+    @param value: the answer
+    @type solution: C{str}
+    @param solution: a solution
+    @type max_cost: C{int}
+    @param max_cost: the work budget, about the character pairs compared
+    @rtype: C{list}
+    @return: matching blocks as returned by difflib.SequenceMatcher
+    '''
+    limit = max(4 * len(solution), max_cost // (len(solution) + 1))
+    return BoundedSequenceMatcher(value[:limit], solution, max_cost).get_matching_blocks()
+
+
 def get_subdiff_hints(value, all_solutions):
     solutions = all_solutions.split('|')
     if len(solutions) > 1:
@@ -813,9 +1161,8 @@ def get_subdiff_hints(value, all_solutions):
         matching_parts = []
     for solution in solutions:
         parts = _("Correct parts in your answer: ")
-        matches = difflib.SequenceMatcher(None, value, solution).get_matching_blocks()
         i = 0
-        for match in matches:
+        for match in subdiff_blocks(value, solution, SUBDIFF_MAX_COST // len(solutions)):
             parts += '-' * (match.b - i)
             i = match.b + match.size
             parts += value[match.a:match.a + match.size]
@@ -23,26 +23,34 @@ import copy
 import json
 import logging
 import os
-import re
 from collections import OrderedDict
 
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
-from django.utils import translation
+from django.utils import timezone, translation
 
+from asyncjob.models import AsyncJob, ContainerState
+from asyncjob import admission
+from asyncjob.tasks import order_container, release_jobs
+from asyncjob.tracker import estimate
 from util.files import create_submission_dir, save_submitted_file, \
-    clean_submission_dir, write_submission_file, write_submission_meta
+    clean_submission_dir, write_submission_file, write_submission_meta, \
+    sync_submission_dir, write_pending_order, \
+    remove_pending_order, claim_pending_orders
 from util.http import cached_view_type
 from util.personalized import select_generated_exercise_instance, \
     user_personal_directory_path
-from util.shell import invoke
+from util.regex import RegexTimeout, compile_safe
+from util.shell import invoke, invoke_background, background_queue_length
 from util.templates import render_configured_template, render_template
 from .auth import make_hash, get_uid
 from ..config import ConfigError, DIR
 
 
 LOGGER = logging.getLogger('main')
+# the process that has ordered the pending containers of the exited processes
+_replayed_pid = None
 
 
 def _parse_fields_and_files(exercise):
@@ -113,7 +121,7 @@ def _parse_fields_and_files(exercise):
             elif ftype == 'integer':
                 pattern = r'[-+]?[0-9]*'
         field['pattern'] = pattern
-        field['pattern_re'] = re.compile(r'^' + pattern + r'$') if pattern else None
+        field['pattern_re'] = compile_safe(r'^' + pattern + r'$') if pattern else None
 
         if ftype == 'file' and not field.get('accept', None):
             ext = field['filename'].rpartition('.')[2]
@@ -159,8 +167,13 @@ def _parse_post_and_validate(request, fields):
                         value = int(value)
                     except ValueError:
                         error = 'invalid'
-                elif field['pattern'] and field['pattern_re'].match(value) is None:
-                    error = 'invalid'
+                elif field['pattern']:
+                    try:
+                        if field['pattern_re'].match(value) is None:
+                            error = 'invalid'
+                    except RegexTimeout:
+                        LOGGER.warning("Pattern of field %s timed out.", name)
+                        error = 'invalid'
             elif field['required']:
                 error = 'missing'
         values.append((error, value))
@@ -346,6 +359,8 @@ def _acceptSubmission(request, course, exercise, post_url, sdir):
         exercise_extra["personalized_exercise"] \
             = select_generated_exercise_instance(course, exercise, uids, attempt)
 
+    # The submission is recorded durably before it is accepted.
+    sync_submission_dir(sdir)
     sid = os.path.basename(sdir)
     write_submission_meta(sid, {
         "url": surl,
@@ -355,7 +370,7 @@ def _acceptSubmission(request, course, exercise, post_url, sdir):
         "exercise_key": exercise["key"],
         "lang": translation.get_language(),
     })
-    r = invoke([
+    cmd = [
         settings.CONTAINER_SCRIPT,
         sid,
         request.scheme + "://" + request.get_host(),
@@ -365,16 +380,113 @@ def _acceptSubmission(request, course, exercise, post_url, sdir):
         c["cmd"],
         json.dumps(course_extra),
         json.dumps(exercise_extra),
-    ])
-    LOGGER.debug("Container order exit=%d out=%s err=%s",
-        r["code"], r["out"], r["err"])
-    qlen = 1
+    ]
+    if settings.CONTAINER_ORDER_CELERY:
+        error, qlen, eta = _queueContainerOrder(course, exercise, uids, attempt,
+            surl, sid, cmd, exercise_extra.get("personalized_exercise"))
+    elif settings.CONTAINER_ORDER_ASYNC:
+        _replayPendingOrders()
+        qlen = background_queue_length()
+        eta = None
+        write_pending_order(sid, cmd)
+        _orderInBackground(sid, cmd)
+        error = False
+    else:
+        r = invoke(cmd)
+        LOGGER.debug("Container order exit=%d out=%s err=%s",
+            r["code"], r["out"], r["err"])
+        error = r['code'] != 0
+        qlen = 0
+        eta = None
 
     return render_template(request, course, exercise, post_url,
         "access/async_accepted.html", {
-            "error": r['code'] != 0,
+            "error": error,
             "accepted": True,
             "wait": True,
             "missing_url": surl_missing,
-            "queue": qlen
+            "queue": qlen,
+            "eta": eta,
         })
+
+
+def _queueContainerOrder(course, exercise, uids, attempt, surl, sid, cmd, personalized):
+    '''
+    Records the submission as an AsyncJob and queues the container order
+    for a Celery worker. If the containers are limited, the job waits in
+    the CREATED state until asyncjob.admission releases it.
+
+    @rtype: C{tuple}
+    @return: whether queueing failed, number of jobs waiting before this one,
+        estimated completion time or None
+    '''
+    job = AsyncJob(
+        course_key=course["key"],
+        exercise_key=exercise["key"],
+        lang=translation.get_language(),
+        container_ref=sid,
+        priority=admission.priority_lane(course, exercise, attempt),
+        upload_url=surl,
+        submission_meta={
+            "uids": uids,
+            "personalized_exercise": personalized,
+        },
+    )
+    if admission.enabled():
+        job.submission_meta["cmd"] = cmd
+        job.save()
+        try:
+            release_jobs.delay()
+        except Exception:
+            # The next release after a completed container picks the job.
+            LOGGER.exception("Failed to queue the release of submission %s", sid)
+    else:
+        job.save()
+        try:
+            order_container.delay(job.id, cmd)
+        except Exception:
+            LOGGER.exception("Failed to queue the container order for submission %s", sid)
+            job.container_state = ContainerState.COMPLETED
+            job.save(update_fields=["container_state", "container_state_updated"])
+            return True, 0, None
+        # The worker may have picked the job already.
+        AsyncJob.objects.filter(id=job.id, container_state=ContainerState.CREATED.value)\
+            .update(container_state=ContainerState.ORDERED.value,
+                container_state_updated=timezone.now())
+    qlen = job.queued_before()
+    eta = estimate(course["key"], exercise["key"]).completion_time(qlen, timezone.now())
+    return False, qlen, eta
+
+
+def _orderInBackground(sid, cmd):
+    invoke_background(cmd).add_done_callback(
+        lambda future: _containerOrdered(sid, future))
+
+
+def _replayPendingOrders():
+    '''
+    Orders the containers that the exited processes of this host left
+    pending, once per process.
+    '''
+    global _replayed_pid
+    if _replayed_pid == os.getpid():
+        return
+    _replayed_pid = os.getpid()
+    for sid, cmd in claim_pending_orders():
+        LOGGER.warning("Ordering the pending container of submission %s again", sid)
+        _orderInBackground(sid, cmd)
+
+
+def _containerOrdered(sid, future):
+    remove_pending_order(sid)
+    try:
+        r = future.result()
+    except Exception:
+        LOGGER.exception("Container order failed for submission %s", sid)
+        return
+    if r["code"] != 0:
+        LOGGER.error("Container order failed for submission %s exit=%d out=%s err=%s",
+            sid, r["code"], r["out"], r["err"])
+    else:
+        LOGGER.debug("Container order exit=%d out=%s err=%s",
+            r["code"], r["out"], r["err"])
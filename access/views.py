@@ -1,11 +1,12 @@
 from django.shortcuts import render
-from django.http.response import HttpResponse, JsonResponse, Http404, HttpResponseForbidden
+from django.http.response import HttpResponse, JsonResponse, Http404, HttpResponseForbidden, \
+    HttpResponseNotModified, StreamingHttpResponse
 from django.utils import timezone
 from django.utils import translation
+from django.utils.http import parse_etags, quote_etag
 from django.core.exceptions import ImproperlyConfigured
 from django.core.urlresolvers import reverse
 from django.conf import settings
-import copy
 import os
 import json
 
@@ -215,56 +216,45 @@ def aplus_json(request, course_key):
     course = config.course_entry(course_key)
     if course is None:
         raise Http404()
-    data = _copy_fields(course, [
-        "archive_time",
-        "assistants",
-        "categories",
-        "contact",
-        "content_numbering",
-        "course_description",
-        "course_footer",
-        "description",
-        "end",
-        "enrollment_audience",
-        "enrollment_end",
-        "enrollment_start",
-        "head_urls",
-        "index_mode",
-        "lifesupport_time",
-        "module_numbering",
-        "name",
-        "numerate_ignoring_modules",
-        "start",
-        "view_content_to",
-    ])
-    data['lang'] = course['languages']
-
-    def children_recursion(parent):
-        if not "children" in parent:
-            return []
-        result = []
-        for o in [o for o in parent["children"] if "key" in o]:
-            of = _type_dict(o, course.get("exercise_types", {}))
-            if "config" in of:
-                _, exercise = config.exercise_entry(course["key"], str(of["key"]), '_root')
-                of = export.exercise(request, course, exercise, of)
-            elif "static_content" in of:
-                of = export.chapter(request, course, of)
-            of["children"] = children_recursion(o)
-            result.append(of)
-        return result
-
-    modules = []
-    if "modules" in course:
-        for m in course["modules"]:
-            mf = _type_dict(m, course.get("module_types", {}))
-            mf["children"] = children_recursion(m)
-            modules.append(mf)
-    data["modules"] = modules
+    etag = export.course_etag(request, config, course)
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and _etag_matches(etag, if_none_match):
+        response = HttpResponseNotModified()
+    elif settings.APLUS_JSON_STREAM:
+        response = StreamingHttpResponse(
+            export.streamed_course_json(request, config, course, etag),
+            content_type='application/json')
+    else:
+        _, content = export.cached_course_json(request, config, course, etag)
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = quote_etag(etag)
+    return response
+
+
+def _etag_matches(etag, if_none_match):
+    if if_none_match.strip() == '*':
+        return True
+    # parse_etags returns the tags unquoted before Django 1.11 and quoted,
+    # with a possible W/ prefix, since.
+    for tag in parse_etags(if_none_match):
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag.strip('"') == etag:
+            return True
+    return False
 
-    if "gitmanager" in settings.INSTALLED_APPS:
-        data["build_log_url"] = request.build_absolute_uri(reverse("build-log-json", args=(course_key, )))
-    return JsonResponse(data)
+
+def config_stats(request):
+    '''
+    Reports the configuration cache counters of the serving process. The
+    counters are only shown with settings.DEBUG.
+    '''
+    if not settings.DEBUG:
+        raise Http404()
+    return JsonResponse({
+        'pid': os.getpid(),
+        'courses': config.stats(),
+    })
 
 
 def test_result(request):
@@ -319,40 +309,3 @@ def _get_course_exercise_lang(course_key, exercise_key, lang_code):
     lang_code = exercise['lang']
     translation.activate(lang_code)
     return (course, exercise, lang_code)
-
-
-def _copy_fields(dict_item, pick_fields):
-    '''
-    Copies picked fields from a dictionary.
-
-    @type dict_item: C{dict}
-    @param dict_item: a dictionary
-    @type pick_fields: C{list}
-    @param pick_fields: a list of field names
-    @rtype: C{dict}
-    @return: a dictionary of picked fields
-    '''
-    result = {}
-    for name in pick_fields:
-        if name in dict_item:
-            result[name] = copy.deepcopy(dict_item[name])
-    return result
-
-def _type_dict(dict_item, dict_types):
-    '''
-    Extends dictionary with a type reference.
-
-    @type dict_item: C{dict}
-    @param dict_item: a dictionary
-    @type dict_types: C{dict}
-    @param dict_types: a dictionary of type dictionaries
-    @rtype: C{dict}
-    @return: an extended dictionary
-    '''
-    base = {}
-    if "type" in dict_item and dict_item["type"] in dict_types:
-        base = copy.deepcopy(dict_types[dict_item["type"]])
-    base.update(dict_item)
-    if "type" in base:
-        del base["type"]
-    return base
@@ -0,0 +1,194 @@
+'''
+Watches course configuration files for changes using Linux inotify.
+
+The watcher keeps a dependency graph from the watched files to the keys of
+the configuration entries that were parsed from them. Directories, not the
+files, are watched so that files replaced by a rename (e.g. git checkout or
+an editor save) are noticed too.
+
+'''
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM \
+    | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT = struct.Struct('iIII')
+
+
+def _libc():
+    if not sys.platform.startswith('linux'):
+        raise OSError("inotify is only available on Linux")
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError("inotify is not supported by the C library")
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+class FileWatcher:
+    '''
+    Maps file changes to the keys that depend on the files.
+    '''
+
+    def __init__(self):
+        '''
+        Creates an inotify instance.
+
+        @raises OSError: if inotify is not available
+        '''
+        self._libc = _libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self._wds = {}
+        self._dirs = {}
+        self._dependents = {}
+        self._dir_dependents = {}
+        self._sources = {}
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _watch_dir(self, directory):
+        if directory in self._dirs:
+            return True
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            return False
+        self._dirs[directory] = wd
+        self._wds[wd] = directory
+        return True
+
+    def watch(self, key, paths):
+        '''
+        Registers a key to depend on files. Registration must happen before
+        the files are checked, so that no change is missed in between.
+
+        @type key: C{tuple}
+        @param key: a key of the dependent entry
+        @type paths: C{iterable}
+        @param paths: paths to the files that the entry was parsed from
+        @rtype: C{bool}
+        @return: False if some directory could not be watched
+        '''
+        self.forget(key)
+        watched = set()
+        ok = True
+        for path in paths:
+            for p in set((os.path.abspath(path), os.path.realpath(path))):
+                ok = self._watch_dir(os.path.dirname(p)) and ok
+                watched.add(p)
+                self._dependents.setdefault(p, set()).add(key)
+        self._sources[key] = watched
+        if not ok:
+            self.forget(key)
+        return ok
+
+    def watch_directory(self, key, directory):
+        '''
+        Registers a key to depend on the entries of a directory.
+
+        @type key: C{tuple}
+        @param key: a key of the dependent entry
+        @type directory: C{str}
+        @param directory: a path to the directory
+        @rtype: C{bool}
+        @return: False if the directory could not be watched
+        '''
+        if not self._watch_dir(directory):
+            return False
+        self._dir_dependents.setdefault(directory, set()).add(key)
+        return True
+
+    def watching(self, key):
+        return key in self._sources
+
+    def forget(self, key):
+        '''
+        Removes the file dependencies of a key.
+
+        @type key: C{tuple}
+        @param key: a key of the dependent entry
+        '''
+        for path in self._sources.pop(key, ()):
+            keys = self._dependents.get(path)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependents[path]
+
+    def forget_all(self):
+        self._dependents.clear()
+        self._dir_dependents.clear()
+        self._sources.clear()
+
+    def _read(self):
+        data = b''
+        while True:
+            try:
+                chunk = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return data
+            if not chunk:
+                return data
+            data += chunk
+
+    def changes(self):
+        '''
+        Reads the pending file events without blocking. The changed keys
+        are forgotten, and must be registered again when they are reloaded.
+
+        @rtype: C{tuple}
+        @return: a set of the changed keys, True if events were lost
+        '''
+        data = self._read()
+        changed = set()
+        overflow = False
+        i = 0
+        while i < len(data):
+            wd, mask, _cookie, length = EVENT.unpack_from(data, i)
+            name = os.fsdecode(data[i + EVENT.size:i + EVENT.size + length].rstrip(b'\0'))
+            i += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            directory = self._wds.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                # The directory is gone, every file in it is affected.
+                del self._wds[wd]
+                del self._dirs[directory]
+                prefix = directory + os.sep
+                for path, keys in self._dependents.items():
+                    if path.startswith(prefix):
+                        changed.update(keys)
+                changed.update(self._dir_dependents.pop(directory, ()))
+                continue
+            if name:
+                changed.update(self._dependents.get(os.path.join(directory, name), ()))
+                changed.update(self._dir_dependents.get(directory, ()))
+        for key in changed:
+            self.forget(key)
+        return changed, overflow
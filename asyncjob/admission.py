@@ -0,0 +1,303 @@
+'''
+Admission control for the grading containers. During deadline rushes one
+course could otherwise flood the cluster with containers and starve the
+others. The number of containers is limited in total
+(settings.CONTAINER_LIMIT_TOTAL), per course (CONTAINER_LIMIT_COURSE)
+and per exercise (CONTAINER_LIMIT_EXERCISE). The jobs over the limits are
+held in the AsyncJob queue in the CREATED state and released when the
+containers complete.
+
+The jobs are in priority lanes (models.JobPriority), see priority_lane.
+The free containers go to the highest lane first. A waiting job moves up
+a lane every settings.PRIORITY_AGING seconds, so the lower lanes are not
+starved. Within a lane, the containers go to the course with the least
+running containers relative to its weight (settings.CONTAINER_COURSE_WEIGHTS,
+1 by default), and in submission order within a course. A course that
+submits in bulk thus gets its share but cannot block the others.
+
+'''
+import logging
+from collections import Counter, OrderedDict
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import AsyncJob, ContainerState, JobPriority
+
+
+logger = logging.getLogger('grader.asyncjob')
+
+# jobs that hold a container or are about to get one
+ACTIVE_STATES = (
+    ContainerState.ORDERED.value,
+    ContainerState.SCHEDULED.value,
+    ContainerState.RUNNING.value,
+)
+
+# lock of the release pass (PostgreSQL advisory lock)
+RELEASE_LOCK = 0x61646d74
+
+
+class AdmissionController:
+    '''
+    Decides which of the waiting jobs may have a container.
+    '''
+
+    def __init__(self, total=None, per_course=None, per_exercise=None, weights=None,
+            aging=None):
+        '''
+        @type total: C{int}
+        @param total: limit of all containers, None for no limit
+        @type per_course: C{int}
+        @param per_course: limit of containers per course, None for no limit
+        @type per_exercise: C{int}
+        @param per_exercise: limit of containers per exercise, None for no limit
+        @type weights: C{dict}
+        @param weights: course weights by course key, 1 by default
+        @type aging: C{float}
+        @param aging: seconds of waiting that raise a job by a lane, None for no aging
+        '''
+        self.total = total
+        self.per_course = per_course
+        self.per_exercise = per_exercise
+        self.weights = weights or {}
+        self.aging = aging
+        self.running = 0
+        self.running_courses = Counter()
+        self.running_exercises = Counter()
+        # course key -> jobs in submission order
+        self.waiting = OrderedDict()
+
+    def add_running(self, course_key, exercise_key):
+        '''
+        Counts a job that holds a container.
+        '''
+        self.running += 1
+        self.running_courses[course_key] += 1
+        self.running_exercises[(course_key, exercise_key)] += 1
+
+    def complete(self, course_key, exercise_key, now=None):
+        '''
+        Releases the container of a job and admits the jobs that now fit.
+
+        @rtype: C{list}
+        @return: the admitted jobs
+        '''
+        self.running -= 1
+        self.running_courses[course_key] -= 1
+        self.running_exercises[(course_key, exercise_key)] -= 1
+        return self.admit(now)
+
+    def enqueue(self, job_id, course_key, exercise_key,
+            priority=JobPriority.NORMAL.value, since=0.0):
+        '''
+        Adds a job to the end of the waiting jobs of its course.
+
+        @type priority: C{int}
+        @param priority: the priority lane, see models.JobPriority
+        @type since: C{float}
+        @param since: the time when the job started to wait, in seconds
+        '''
+        self.waiting.setdefault(course_key, []).append(
+            (job_id, course_key, exercise_key, priority, since))
+
+    def lane(self, priority, since, now):
+        '''
+        @rtype: C{int}
+        @return: the lane of a job including the aging
+        '''
+        if self.aging and now is not None:
+            priority += int(max(0, now - since) // self.aging)
+        return min(priority, JobPriority.HIGH.value)
+
+    def admit(self, now=None):
+        '''
+        Admits waiting jobs as long as the limits allow.
+
+        @type now: C{float}
+        @param now: the current time in seconds for the aging
+        @rtype: C{list}
+        @return: the admitted jobs as (job id, course key, exercise key)
+        '''
+        admitted = []
+        while self.total is None or self.running < self.total:
+            best = None
+            for course_key, jobs in self.waiting.items():
+                if self.per_course is not None \
+                        and self.running_courses[course_key] >= self.per_course:
+                    continue
+                index, lane = self._next_job(jobs, now)
+                if index is None:
+                    continue
+                load = self.running_courses[course_key] / self.weights.get(course_key, 1)
+                key = (-lane, load, jobs[index][0])
+                if best is None or key < best[0]:
+                    best = (key, course_key, index)
+            if best is None:
+                break
+            _, course_key, index = best
+            job = self.waiting[course_key].pop(index)
+            if not self.waiting[course_key]:
+                del self.waiting[course_key]
+            self.add_running(job[1], job[2])
+            admitted.append(job[:3])
+        return admitted
+
+    def _next_job(self, jobs, now):
+        # The first job of the highest lane whose exercise is under its
+        # limit, so that a full exercise does not block the other exercises
+        # of the course.
+        best = (None, None)
+        for index, (job_id, course_key, exercise_key, priority, since) in enumerate(jobs):
+            if self.per_exercise is not None \
+                    and self.running_exercises[(course_key, exercise_key)] >= self.per_exercise:
+                continue
+            lane = self.lane(priority, since, now)
+            if best[1] is None or lane > best[1]:
+                best = (index, lane)
+                if lane == JobPriority.HIGH.value:
+                    break
+        return best
+
+
+def enabled():
+    '''
+    @rtype: C{bool}
+    @return: True if the containers are limited
+    '''
+    return any(limit is not None for limit in (
+        settings.CONTAINER_LIMIT_TOTAL,
+        settings.CONTAINER_LIMIT_COURSE,
+        settings.CONTAINER_LIMIT_EXERCISE,
+    ))
+
+
+def release(now=None):
+    '''
+    Marks the held jobs that the limits admit as ORDERED. A job that has
+    stayed in an active state for settings.CONTAINER_ADMISSION_TIMEOUT
+    seconds is considered lost and no longer holds a container. The lost
+    ORDERED jobs, whose order task never ran, are admitted again.
+
+    @type now: C{datetime.datetime}
+    @param now: the current time, by default now
+    @rtype: C{list}
+    @return: the admitted jobs as (job id, CONTAINER_SCRIPT command line)
+    '''
+    now = now or timezone.now()
+    controller = AdmissionController(
+        settings.CONTAINER_LIMIT_TOTAL,
+        settings.CONTAINER_LIMIT_COURSE,
+        settings.CONTAINER_LIMIT_EXERCISE,
+        settings.CONTAINER_COURSE_WEIGHTS,
+        settings.PRIORITY_AGING,
+    )
+    with transaction.atomic():
+        # Concurrent passes would admit the same free containers.
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [RELEASE_LOCK])
+        since = now - timedelta(seconds=settings.CONTAINER_ADMISSION_TIMEOUT)
+        for course_key, exercise_key in AsyncJob.objects.filter(
+                container_state__in=ACTIVE_STATES,
+                container_state_updated__gte=since)\
+                .values_list('course_key', 'exercise_key'):
+            controller.add_running(course_key, exercise_key)
+        # An order that has not reached a worker in time was lost.
+        for job_id, course_key, exercise_key, priority, created_at in AsyncJob.objects.filter(
+                Q(container_state=ContainerState.CREATED.value)
+                | Q(container_state=ContainerState.ORDERED.value,
+                    container_state_updated__lt=since))\
+                .order_by('id').values_list('id', 'course_key', 'exercise_key',
+                    'priority', 'created_at'):
+            controller.enqueue(job_id, course_key, exercise_key,
+                priority, created_at.timestamp())
+        ids = [job[0] for job in controller.admit(now.timestamp())]
+        if not ids:
+            return []
+        AsyncJob.objects.filter(id__in=ids).update(
+            container_state=ContainerState.ORDERED.value,
+            container_state_updated=now)
+    return [
+        (job_id, meta.get('cmd'))
+        for job_id, meta in AsyncJob.objects.filter(id__in=ids)\
+            .order_by('id').values_list('id', 'submission_meta')
+    ]
+
+
+def hold(job_ids):
+    '''
+    Returns admitted jobs whose orders could not be queued to the held jobs.
+
+    @type job_ids: C{list}
+    @param job_ids: ids of the ORDERED jobs
+    '''
+    AsyncJob.objects.filter(id__in=job_ids, container_state=ContainerState.ORDERED.value)\
+        .update(container_state=ContainerState.CREATED.value,
+            container_state_updated=timezone.now())
+
+
+def priority_lane(course, exercise, attempt, now=None):
+    '''
+    Selects the priority lane of a submission. The lane is set with
+    `container.priority` (low, normal or high) in the exercise. The
+    submissions after settings.PRIORITY_RESUBMISSIONS attempts drop a lane,
+    and the submissions during the last settings.PRIORITY_DEADLINE_WINDOW
+    seconds before the module closes rise a lane.
+
+    @type course: C{dict}
+    @param course: a course configuration
+    @type exercise: C{dict}
+    @param exercise: an exercise configuration
+    @type attempt: C{int}
+    @param attempt: the ordinal number of the submission
+    @type now: C{datetime.datetime}
+    @param now: the current time, by default now
+    @rtype: C{int}
+    @return: the priority, see models.JobPriority
+    '''
+    name = str(exercise.get("container", {}).get("priority", "normal")).upper()
+    if name not in JobPriority.__members__:
+        # The configuration is checked when it is loaded, and the
+        # submission is already stored.
+        logger.warning("Invalid container priority %r in exercise %s, using normal.",
+            name.lower(), exercise.get("key"))
+        name = JobPriority.NORMAL.name
+    priority = JobPriority[name].value
+    if settings.PRIORITY_RESUBMISSIONS and attempt > settings.PRIORITY_RESUBMISSIONS:
+        priority -= 1
+    close = _module_close(course, exercise.get("key"))
+    if close is not None and settings.PRIORITY_DEADLINE_WINDOW:
+        left = (close - (now or timezone.now())).total_seconds()
+        if 0 <= left <= settings.PRIORITY_DEADLINE_WINDOW:
+            priority += 1
+    return max(JobPriority.LOW.value, min(priority, JobPriority.HIGH.value))
+
+
+def _module_close(course, exercise_key):
+    # The close date of the module of an exercise, if it is set as a date.
+    def contains(parent):
+        return any(
+            str(child.get("key")) == exercise_key or contains(child)
+            for child in parent.get("children", ())
+        )
+    for module in course.get("modules", ()):
+        if "close" in module and contains(module):
+            close = module["close"]
+            if isinstance(close, str):
+                try:
+                    close = parse_datetime(close) or parse_datetime(close + " 00:00")
+                except ValueError:
+                    return None
+            elif isinstance(close, date) and not isinstance(close, datetime):
+                close = datetime.combine(close, time())
+            if not isinstance(close, datetime):
+                return None
+            if timezone.is_naive(close):
+                close = timezone.make_aware(close)
+            return close
+    return None
@@ -0,0 +1,435 @@
+'''
+Archives of the directories that the grading containers download. The
+submission archives are streamed as they are compressed, see
+stream_archive, and stream_chunks sends the chunks of a submission that a
+grading node does not have yet. An archive of an exercise or a
+personalized exercise is built once per content version and kept in
+settings.CONTAINER_ARCHIVE_PATH, so that the pods of an exercise get the
+same file instead of each compressing the directory again. The version is
+a hash of the names, sizes and modification times of the files, so any
+change of the course content builds a new archive. The SHA-256 digest of
+each archive is kept next to it, so that the grading nodes can cache the
+archives by their content (archive_digest).
+
+'''
+import fcntl
+import grp
+import hashlib
+import logging
+import os
+import pwd
+import shutil
+import stat
+import tarfile
+import tempfile
+import time
+import zlib
+from functools import lru_cache
+
+from django.conf import settings
+
+from access.snapshot import read_generation
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+logger = logging.getLogger('grader.asyncjob')
+
+# archive compressions in the order of preference
+ENCODINGS = ('zstd', 'gzip', 'identity')
+CONTENT_TYPES = {
+    'zstd': ('application/zstd', '.tar.zst'),
+    'gzip': ('application/gzip', '.tar.gz'),
+    'identity': ('application/x-tar', '.tar'),
+}
+CHUNK_SIZE = 256 * 1024
+# Refresh the modification time of a used archive at most this often.
+TOUCH_INTERVAL = 3600
+
+
+def archive_encoding(accept_encoding):
+    '''
+    Chooses the compression of an archive from an Accept-Encoding header:
+    zstd (if the zstandard module is installed), gzip or identity (a plain
+    tar). Without the header the archive is compressed with gzip.
+
+    @type accept_encoding: C{str}
+    @param accept_encoding: the header value or None
+    @rtype: C{str}
+    @return: an encoding in ENCODINGS
+    '''
+    if not accept_encoding:
+        return 'gzip'
+    accepted = set()
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        q = params.strip().replace(' ', '')
+        if q.startswith('q=') and _is_zero(q[2:]):
+            continue
+        accepted.add(name.strip().lower())
+    for encoding in ENCODINGS:
+        if encoding in accepted or '*' in accepted:
+            if encoding != 'zstd' or zstandard is not None:
+                return encoding
+    return 'identity'
+
+
+def _is_zero(q):
+    try:
+        return float(q) == 0
+    except ValueError:
+        return False
+
+
+class _Identity:
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+def _compressor(encoding):
+    if encoding == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor().compressobj()
+    return _Identity()
+
+
+def _compress(blocks, encoding):
+    compressor = _compressor(encoding)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    data = compressor.flush()
+    if data:
+        yield data
+
+
+def stream_archive(path, encoding='gzip', chunk_size=CHUNK_SIZE):
+    '''
+    Generates a tar archive of a directory in chunks as the files are
+    read, so that the memory use does not depend on the size of the files.
+    The archive has the same members as tarfile.add(path, arcname='.').
+
+    @type path: C{str}
+    @param path: the directory
+    @type encoding: C{str}
+    @param encoding: the compression, see archive_encoding
+    @type chunk_size: C{int}
+    @param chunk_size: bytes read from a file at a time
+    @rtype: C{generator}
+    @return: the chunks of the archive as C{bytes}
+    '''
+    return _compress(_tar_blocks(path, chunk_size), encoding)
+
+
+def write_archive(path, fileobj, encoding='gzip'):
+    '''
+    Writes a tar archive of a directory, see stream_archive.
+
+    @type path: C{str}
+    @param path: the directory
+    @type fileobj: C{file}
+    @param fileobj: a binary file to write to
+    @type encoding: C{str}
+    @param encoding: the compression, see archive_encoding
+    '''
+    for data in stream_archive(path, encoding):
+        fileobj.write(data)
+
+
+@lru_cache(maxsize=64)
+def _user_name(uid):
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return ''
+
+
+@lru_cache(maxsize=64)
+def _group_name(gid):
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return ''
+
+
+def _tar_blocks(path, chunk_size):
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in [root] + sorted(os.path.join(root, f) for f in files):
+            try:
+                st = os.lstat(name)
+            except OSError:
+                continue
+            info = tarfile.TarInfo('.' if name == path else './' + os.path.relpath(name, path))
+            info.mode = stat.S_IMODE(st.st_mode)
+            info.mtime = int(st.st_mtime)
+            info.uid, info.gid = st.st_uid, st.st_gid
+            info.uname, info.gname = _user_name(st.st_uid), _group_name(st.st_gid)
+            if stat.S_ISDIR(st.st_mode):
+                info.type = tarfile.DIRTYPE
+            elif stat.S_ISLNK(st.st_mode):
+                info.type = tarfile.SYMTYPE
+                info.linkname = os.readlink(name)
+            elif stat.S_ISREG(st.st_mode):
+                info.type = tarfile.REGTYPE
+                info.size = st.st_size
+            else:
+                continue
+            try:
+                f = open(name, 'rb') if info.type == tarfile.REGTYPE else None
+            except OSError as e:
+                logger.warning("Skipping %s in the archive: %s", name, e)
+                continue
+            yield info.tobuf(tarfile.GNU_FORMAT, 'utf-8', 'surrogateescape')
+            if f is not None:
+                with f:
+                    yield from _file_blocks(f, info.size, chunk_size)
+    yield bytes(2 * tarfile.BLOCKSIZE)
+
+
+def _file_blocks(f, size, chunk_size):
+    # The size is in the header, so a file that changes meanwhile is cut
+    # or padded with zeros.
+    left = size
+    while left > 0:
+        data = f.read(min(chunk_size, left))
+        if not data:
+            data = bytes(min(chunk_size, left))
+        left -= len(data)
+        yield data
+    remainder = size % tarfile.BLOCKSIZE
+    if remainder:
+        yield bytes(tarfile.BLOCKSIZE - remainder)
+
+
+def stream_chunks(chunks, encoding='gzip', chunk_size=CHUNK_SIZE):
+    '''
+    Generates a tar archive of parts of files, see stream_archive.
+
+    @type chunks: C{list}
+    @param chunks: the members as (name, file path, offset, size)
+    @type encoding: C{str}
+    @param encoding: the compression, see archive_encoding
+    @rtype: C{generator}
+    @return: the chunks of the archive as C{bytes}
+    '''
+    return _compress(_chunk_blocks(chunks, chunk_size), encoding)
+
+
+def _chunk_blocks(chunks, chunk_size):
+    for name, path, offset, size in chunks:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mode = 0o644
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            yield info.tobuf(tarfile.GNU_FORMAT, 'utf-8', 'surrogateescape')
+            yield from _file_blocks(f, size, chunk_size)
+    yield bytes(2 * tarfile.BLOCKSIZE)
+
+
+def directory_version(path):
+    '''
+    @type path: C{str}
+    @param path: a directory
+    @rtype: C{str}
+    @return: a hex digest that changes when any file in the directory changes
+    '''
+    version = hashlib.sha1()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in [root] + sorted(os.path.join(root, f) for f in files):
+            try:
+                st = os.lstat(name)
+            except OSError:
+                continue
+            version.update(("%s\0%d\0%d\0%o\n" % (
+                os.path.relpath(name, path), st.st_size, st.st_mtime_ns, st.st_mode,
+            )).encode('utf-8', 'surrogateescape'))
+    return version.hexdigest()
+
+
+def _git_head(path):
+    # The commit checked out in a git working directory, or None.
+    git_dir = os.path.join(path, '.git')
+    try:
+        if os.path.isfile(git_dir):
+            with open(git_dir) as f:
+                git_dir = os.path.join(path, f.read().strip()[len('gitdir:'):].strip())
+        with open(os.path.join(git_dir, 'HEAD')) as f:
+            head = f.read().strip()
+        if not head.startswith('ref:'):
+            return head
+        ref = head[len('ref:'):].strip()
+        try:
+            with open(os.path.join(git_dir, ref)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            with open(os.path.join(git_dir, 'packed-refs')) as f:
+                for line in f:
+                    if line.rstrip('\n').endswith(' ' + ref):
+                        return line.split(' ', 1)[0]
+    except OSError:
+        pass
+    return None
+
+
+def checkout_version(course_dir, course_key):
+    '''
+    Gets the version of a course directory that is a git checkout (see
+    gitmanager): the checked out commit and the course generation, which
+    `manage.py compile_courses` bumps after the course has been built.
+    Reading it does not depend on the number of the files.
+
+    @type course_dir: C{str}
+    @param course_dir: the course directory
+    @type course_key: C{str}
+    @param course_key: the course key
+    @rtype: C{str}
+    @return: the version, or None if the directory is not a git checkout
+    '''
+    commit = _git_head(course_dir)
+    if not commit:
+        return None
+    return "%s-%d" % (commit, read_generation(course_key))
+
+
+def cached_archive(path, version=None):
+    '''
+    Opens the archive of a version of a directory, building it if
+    necessary. Concurrent requests wait for one process to build it, and
+    the archives of the older versions are removed. The archive is opened
+    under a shared lock, so it is not removed between finding and opening
+    it.
+
+    @type path: C{str}
+    @param path: the directory
+    @type version: C{str}
+    @param version: the version of the directory, e.g. from
+        checkout_version, by default the directory_version
+    @rtype: C{tuple}
+    @return: the open archive file and its SHA-256 hex digest
+    '''
+    path = os.path.realpath(path)
+    directory = os.path.join(settings.CONTAINER_ARCHIVE_PATH,
+        hashlib.sha1(path.encode('utf-8', 'surrogateescape')).hexdigest())
+    archive = os.path.join(directory, (version or directory_version(path)) + '.tar.gz')
+
+    while True:
+        os.makedirs(directory, exist_ok=True)
+        try:
+            lock = open(os.path.join(directory, '.lock'), 'a')
+        except FileNotFoundError:
+            # The directory was pruned in between.
+            continue
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            if not os.path.exists(archive):
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if _removed(lock):
+                    continue
+                if not os.path.exists(archive):
+                    _build_archive(path, directory, archive)
+                    prune_archives()
+            elif _removed(lock):
+                continue
+            f = open(archive, 'rb')
+            try:
+                if time.time() - os.fstat(f.fileno()).st_mtime > TOUCH_INTERVAL:
+                    # The archives that are not used are pruned.
+                    os.utime(archive)
+                return f, archive_digest(archive)
+            except:
+                f.close()
+                raise
+
+
+def _removed(lock):
+    # The directory of the lock was pruned while waiting for the lock.
+    return os.fstat(lock.fileno()).st_nlink == 0
+
+
+def prune_archives():
+    '''
+    Removes the archive directories of the paths whose archives have not
+    been used for settings.CONTAINER_ARCHIVE_MAX_AGE seconds, e.g. the
+    removed exercises and personalized exercise instances.
+    '''
+    if not settings.CONTAINER_ARCHIVE_MAX_AGE:
+        return
+    expired = time.time() - settings.CONTAINER_ARCHIVE_MAX_AGE
+    try:
+        entries = list(os.scandir(settings.CONTAINER_ARCHIVE_PATH))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if not entry.is_dir() or any(
+                    e.stat().st_mtime >= expired
+                    for e in os.scandir(entry.path) if e.name.endswith('.tar.gz')):
+                continue
+            with open(os.path.join(entry.path, '.lock'), 'a') as lock:
+                # A directory in use is left for the next time.
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                shutil.rmtree(entry.path)
+        except OSError:
+            continue
+        logger.info("Removed the unused archives %s", entry.path)
+
+
+def _build_archive(path, directory, archive):
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        digest = hashlib.sha256()
+        with os.fdopen(fd, 'wb') as f:
+            for data in stream_archive(path):
+                f.write(data)
+                digest.update(data)
+        # The digest is in place before the archive, see archive_digest.
+        with open(_digest_path(archive), 'w') as f:
+            f.write(digest.hexdigest())
+        os.replace(tmp_path, archive)
+    except:
+        os.unlink(tmp_path)
+        raise
+    logger.info("Built the archive of %s", path)
+    # The processes that have opened an old archive keep sending it.
+    current = (os.path.basename(archive), os.path.basename(_digest_path(archive)))
+    for name in os.listdir(directory):
+        if name.endswith(('.tar.gz', '.sha256')) and name not in current:
+            try:
+                os.unlink(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def _digest_path(archive):
+    return archive[:-len('.tar.gz')] + '.sha256'
+
+
+def archive_digest(archive):
+    '''
+    @type archive: C{str}
+    @param archive: the path of an archive from cached_archive
+    @rtype: C{str}
+    @return: the SHA-256 hex digest of the archive file
+    '''
+    try:
+        with open(_digest_path(archive)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    digest = hashlib.sha256()
+    with open(archive, 'rb') as f:
+        for data in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import os
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from asyncjob.tasks import record_pod_events
+from asyncjob.watcher import PodWatcher
+
+
+logger = logging.getLogger('grader.asyncjob')
+
+
+class Command(BaseCommand):
+    help = "Watch the grading pods in Kubernetes and record their states in the asynchronous jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--namespace", default="grader",
+                help="Namespace of the grading pods")
+        parser.add_argument("--label-selector", default="mooc-grader,sid",
+                help="Label selector of the grading pods")
+        parser.add_argument("--kubeconfig", default=None,
+                help="Kubernetes client configuration. By default the in-cluster "
+                "configuration or ~/.kube/config is used.")
+        parser.add_argument("--batch-size", type=int, default=100,
+                help="Most events recorded at a time")
+        parser.add_argument("--batch-interval", type=float, default=1.0,
+                help="Seconds that events are collected to a batch")
+        parser.add_argument("--timeout", type=int, default=300,
+                help="Seconds after which a watch request is renewed")
+
+    def handle(self, *args, **options):
+        try:
+            from kubernetes_asyncio import client, config, watch
+        except ImportError:
+            raise CommandError("The kube_watcher requires kubernetes_asyncio, "
+                "see kube_watcher/requirements.txt")
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        if options["kubeconfig"] is None and "KUBERNETES_SERVICE_HOST" in os.environ:
+            config.load_incluster_config()
+        else:
+            loop.run_until_complete(config.load_kube_config(config_file=options["kubeconfig"]))
+        v1 = client.CoreV1Api()
+        namespace = options["namespace"]
+        selector = options["label_selector"]
+
+        async def list_pods():
+            pods = await v1.list_namespaced_pod(namespace, label_selector=selector)
+            return pods.items, pods.metadata.resource_version
+
+        async def watch_pods(version):
+            async with watch.Watch().stream(v1.list_namespaced_pod, namespace,
+                    label_selector=selector, resource_version=version,
+                    timeout_seconds=options["timeout"]) as stream:
+                async for event in stream:
+                    yield event
+
+        watcher = PodWatcher(list_pods, watch_pods, record_pod_events,
+            state_path=settings.KUBE_WATCHER_STATE,
+            batch_size=options["batch_size"],
+            batch_interval=options["batch_interval"])
+        logger.info("Watching the pods of %s from version %s", namespace,
+            watcher.resource_version or "(list)")
+
+        # The events of the current batch are recorded before exiting.
+        task = loop.create_task(watcher.run())
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, task.cancel)
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-18 07:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asyncjob', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='asyncjob',
+            name='container_state',
+            field=models.CharField(choices=[('c', 'CREATED'), ('o', 'ORDERED'), ('s', 'SCHEDULED'), ('r', 'RUNNING'), ('f', 'COMPLETED')], db_index=True, default='c', max_length=1),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-18 07:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asyncjob', '0002_container_state_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asyncjob',
+            name='container_state_updated',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='asyncjob',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='asyncjob',
+            name='init_start',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='asyncjob',
+            name='main_end',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='asyncjob',
+            name='main_start',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-18 07:08
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asyncjob', '0003_asyncjob_times'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asyncjob',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'LOW'), (1, 'NORMAL'), (2, 'HIGH')], default=1),
+        ),
+    ]
@@ -3,6 +3,7 @@ from datetime import datetime, timezone
 
 from django.contrib.postgres.fields import JSONField
 from django.db import models
+from django.utils.timezone import now
 
 
 class FieldEnum(Enum):
@@ -19,6 +20,12 @@ class ContainerState(FieldEnum):
     COMPLETED = 'f' # job has completed with success or failure
 
 
+class JobPriority(FieldEnum):
+    LOW = 0    # e.g. practice resubmissions
+    NORMAL = 1
+    HIGH = 2   # e.g. exams and submissions close to the deadline
+
+
 class UploadState(FieldEnum):
     PENDING = 'p'   # upload is not tried yet, waiting to be scheduled
     SCHEDULED = 's' # upload task added to queue
@@ -40,7 +47,24 @@ class AsyncJob(models.Model):
     container_state = models.CharField(
         max_length=1,
         choices=ContainerState.choices(),
-        default=ContainerState.CREATED.value)
+        default=ContainerState.CREATED.value,
+        db_index=True)
+    container_state_updated = models.DateTimeField(
+        null=True,
+        db_index=True)
+    priority = models.PositiveSmallIntegerField(
+        choices=JobPriority.choices(),
+        default=JobPriority.NORMAL.value)
+
+    # times
+    created_at = models.DateTimeField(
+        default=now)
+    init_start = models.DateTimeField(
+        null=True)
+    main_start = models.DateTimeField(
+        null=True)
+    main_end = models.DateTimeField(
+        null=True)
 
     # upload
     upload_url = models.URLField()
@@ -57,9 +81,31 @@ class AsyncJob(models.Model):
     upload_at = models.DateTimeField(
         null=True)
 
+    # jobs that wait for a container
+    WAITING_STATES = (
+        ContainerState.CREATED.value,
+        ContainerState.ORDERED.value,
+        ContainerState.SCHEDULED.value,
+    )
+
+    def queued_before(self):
+        # number of jobs that wait for a container before this one, i.e.
+        # the earlier jobs of the same priority and the higher priorities
+        return AsyncJob.objects.filter(
+            models.Q(priority__gt=self.priority)
+            | models.Q(priority=self.priority, id__lt=self.id),
+            container_state__in=self.WAITING_STATES).count()
+
+    def _prepare_priority(self, priority):
+        if isinstance(priority, JobPriority):
+            priority = priority.value
+        return priority
+
     def _prepare_container_state(self, new_state):
         if isinstance(new_state, ContainerState):
             new_state = new_state.value
+        if new_state != self.container_state:
+            self.container_state_updated = datetime.now(tz=timezone.utc)
         return new_state
 
     def _prepare_upload_state(self, new_state):
@@ -71,12 +117,13 @@ class AsyncJob(models.Model):
 
     def _prepare_upload_code(self, code):
         self.upload_attempt += 1
-        self.upload_at = datetime.now(tz.timezone.utc)
+        self.upload_at = datetime.now(tz=timezone.utc)
         return code
 
     def __setattr__(self, name, value):
-        # if `_prepare_<name>` exists, call it before setting the value
+        # if `_prepare_<name>` exists, call it before setting the value,
+        # except for the initial values set by Model.__init__
         func = getattr(self, '_prepare_' + name, None)
-        if func is not None and callable(func):
+        if func is not None and callable(func) and name in self.__dict__:
             value = func(value)
         super().__setattr__(name, value)
@@ -3,8 +3,16 @@ from functools import partial
 from celery import bootsteps, shared_task
 from celery.exceptions import Ignore
 from celery.utils.log import get_task_logger
+from django.utils import timezone, translation
 from kombu import Consumer, Exchange, Queue
 
+from access.config import config
+from util.http import post_system_error
+from util.shell import invoke
+from . import admission
+from .models import AsyncJob, ContainerState
+from .watcher import apply_events, message_event
+
 
 logger = get_task_logger(__name__)
 task = partial(shared_task, bind=True, ignore_result=True)
@@ -20,92 +28,56 @@ def container_completed(self, state, meta, times):
 
 ## Schedule jobs
 
-def _acceptSubmission(request, course, exercise, post_url, sdir):
-    '''
-    Queues the submission for grading.
-    '''
-    uids = get_uid(request)
-    attempt = int(request.GET.get("ordinal_number", 1))
-
-    if "submission_url" in request.GET:
-        surl = request.GET["submission_url"]
-        surl_missing = False
+@task()
+def order_container(self, job_id, cmd):
+    """
+    Orders the grading container of a submission that was accepted as
+    the AsyncJob `job_id`. `cmd` is the CONTAINER_SCRIPT command line.
+    """
+    # The states are changed conditionally, because the container may post
+    # its result, or the kube_watcher record it, before the order returns.
+    scheduled = AsyncJob.objects.filter(id=job_id, container_state__in=(
+            ContainerState.CREATED.value, ContainerState.ORDERED.value))\
+        .update(container_state=ContainerState.SCHEDULED.value,
+            container_state_updated=timezone.now())
+    if not scheduled:
+        logger.error("Container order for a missing or already ordered job %s", job_id)
+        raise Ignore()
+
+    r = invoke(cmd)
+    if r["code"] != 0:
+        logger.error("Container order failed for job %s exit=%d out=%s err=%s",
+            job_id, r["code"], r["out"], r["err"])
+        completed = AsyncJob.objects.filter(id=job_id)\
+            .exclude(container_state=ContainerState.COMPLETED.value)\
+            .update(container_state=ContainerState.COMPLETED.value,
+                container_state_updated=timezone.now())
+        if completed and admission.enabled():
+            # The failed order freed its container.
+            release_jobs.delay()
     else:
-        LOGGER.warning("submission_url missing from a request")
-        surl = request.build_absolute_uri(reverse('test-result'))
-        surl_missing = True
-
-    # Order container for grading.
-    c = _requireContainer(exercise)
-
-    course_extra = {
-        "key": course["key"],
-        "name": course["name"],
-    }
-    exercise_extra = {
-        "key": exercise["key"],
-        "title": exercise.get("title", None),
-        "resources": c.get("resources", {}), # Unofficial param, implemented differently later
-        "require_constant_environment": c.get("require_constant_environment", False) # Unofficial param, implemented differently later
-    }
-    if exercise.get("personalized", False):
-        exercise_extra["personalized_exercise"] \
-            = select_generated_exercise_instance(course, exercise, uids, attempt)
-
-    job = AsyncJob(
-        course_key=course['key'],
-        exercise_key=exercise['key'],
-        lang=translation.get_language(), # FIXME
-        upload_url=surl,
-        submission_meta={
-            'uids': uids,
-            'personalized_exercise': exercise_extra.get("personalized_exercise"),
-        },
-    )
-
-    sid = os.path.basename(sdir)
-    write_submission_meta(sid, {
-        "url": surl,
-        "dir": sdir,
-        'personalized_exercise': exercise_extra.get("personalized_exercise"),
-        "course_key": course["key"],
-        "exercise_key": exercise["key"],
-        "lang": translation.get_language(),
-    })
-    r = invoke([
-        settings.CONTAINER_SCRIPT,
-        sid,
-        request.scheme + "://" + request.get_host(),
-        c["image"],
-        os.path.join(DIR, course["key"], c["mount"]),
-        sdir,
-        c["cmd"],
-        json.dumps(course_extra),
-        json.dumps(exercise_extra),
-    ])
-    LOGGER.debug("Container order exit=%d out=%s err=%s",
-        r["code"], r["out"], r["err"])
-    qlen = 1
-
-    return render_template(request, course, exercise, post_url,
-        "access/async_accepted.html", {
-            "error": r['code'] != 0,
-            "accepted": True,
-            "wait": True,
-            "missing_url": surl_missing,
-            "queue": qlen
-        })
-
-
-
-
-def invoke_script(args):
-    from util.files import create_submission_dir, save_submitted_file, \
-        clean_submission_dir, write_submission_file, write_submission_meta
-    from util.shell import invoke
-    r = invoke(args)
-    logger.debug("Container order exit=%d out=%s err=%s",
-        r["code"], r["out"], r["err"])
+        logger.debug("Container order exit=%d out=%s err=%s",
+            r["code"], r["out"], r["err"])
+        AsyncJob.objects.filter(id=job_id, container_state=ContainerState.SCHEDULED.value)\
+            .update(container_state=ContainerState.RUNNING.value,
+                container_state_updated=timezone.now())
+
+
+@task()
+def release_jobs(self):
+    """
+    Orders the containers of the held jobs that the admission limits allow.
+    """
+    admitted = admission.release()
+    for n, (job_id, cmd) in enumerate(admitted):
+        try:
+            order_container.delay(job_id, cmd)
+        except Exception:
+            # The jobs wait for the next release instead of staying ORDERED.
+            logger.exception("Failed to queue the container orders of %d jobs",
+                len(admitted) - n)
+            admission.hold([job_id for job_id, _ in admitted[n:]])
+            break
 
 
 ## AMQP in queue
@@ -129,11 +101,43 @@ class KubernetesEventConsumerStep(bootsteps.ConsumerStep):
         )]
 
 def kubernetes_event_handler(body, message):
-    print('Pod {}: {} ({})'.format(
-        body.get('meta', {}).get('pod_name'),
+    meta = body.get('meta', {})
+    logger.debug('Pod %s: %s (%s)',
+        meta.get('pod_name'),
         body.get('state', '?'),
-        message.properties.get('correlation_id', ''),
-    ))
-    print("  meta:", body.get('meta'))
-    print("  times:", body.get('times'))
+        message.properties.get('correlation_id', ''))
+    try:
+        record_pod_events([message_event(body)])
+    except Exception:
+        logger.exception("Failed to record the pod event %s", body)
     message.ack()
+
+
+def record_pod_events(events):
+    """
+    Records a batch of pod events (asyncjob.watcher.PodEvent), posts a
+    system error for the pods that died without a result and releases the
+    held jobs when containers were freed.
+    """
+    completed, lost = apply_events(events)
+    for job_id, result in lost:
+        post_container_error.delay(job_id, result.name)
+    if completed and admission.enabled():
+        release_jobs.delay()
+
+
+@task()
+def post_container_error(self, job_id, result):
+    """
+    Posts a system error as the result of the AsyncJob `job_id` whose
+    container died without posting the grading result.
+    """
+    try:
+        job = AsyncJob.objects.get(id=job_id)
+    except AsyncJob.DoesNotExist:
+        raise Ignore()
+    logger.warning("Container of job %s (%s) ended with %s without a result",
+        job_id, job.container_ref, result)
+    with translation.override(job.lang):
+        course, exercise = config.exercise_entry(job.course_key, job.exercise_key, lang=job.lang)
+        post_system_error(job.upload_url, course, exercise)
@@ -1,3 +1,499 @@
-from django.test import TestCase
+import hashlib
+import heapq
+import io
+import json
+import os
+import shutil
+import tarfile
+import asyncio
+import tempfile
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from celery.exceptions import Ignore
+from django.contrib.postgres.fields import JSONField
+from django.test import TestCase, override_settings
+from django.core.urlresolvers import reverse
+
+from .admission import AdmissionController, priority_lane
+from util.files import read_submission_chunks, write_submission_manifest
+from .archives import archive_digest, archive_encoding, cached_archive, checkout_version, \
+    stream_archive, stream_chunks
+from .models import AsyncJob, ContainerState, JobPriority
+from .tasks import order_container, release_jobs
+from .tracker import QueueEstimate, queue_status
+from .watcher import PodResult, PodWatcher, apply_events
+
+
+def create_job(sid, state):
+    # AsyncJob.save does not work with the SQLite JSONField.
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO asyncjob_asyncjob (course_key, exercise_key, lang, "
+            "submission_meta, container_ref, container_state, priority, created_at, "
+            "upload_url, upload_state, upload_code, upload_attempt) "
+            "VALUES ('c', 'e', 'en', '{}', %s, %s, 1, '2020-01-01 00:00:00', "
+            "'http://localhost/', 'p', 0, 0)", [sid, state.value])
+    return AsyncJob.objects.get(container_ref=sid).id
+
+
+def job_state(job_id):
+    return AsyncJob.objects.filter(id=job_id).values_list('container_state', flat=True).get()
+
+
+class ContainerOrderTestCase(TestCase):
+
+    def test_order_container(self):
+        job_id = create_job('a', ContainerState.ORDERED)
+        order_container(job_id, ['true'])
+        self.assertEqual(job_state(job_id), ContainerState.RUNNING.value)
+
+        job_id = create_job('b', ContainerState.CREATED)
+        order_container(job_id, ['false'])
+        self.assertEqual(job_state(job_id), ContainerState.COMPLETED.value)
+
+        # A repeated order does not start another container.
+        with mock.patch('asyncjob.tasks.invoke') as invoke:
+            self.assertRaises(Ignore, order_container, job_id, ['true'])
+        invoke.assert_not_called()
+
+    def test_completed_during_order(self):
+        job_id = create_job('a', ContainerState.ORDERED)
+
+        def complete(cmd):
+            self.assertEqual(job_state(job_id), ContainerState.SCHEDULED.value)
+            AsyncJob.objects.filter(id=job_id).update(
+                container_state=ContainerState.COMPLETED.value)
+            return {"code": 0, "out": "", "err": ""}
+
+        with mock.patch('asyncjob.tasks.invoke', complete):
+            order_container(job_id, ['true'])
+        self.assertEqual(job_state(job_id), ContainerState.COMPLETED.value)
+
+
+class QueueEstimateTestCase(TestCase):
+
+    def test_estimate(self):
+        now = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        # 120 jobs completed in 10 minutes and containers take 30 s.
+        est = QueueEstimate(120, [20, 30, 300, 25, 40], 600)
+        self.assertEqual(est.throughput, 0.2)
+        self.assertEqual(est.service_time, 30)
+        self.assertEqual(est.wait_time(0), 0)
+        self.assertEqual(est.wait_time(10), 50)
+        self.assertEqual(est.completion_time(10, now), now + timedelta(seconds=80))
+
+        # Nothing has completed recently.
+        est = QueueEstimate(0, [30], 600)
+        self.assertEqual(est.completion_time(0, now), now + timedelta(seconds=30))
+        self.assertIsNone(est.completion_time(5, now))
+        self.assertIsNone(QueueEstimate(10, [], 600).completion_time(0, now))
+
+    def test_queue_status(self):
+        create_job('s1', ContainerState.CREATED)
+        create_job('s2', ContainerState.RUNNING)
+        other = create_job('s3', ContainerState.CREATED)
+        AsyncJob.objects.filter(id=other).update(course_key='other')
+        status = queue_status('c', 'e')
+        self.assertEqual(status['waiting'], 1)
+        self.assertEqual(status['running'], 1)
+        self.assertEqual(status['global_queue_length'], 2)
+        self.assertEqual(reverse('queue-status', args=['c', 'e']), '/queue-status/c/e/')
+        self.assertEqual(reverse('queue-status-course', args=['c']), '/queue-status/c/')
+
+
+def simulate(controller, arrivals, duration):
+    # A fake executor that runs each admitted job for `duration`. Returns
+    # the completion times by job id and the busy container time.
+    running = []
+    completed = {}
+    busy = 0
+    arrivals = sorted(arrivals)
+
+    def start(jobs, now):
+        for job in jobs:
+            heapq.heappush(running, (now + duration, job))
+
+    while arrivals or running:
+        if arrivals and (not running or arrivals[0][0] <= running[0][0]):
+            now, job_id, course_key, exercise_key = arrivals.pop(0)
+            controller.enqueue(job_id, course_key, exercise_key)
+            start(controller.admit(), now)
+        else:
+            now, job = heapq.heappop(running)
+            completed[job[0]] = now
+            busy += duration
+            start(controller.complete(job[1], job[2]), now)
+    return completed, busy
+
+
+class AdmissionTestCase(TestCase):
+
+    def test_skewed_load(self):
+        # One course floods the queue with 200 jobs just before two other
+        # courses submit 10 jobs each.
+        arrivals = [(0, n, 'big', 'e') for n in range(200)]
+        arrivals += [(1, 200 + n, 'small%d' % (n % 2), 'e') for n in range(20)]
+        controller = AdmissionController(total=10)
+        completed, busy = simulate(controller, arrivals, 10)
+
+        self.assertEqual(len(completed), 220)
+        self.assertEqual(controller.running, 0)
+        # In submission order the small courses would complete at 210-220.
+        small = [completed[n] for n in range(200, 220)]
+        self.assertLessEqual(max(small), 50)
+        # No container is left idle while jobs wait.
+        self.assertEqual(max(completed.values()), 220)
+        self.assertEqual(busy, 10 * 220)
+
+        # A course limit keeps free containers for the other courses.
+        controller = AdmissionController(total=10, per_course=8)
+        for job in arrivals[:200]:
+            controller.enqueue(*job[1:])
+        self.assertEqual(len(controller.admit()), 8)
+        for job in arrivals[200:]:
+            controller.enqueue(*job[1:])
+        self.assertEqual([job[1] for job in controller.admit()], ['small0', 'small1'])
+
+    def test_weights_and_exercise_limit(self):
+        controller = AdmissionController(total=9, weights={'a': 2})
+        for n in range(20):
+            controller.enqueue(n, 'a' if n < 10 else 'b', 'e')
+        admitted = controller.admit()
+        self.assertEqual([job[1] for job in admitted].count('a'), 6)
+        self.assertEqual(controller.running, 9)
+
+        # A full exercise does not block the other exercises of the course.
+        controller = AdmissionController(per_exercise=2)
+        for n in range(5):
+            controller.enqueue(n, 'a', 'e1')
+        controller.enqueue(5, 'a', 'e2')
+        self.assertEqual([job[0] for job in controller.admit()], [0, 1, 5])
+        self.assertEqual(controller.complete('a', 'e1'), [(2, 'a', 'e1')])
+
+    def test_priority_lanes(self):
+        controller = AdmissionController(total=1, aging=100)
+        controller.enqueue(1, 'a', 'e', JobPriority.LOW.value, 0)
+        controller.enqueue(2, 'a', 'e', JobPriority.NORMAL.value, 50)
+        controller.enqueue(3, 'b', 'e', JobPriority.HIGH.value, 90)
+        self.assertEqual(controller.admit(now=100), [(3, 'b', 'e')])
+        # The low job has aged to the high lane.
+        self.assertEqual(controller.complete('b', 'e', now=200), [(1, 'a', 'e')])
+
+        exercise = {'key': 'e', 'container': {'priority': 'high'}}
+        course = {'modules': [{'key': 'm', 'close': '2020-01-01 12:00',
+            'children': [{'key': 'e'}]}]}
+        now = datetime(2020, 1, 1, 11, 30, tzinfo=timezone.utc)
+        self.assertEqual(priority_lane({}, {'key': 'e'}, 1), JobPriority.NORMAL.value)
+        self.assertEqual(priority_lane({}, {'key': 'e'}, 10), JobPriority.LOW.value)
+        self.assertEqual(priority_lane({}, exercise, 10), JobPriority.NORMAL.value)
+        self.assertEqual(priority_lane(course, {'key': 'e'}, 1, now), JobPriority.HIGH.value)
+        self.assertEqual(priority_lane(course, {'key': 'e'}, 1, now - timedelta(days=1)),
+            JobPriority.NORMAL.value)
+        # An invalid lane does not fail the stored submission.
+        with self.assertLogs('grader.asyncjob', 'WARNING'):
+            self.assertEqual(priority_lane({}, {'key': 'e', 'container': {'priority': 'urgent'}}, 1),
+                JobPriority.NORMAL.value)
+
+
+    @override_settings(CONTAINER_LIMIT_TOTAL=2)
+    @mock.patch.object(JSONField, 'from_db_value', create=True,
+        new=lambda self, value, *args: json.loads(value))
+    def test_lost_orders(self):
+        # The JSONField is read from SQLite as text.
+        lost = create_job('a', ContainerState.ORDERED)
+        create_job('b', ContainerState.ORDERED)
+        held = create_job('c', ContainerState.CREATED)
+        now = datetime.now(timezone.utc)
+        AsyncJob.objects.filter(id=lost).update(container_state_updated=now - timedelta(hours=2))
+        AsyncJob.objects.exclude(id=lost).update(container_state_updated=now)
+
+        # The order of `a` never reached a worker, so it is ordered again.
+        with mock.patch('asyncjob.tasks.order_container.delay',
+                side_effect=[None, OSError('broker down')]) as delay:
+            release_jobs()
+        self.assertEqual([c[0][0] for c in delay.call_args_list], [lost])
+        self.assertEqual(job_state(lost), ContainerState.ORDERED.value)
+
+        # An order that could not be queued returns the job to the held jobs.
+        AsyncJob.objects.filter(id=lost).update(container_state=ContainerState.COMPLETED.value)
+        with mock.patch('asyncjob.tasks.order_container.delay',
+                side_effect=OSError('broker down')) as delay:
+            release_jobs()
+        self.assertEqual([c[0][0] for c in delay.call_args_list], [held])
+        self.assertEqual(job_state(held), ContainerState.CREATED.value)
+
+
+class ArchiveTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp, 'exercise')
+        os.makedirs(os.path.join(self.source, 'tests'))
+        with open(os.path.join(self.source, 'tests', 'test.py'), 'w') as f:
+            f.write('print("ok")\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_cached_archive(self):
+        with override_settings(CONTAINER_ARCHIVE_PATH=os.path.join(self.tmp, 'archives')):
+            f, digest = cached_archive(self.source)
+            with f:
+                archive = f.name
+                self.assertEqual(digest, hashlib.sha256(f.read()).hexdigest())
+            again, _ = cached_archive(self.source)
+            again.close()
+            self.assertEqual(again.name, archive)
+            self.assertEqual(archive_digest(archive), digest)
+            with tarfile.open(archive) as tar:
+                self.assertIn('./tests/test.py', tar.getnames())
+
+            # A changed file builds a new version and removes the old one,
+            # which an earlier request can still send.
+            opened, _ = cached_archive(self.source)
+            with open(os.path.join(self.source, 'tests', 'test.py'), 'w') as f:
+                f.write('print("changed")\n')
+            f, changed_digest = cached_archive(self.source)
+            with f, opened:
+                self.assertNotEqual(f.name, archive)
+                self.assertFalse(os.path.exists(archive))
+                self.assertNotEqual(changed_digest, digest)
+                self.assertEqual(hashlib.sha256(opened.read()).hexdigest(), digest)
+                with tarfile.open(fileobj=f) as tar:
+                    self.assertEqual(tar.extractfile('./tests/test.py').read(),
+                        b'print("changed")\n')
+
+    def test_checkout_version(self):
+        self.assertIsNone(checkout_version(self.source, 'course'))
+        git = os.path.join(self.source, '.git')
+        os.makedirs(os.path.join(git, 'refs', 'heads'))
+        with open(os.path.join(git, 'HEAD'), 'w') as f:
+            f.write('ref: refs/heads/master\n')
+        with open(os.path.join(git, 'packed-refs'), 'w') as f:
+            f.write('# pack-refs with: peeled\n' + 'a' * 40 + ' refs/heads/master\n')
+        with override_settings(COMPILED_COURSES_PATH=os.path.join(self.tmp, 'compiled')):
+            self.assertEqual(checkout_version(self.source, 'course'), 'a' * 40 + '-0')
+            with open(os.path.join(git, 'refs', 'heads', 'master'), 'w') as f:
+                f.write('b' * 40 + '\n')
+            self.assertEqual(checkout_version(self.source, 'course'), 'b' * 40 + '-0')
+
+        with override_settings(CONTAINER_ARCHIVE_PATH=os.path.join(self.tmp, 'archives')):
+            # A version does not scan the files.
+            with mock.patch('asyncjob.archives.directory_version') as scan:
+                f, digest = cached_archive(self.source, 'v1')
+                f.close()
+                self.assertEqual(os.path.basename(f.name), 'v1.tar.gz')
+                f, _ = cached_archive(self.source, 'v1')
+                f.close()
+                self.assertFalse(scan.called)
+
+    def test_prune_archives(self):
+        archives = os.path.join(self.tmp, 'archives')
+        other = os.path.join(self.tmp, 'other')
+        shutil.copytree(self.source, other)
+        with override_settings(CONTAINER_ARCHIVE_PATH=archives,
+                CONTAINER_ARCHIVE_MAX_AGE=3600):
+            f, _ = cached_archive(other)
+            f.close()
+            old = os.path.dirname(f.name)
+            os.utime(f.name, (0, 0))
+            f, _ = cached_archive(self.source)
+            f.close()
+            self.assertFalse(os.path.exists(old))
+            self.assertTrue(os.path.exists(f.name))
+
+            # An archive in use is kept.
+            f, _ = cached_archive(other)
+            f.close()
+            os.utime(f.name, (0, 0))
+            f, _ = cached_archive(other)
+            f.close()
+            self.assertGreater(os.stat(f.name).st_mtime, 0)
+            shutil.rmtree(self.source)
+            os.makedirs(self.source)
+            f, _ = cached_archive(self.source)
+            f.close()
+            self.assertEqual(len(os.listdir(archives)), 2)
+
+    def test_stream_archive(self):
+        os.symlink('tests/test.py', os.path.join(self.source, 'link.py'))
+        with open(os.path.join(self.source, 'data.csv'), 'wb') as f:
+            f.write(os.urandom(70000))
+        with tarfile.open(os.path.join(self.tmp, 'expected.tar'), 'w') as tar:
+            tar.add(self.source, arcname='.')
+        with tarfile.open(os.path.join(self.tmp, 'expected.tar')) as tar:
+            expected = [(m.name, m.type, m.size, m.linkname) for m in tar.getmembers()]
+
+        for encoding in ('gzip', 'identity'):
+            data = b''.join(stream_archive(self.source, encoding, chunk_size=4096))
+            with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+                members = [(m.name, m.type, m.size, m.linkname) for m in tar.getmembers()]
+                self.assertEqual(sorted(members), sorted(expected))
+                with open(os.path.join(self.source, 'data.csv'), 'rb') as f:
+                    self.assertEqual(tar.extractfile('./data.csv').read(), f.read())
+
+        self.assertEqual(archive_encoding(None), 'gzip')
+        self.assertEqual(archive_encoding('identity'), 'identity')
+        self.assertEqual(archive_encoding('gzip;q=0, identity'), 'identity')
+        self.assertEqual(archive_encoding('br, gzip;q=0.5'), 'gzip')
+
+    def test_submission_chunks(self):
+        with open(os.path.join(self.source, 'tests', 'data.txt'), 'w') as f:
+            f.write('0123456789')
+        os.chmod(os.path.join(self.source, 'tests'), 0o755)
+        os.chmod(os.path.join(self.source, 'tests', 'data.txt'), 0o644)
+        with override_settings(SUBMISSION_CHUNK_SIZE=4):
+            self.assertTrue(write_submission_manifest(self.source))
+        with open(self.source + '.manifest') as f:
+            self.assertEqual(f.read().splitlines()[:4], [
+                'S 4',
+                'D 755 0 tests',
+                'F 644 10 tests/data.txt',
+                'C ' + hashlib.sha256(b'0123').hexdigest(),
+            ])
+        chunks = read_submission_chunks(self.source)
+        self.assertEqual(len(chunks), 3 + 3)
+        last = hashlib.sha256(b'89').hexdigest()
+        self.assertEqual(chunks[last][1:], (8, 2))
+
+        data = b''.join(stream_chunks([(last,) + chunks[last]]))
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            self.assertEqual(tar.extractfile(last).read(), b'89')
+
+
+def fake_pod(sid, version, phase, reason=None, started=None, finished=None):
+    # A pod object of the watch stream with one container.
+    state = SimpleNamespace(
+        terminated=SimpleNamespace(started_at=started, finished_at=finished) if finished else None,
+        running=SimpleNamespace(started_at=started) if started and not finished else None)
+    return SimpleNamespace(
+        metadata=SimpleNamespace(labels={'sid': sid}, resource_version=version),
+        spec=SimpleNamespace(node_name='node1'),
+        status=SimpleNamespace(phase=phase, reason=reason,
+            init_container_statuses=[SimpleNamespace(state=state)],
+            container_statuses=[SimpleNamespace(state=state)]))
+
+
+class PodWatcherTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def states(self):
+        return dict(AsyncJob.objects.values_list('container_ref', 'container_state'))
+
+    def test_fake_stream(self):
+        t0 = datetime(2020, 1, 1, 12, tzinfo=timezone.utc)
+        t1 = t0 + timedelta(seconds=30)
+        state_path = os.path.join(self.tmp, 'state')
+        with open(state_path, 'w') as f:
+            f.write('5')
+        streams = [
+            [
+                {'type': 'MODIFIED', 'object': fake_pod('a', '6', 'Pending')},
+                {'type': 'MODIFIED', 'object': fake_pod('a', '7', 'Running', started=t0)},
+                {'type': 'MODIFIED', 'object': fake_pod('a', '8', 'Succeeded',
+                    started=t0, finished=t1)},
+                {'type': 'MODIFIED', 'object': fake_pod('b', '9', 'Failed', 'DeadlineExceeded',
+                    started=t0, finished=t1)},
+                {'type': 'ERROR', 'object': {'code': 410}},
+            ],
+            [
+                {'type': 'DELETED', 'object': fake_pod('c', '21', 'Running', started=t0)},
+            ],
+        ]
+        versions = []
+        batches = []
+
+        async def list_pods():
+            return [fake_pod('c', '20', 'Running', started=t0)], '20'
+
+        async def watch_pods(version):
+            versions.append(version)
+            for event in streams.pop(0):
+                yield event
+            if not streams:
+                watcher.stop()
+
+        watcher = PodWatcher(list_pods, watch_pods, batches.append, state_path,
+            batch_size=3, batch_interval=0.01)
+        self.assertEqual(watcher.resource_version, '5')
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(watcher.run())
+        finally:
+            loop.close()
+
+        # The watch resumed from the saved version and again after the list.
+        self.assertEqual(versions, ['5', '20'])
+        with open(state_path) as f:
+            self.assertEqual(f.read(), '21')
+        self.assertTrue(all(len(batch) <= 3 for batch in batches))
+        events = [event for batch in batches for event in batch]
+        self.assertEqual([(e.sid, e.state, e.result) for e in events], [
+            ('a', ContainerState.SCHEDULED, None),
+            ('a', ContainerState.RUNNING, None),
+            ('a', ContainerState.COMPLETED, PodResult.SUCCEEDED),
+            ('b', ContainerState.COMPLETED, PodResult.EXPIRED),
+            ('c', ContainerState.RUNNING, None),
+            ('c', ContainerState.COMPLETED, PodResult.CRASHED),
+        ])
+        self.assertEqual(events[2].times, {'init_start': t0, 'main_start': t0, 'main_end': t1})
+
+        create_job('a', ContainerState.ORDERED)
+        create_job('b', ContainerState.RUNNING)
+        create_job('c', ContainerState.RUNNING)
+        create_job('d', ContainerState.RUNNING)
+        job_ids = dict(AsyncJob.objects.values_list('container_ref', 'id'))
+        completed, lost = apply_events(events)
+        self.assertEqual(completed, 3)
+        self.assertEqual(sorted(lost), [
+            (job_ids['b'], PodResult.EXPIRED),
+            (job_ids['c'], PodResult.CRASHED),
+        ])
+        self.assertEqual(self.states(), {'a': 'f', 'b': 'f', 'c': 'f', 'd': 'r'})
+        self.assertEqual(AsyncJob.objects.get(container_ref='a').main_end, t1)
+        # A replayed event does not change the completed jobs.
+        self.assertEqual(apply_events(events[:2] + events[4:5]), (0, []))
+        self.assertEqual(self.states(), {'a': 'f', 'b': 'f', 'c': 'f', 'd': 'r'})
+
+    def test_cancel_without_database(self):
+        state_path = os.path.join(self.tmp, 'state')
+        with open(state_path, 'w') as f:
+            f.write('5')
+
+        async def list_pods():
+            return [], '5'
+
+        async def watch_pods(version):
+            yield {'type': 'MODIFIED', 'object': fake_pod('a', '6', 'Running')}
+            await asyncio.sleep(3600)
+
+        def handle(events):
+            raise OSError('database down')
+
+        watcher = PodWatcher(list_pods, watch_pods, handle, state_path,
+            batch_interval=0.01, retry_delay=0.05)
+        loop = asyncio.new_event_loop()
+        try:
+            task = loop.create_task(watcher.run())
+            loop.call_later(0.2, task.cancel)
+
+            async def wait():
+                await asyncio.wait_for(task, 5)
+
+            with self.assertRaises(asyncio.CancelledError):
+                loop.run_until_complete(wait())
+        finally:
+            loop.close()
+
+        # The events are replayed from the saved version at the next start.
+        self.assertTrue(watcher.gave_up)
+        with open(state_path) as f:
+            self.assertEqual(f.read(), '5')
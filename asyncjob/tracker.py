@@ -0,0 +1,138 @@
+'''
+Estimates how backed up the grading queue is. The estimates are based on
+the AsyncJob state transitions and the container timings reported in the
+kubernetes_events: the queue drains at the rate the jobs have completed
+during the last settings.QUEUE_ESTIMATE_WINDOW seconds, and a container
+takes the median time from init_start to main_end of the recent jobs of
+the exercise.
+
+'''
+from datetime import timedelta
+from statistics import median
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import AsyncJob, ContainerState
+
+
+class QueueEstimate:
+    '''
+    Queue estimates from the recent grading history.
+    '''
+
+    def __init__(self, completed, service_times, window):
+        '''
+        @type completed: C{int}
+        @param completed: number of jobs completed during the window
+        @type service_times: C{list}
+        @param service_times: recent container times in seconds
+        @type window: C{float}
+        @param window: length of the window in seconds
+        '''
+        self.throughput = completed / window if window > 0 else 0.0
+        self.service_time = median(service_times) if service_times else None
+
+    def wait_time(self, position):
+        '''
+        Estimates the time before the container of a job starts.
+
+        @type position: C{int}
+        @param position: number of jobs waiting before the job
+        @rtype: C{float}
+        @return: seconds or None if unknown
+        '''
+        if position <= 0:
+            return 0.0
+        if not self.throughput:
+            return None
+        return position / self.throughput
+
+    def completion_time(self, position, now):
+        '''
+        Estimates when the grading of a job completes.
+
+        @type position: C{int}
+        @param position: number of jobs waiting before the job
+        @type now: C{datetime.datetime}
+        @param now: the current time
+        @rtype: C{datetime.datetime}
+        @return: the time or None if unknown
+        '''
+        wait = self.wait_time(position)
+        if wait is None or self.service_time is None:
+            return None
+        return now + timedelta(seconds=wait + self.service_time)
+
+
+def _service_times(jobs):
+    times = jobs.filter(init_start__isnull=False, main_end__isnull=False)\
+        .order_by('-main_end')\
+        .values_list('init_start', 'main_end')[:settings.QUEUE_ESTIMATE_SAMPLES]
+    return [(end - start).total_seconds() for start, end in times]
+
+
+def estimate(course_key=None, exercise_key=None, now=None):
+    '''
+    Builds the queue estimates for an exercise. The container times of all
+    exercises are used if the exercise has no history.
+
+    @type course_key: C{str}
+    @param course_key: a course key or None
+    @type exercise_key: C{str}
+    @param exercise_key: an exercise key or None
+    @type now: C{datetime.datetime}
+    @param now: the current time, by default now
+    @rtype: C{QueueEstimate}
+    @return: the estimates
+    '''
+    now = now or timezone.now()
+    window = settings.QUEUE_ESTIMATE_WINDOW
+    completed = AsyncJob.objects.filter(
+        container_state=ContainerState.COMPLETED.value,
+        container_state_updated__gte=now - timedelta(seconds=window)).count()
+    jobs = AsyncJob.objects.all()
+    if course_key:
+        jobs = jobs.filter(course_key=course_key)
+        if exercise_key:
+            jobs = jobs.filter(exercise_key=exercise_key)
+    service_times = _service_times(jobs)
+    if not service_times and course_key:
+        service_times = _service_times(AsyncJob.objects.all())
+    return QueueEstimate(completed, service_times, window)
+
+
+def queue_status(course_key, exercise_key=None, now=None):
+    '''
+    Describes the queue for a course or an exercise.
+
+    @type course_key: C{str}
+    @param course_key: a course key
+    @type exercise_key: C{str}
+    @param exercise_key: an exercise key or None for the whole course
+    @type now: C{datetime.datetime}
+    @param now: the current time, by default now
+    @rtype: C{dict}
+    @return: the jobs waiting and running and the estimates for a new submission
+    '''
+    now = now or timezone.now()
+    jobs = AsyncJob.objects.filter(course_key=course_key)
+    if exercise_key:
+        jobs = jobs.filter(exercise_key=exercise_key)
+    # The containers are shared by the courses, so a new submission waits for
+    # the jobs of every course, which drain at the total throughput.
+    queue_length = AsyncJob.objects.filter(
+        container_state__in=AsyncJob.WAITING_STATES).count()
+    est = estimate(course_key, exercise_key, now)
+    completion = est.completion_time(queue_length, now)
+    return {
+        "course": course_key,
+        "exercise": exercise_key,
+        "waiting": jobs.filter(container_state__in=AsyncJob.WAITING_STATES).count(),
+        "running": jobs.filter(container_state=ContainerState.RUNNING.value).count(),
+        "global_queue_length": queue_length,
+        "throughput_per_minute": est.throughput * 60,
+        "service_time": est.service_time,
+        "wait_time": est.wait_time(queue_length),
+        "estimated_completion": completion.isoformat() if completion else None,
+    }
@@ -15,4 +15,19 @@ urlpatterns = [
     url(r'^container/personalized.tar.gz$',
         views.container_download_personalized,
         name='container-download-personalized'),
+    url(r'^container/submission.manifest$',
+        views.container_download_submission_manifest,
+        name='container-download-submission-manifest'),
+    url(r'^container/submission-chunks.tar.gz$',
+        views.container_download_submission_chunks,
+        name='container-download-submission-chunks'),
+    url(r'^container/manifest.txt$',
+        views.container_manifest,
+        name='container-manifest'),
+    url(r'^queue-status/([\w-]+)/$',
+        views.queue_status,
+        name='queue-status-course'),
+    url(r'^queue-status/([\w-]+)/([\w-]+)/$',
+        views.queue_status,
+        name='queue-status'),
 ]
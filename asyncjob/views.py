@@ -1,21 +1,29 @@
 import logging
 import os
-import tarfile
-from io import BytesIO
+from collections import OrderedDict
 
 from django.conf import settings
-from django.http.response import FileResponse
+from django.http.response import FileResponse, StreamingHttpResponse
 from django.http.response import HttpResponse, JsonResponse, Http404, HttpResponseForbidden
 from django.shortcuts import render
+from django.views.decorators.http import require_POST
+from django.utils import timezone
 
 from access.config import DIR, config
 
 # FIXME remove
 from util.files import clean_submission_dir, read_and_remove_submission_meta, \
-                       read_submission_meta, write_submission_meta
+                       read_submission_meta, write_submission_meta, \
+                       read_submission_chunks, submission_manifest_path, \
+                       write_submission_manifest
 from util.http import post_data
 from util.monitored_dict import MonitoredDict
 from util.templates import template_to_str
+from .archives import CONTENT_TYPES, archive_encoding, cached_archive, checkout_version, \
+    stream_archive, stream_chunks
+from .models import AsyncJob, ContainerState
+from .tasks import release_jobs
+from . import admission, tracker
 
 
 logger = logging.getLogger('grader.asyncjob')
@@ -51,24 +59,37 @@ def _container_download_auth(request):
 
 
 def _container_download_sendtar(request, path, name):
-    data = BytesIO()
-    with tarfile.open(mode = "w:gz", fileobj=data) as tar:
-        tar.add(path, arcname='.', recursive=True)
-
-    data.seek(0)
-    response = FileResponse(data, content_type='application/gzip')
+    if not os.path.isdir(path):
+        raise Http404("Missing directory for %s" % (name,))
+
+    # The archive is compressed while it is sent, so a large submission is
+    # never held in the memory.
+    encoding = archive_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+    content_type, suffix = CONTENT_TYPES[encoding]
+    response = StreamingHttpResponse(stream_archive(path, encoding), content_type=content_type)
     # TODO: Django 2.0: (as_attachment=True, filename='exercise.tar.gz') does the same
-    response['Content-Disposition'] = 'attachment; filename="%s"' % (name,)
+    response['Content-Disposition'] = 'attachment; filename="%s%s"' % (name, suffix)
+    response['Vary'] = 'Accept-Encoding'
     logger.info("End of %s", request.path_info)
     return response
 
 
-def container_download_exercise(request):
-    """
-    Download exercise data from grader to container
-    """
-    meta = _container_download_auth(request)
+def _container_download_sendcached(request, path, name, version=None):
+    if not settings.CONTAINER_ARCHIVE_PATH:
+        return _container_download_sendtar(request, path, name)
+    if not os.path.isdir(path):
+        raise Http404("Missing directory for %s" % (name,))
 
+    # The WSGI server sends the file without copying (wsgi.file_wrapper).
+    f, _ = cached_archive(path, version)
+    response = FileResponse(f, content_type='application/gzip')
+    response['Content-Length'] = os.fstat(f.fileno()).st_size
+    response['Content-Disposition'] = 'attachment; filename="%s.tar.gz"' % (name,)
+    logger.info("End of %s", request.path_info)
+    return response
+
+
+def _container_exercise_path(meta):
     course_key = meta['course_key']
     exercise_key = meta['exercise_key']
     lang = meta['lang']
@@ -78,8 +99,23 @@ def container_download_exercise(request):
     if not container or "mount" not in container:
         raise Http404("Invalid exercise container info")
 
-    exercise_path = os.path.join(DIR, course_key, container['mount'])
-    return _container_download_sendtar(request, exercise_path, 'exercise.tar.gz')
+    return os.path.join(DIR, course_key, container['mount'])
+
+
+def _container_exercise_version(meta):
+    # The course checkout is versioned without scanning its files.
+    course_key = meta['course_key']
+    return checkout_version(os.path.join(DIR, course_key), course_key)
+
+
+def container_download_exercise(request):
+    """
+    Download exercise data from grader to container
+    """
+    meta = _container_download_auth(request)
+    exercise_path = _container_exercise_path(meta)
+    return _container_download_sendcached(request, exercise_path, 'exercise',
+        _container_exercise_version(meta))
 
 
 def container_download_personalized(request):
@@ -90,7 +126,29 @@ def container_download_personalized(request):
     personalized_dir = meta.get('personalized_exercise')
     if not personalized_dir:
         raise Http404("No personalization for the exercise")
-    return _container_download_sendtar(request, personalized_dir, 'personalized.tar.gz')
+    return _container_download_sendcached(request, personalized_dir, 'personalized')
+
+
+def container_manifest(request):
+    """
+    List the SHA-256 digests of the cached archives of the container, one
+    "<name> <digest>" line per archive, for the bundle cache of init.sh
+    """
+    meta = _container_download_auth(request)
+    archives = []
+    if settings.CONTAINER_ARCHIVE_PATH:
+        archives.append(('exercise', _container_exercise_path(meta),
+            _container_exercise_version(meta)))
+        if meta.get('personalized_exercise'):
+            archives.append(('personalized', meta['personalized_exercise'], None))
+    lines = []
+    for name, path, version in archives:
+        if os.path.isdir(path):
+            f, digest = cached_archive(path, version)
+            f.close()
+            lines.append("%s %s\n" % (name, digest))
+    logger.info("End of %s", request.path_info)
+    return HttpResponse("".join(lines), content_type='text/plain')
 
 
 def container_download_submission(request):
@@ -99,7 +157,45 @@ def container_download_submission(request):
     """
     meta = _container_download_auth(request)
     submission_dir = meta['dir']
-    return _container_download_sendtar(request, submission_dir, 'submission.tar.gz')
+    return _container_download_sendtar(request, submission_dir, 'submission')
+
+
+def container_download_submission_manifest(request):
+    """
+    Download the chunk manifest of the submission (util.files.write_submission_manifest).
+    The manifest is written on the first download, so only the pods of the
+    nodes that have a bundle cache pay for hashing the submission.
+    """
+    meta = _container_download_auth(request)
+    path = submission_manifest_path(meta['dir'])
+    if not os.path.exists(path) and not write_submission_manifest(meta['dir']):
+        raise Http404("No manifest for the submission")
+    response = FileResponse(open(path, 'rb'), content_type='text/plain; charset=utf-8')
+    logger.info("End of %s", request.path_info)
+    return response
+
+
+@require_POST
+def container_download_submission_chunks(request):
+    """
+    Download the submission chunks whose SHA-256 digests are posted, one per
+    line, as a tar archive of files named by the digests
+    """
+    meta = _container_download_auth(request)
+    chunks = read_submission_chunks(meta['dir'])
+    if chunks is None:
+        raise Http404("No manifest for the submission")
+    # Only the chunks of this submission are sent.
+    digests = OrderedDict.fromkeys(request.body.decode('ascii', 'replace').split())
+    members = [(digest,) + chunks[digest] for digest in digests if digest in chunks]
+
+    encoding = archive_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+    content_type, suffix = CONTENT_TYPES[encoding]
+    response = StreamingHttpResponse(stream_chunks(members, encoding), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="chunks%s"' % (suffix,)
+    response['Vary'] = 'Accept-Encoding'
+    logger.info("End of %s: %d of %d chunks", request.path_info, len(members), len(chunks))
+    return response
 
 
 def container_post(request):
@@ -116,6 +212,16 @@ def container_post(request):
     if meta is None:
         return HttpResponseForbidden("Invalid sid")
     #clean_submission_dir(meta["dir"])
+    if settings.CONTAINER_ORDER_CELERY:
+        completed = AsyncJob.objects.filter(container_ref=sid)\
+            .exclude(container_state=ContainerState.COMPLETED.value)\
+            .update(container_state=ContainerState.COMPLETED.value,
+                container_state_updated=timezone.now())
+        if completed and admission.enabled():
+            try:
+                release_jobs.delay()
+            except Exception:
+                logger.exception("Failed to queue the release of the held jobs")
 
 
     data = {
@@ -160,3 +266,17 @@ def container_post(request):
         write_submission_meta(sid, meta)
         return HttpResponse("Failed to deliver results", status=502)
     return HttpResponse("Ok")
+
+
+def queue_status(request, course_key, exercise_key=None):
+    """
+    Reports the grading queue and estimates for a course or an exercise
+    """
+    if exercise_key is None:
+        if config.course_entry(course_key) is None:
+            raise Http404()
+    else:
+        (course, exercise) = config.exercise_entry(course_key, exercise_key)
+        if course is None or exercise is None:
+            raise Http404()
+    return JsonResponse(tracker.queue_status(course_key, exercise_key))
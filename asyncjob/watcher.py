@@ -0,0 +1,365 @@
+'''
+Records the states of the grading pods in Kubernetes in the AsyncJobs, see
+the kube_watcher management command. The pods are matched to the jobs by
+their `sid` label (scripts/kubernetes-run.py).
+
+PodWatcher lists the pods once and then watches the changes from the
+resource version of the previous change, which is kept in
+settings.KUBE_WATCHER_STATE so that a restarted watcher resumes where it
+stopped. When the version has expired, the pods are listed again. The
+events are applied in batches with a few bulk updates (apply_events), and
+the container states only move forward, so replayed events are harmless.
+
+A pod that failed (CRASHED), ran out of time (EXPIRED) or was deleted
+before it completed has not posted the grading result, so a system error
+is posted for its submission instead.
+
+'''
+import asyncio
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+
+from django.db import close_old_connections, transaction
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import AsyncJob, ContainerState
+
+
+logger = logging.getLogger('grader.asyncjob')
+
+
+class PodResult(Enum):
+    # ok:
+    SUCCEEDED = 0
+    # failed:
+    CRASHED = 1
+    EXPIRED = 2
+    # error:
+    UNKNOWN = 99
+
+
+# a change of a grading pod: the sid of the job, the ContainerState, the
+# PodResult of a completed pod and the times as a dict of datetimes
+PodEvent = namedtuple('PodEvent', 'sid state result times')
+
+# the container states in the order a job goes through them
+STATE_ORDER = [state.value for state in ContainerState]
+
+TIME_FIELDS = ('init_start', 'main_start', 'main_end')
+
+
+def pod_event(event_type, pod):
+    '''
+    @type event_type: C{str}
+    @param event_type: the watch event type (ADDED, MODIFIED or DELETED)
+    @type pod: C{kubernetes.client.V1Pod}
+    @param pod: the pod
+    @rtype: C{PodEvent}
+    @return: the event, or None if the pod is not a grading pod or its
+        state is not recorded
+    '''
+    sid = (pod.metadata.labels or {}).get('sid')
+    if not sid:
+        return None
+    status = pod.status
+    phase = status.phase if status else None
+    result = None
+    if phase == 'Succeeded':
+        result = PodResult.SUCCEEDED
+    elif phase == 'Failed':
+        result = PodResult.EXPIRED if status.reason == 'DeadlineExceeded' else PodResult.CRASHED
+    elif event_type == 'DELETED':
+        # deleted or evicted before it completed
+        result = PodResult.CRASHED
+    elif phase == 'Running':
+        return PodEvent(sid, ContainerState.RUNNING, None, {})
+    elif phase == 'Pending' and pod.spec and pod.spec.node_name:
+        return PodEvent(sid, ContainerState.SCHEDULED, None, {})
+    else:
+        return None
+    return PodEvent(sid, ContainerState.COMPLETED, result, _pod_times(status))
+
+
+def _pod_times(status):
+    def started(state):
+        if state is None:
+            return None
+        if state.terminated:
+            return state.terminated.started_at
+        if state.running:
+            return state.running.started_at
+        return None
+
+    def finished(state):
+        return state.terminated.finished_at if state and state.terminated else None
+
+    times = {}
+    init = (status and status.init_container_statuses) or []
+    main = (status and status.container_statuses) or []
+    if init:
+        times['init_start'] = started(init[0].state)
+    starts = [t for t in (started(s.state) for s in main) if t]
+    ends = [t for t in (finished(s.state) for s in main) if t]
+    if starts:
+        times['main_start'] = min(starts)
+    if ends:
+        times['main_end'] = max(ends)
+    return {key: value for key, value in times.items() if value}
+
+
+def message_event(body):
+    '''
+    Converts a pod event from the kubernetes_events AMQP exchange
+    (kube_watcher/example4.py) to a PodEvent.
+
+    @type body: C{dict}
+    @param body: the message with `state`, `meta` and `times`
+    @rtype: C{PodEvent}
+    '''
+    name = str(body.get('state', '')).rsplit('.', 1)[-1]
+    result = PodResult.__members__.get(name, PodResult.UNKNOWN)
+    times = {
+        key: parse_datetime(value)
+        for key, value in body.get('times', {}).items()
+        if key in TIME_FIELDS and value
+    }
+    return PodEvent(body.get('meta', {}).get('sid'), ContainerState.COMPLETED, result, times)
+
+
+def apply_events(events, now=None):
+    '''
+    Records a batch of pod events in the AsyncJobs with one update per
+    container state and one for the times. A state only replaces an
+    earlier state of the job.
+
+    @type events: C{list}
+    @param events: PodEvents in the order they happened
+    @type now: C{datetime.datetime}
+    @param now: the time of the state changes, by default now
+    @rtype: C{tuple}
+    @return: the number of jobs that completed, and (job id, PodResult) of
+        the completed jobs whose pods died without posting a result
+    '''
+    now = now or timezone.now()
+    latest = {}
+    times = {}
+    for event in events:
+        if not event or not event.sid:
+            continue
+        previous = latest.get(event.sid)
+        if previous is None or STATE_ORDER.index(event.state.value) \
+                >= STATE_ORDER.index(previous.state.value):
+            latest[event.sid] = event
+        times.setdefault(event.sid, {}).update(event.times)
+
+    by_state = {}
+    for sid, event in latest.items():
+        by_state.setdefault(event.state, []).append(sid)
+    dead = {
+        sid: event.result for sid, event in latest.items()
+        if event.result in (PodResult.CRASHED, PodResult.EXPIRED)
+    }
+
+    completed = 0
+    lost = []
+    with transaction.atomic():
+        if dead:
+            # The jobs that have not completed did not post the result.
+            for job_id, sid in AsyncJob.objects.select_for_update()\
+                    .filter(container_ref__in=dead)\
+                    .exclude(container_state=ContainerState.COMPLETED.value)\
+                    .values_list('id', 'container_ref'):
+                lost.append((job_id, dead[sid]))
+        for state, sids in by_state.items():
+            earlier = STATE_ORDER[:STATE_ORDER.index(state.value)]
+            updated = AsyncJob.objects.filter(
+                    container_ref__in=sids, container_state__in=earlier)\
+                .update(container_state=state.value, container_state_updated=now)
+            if state == ContainerState.COMPLETED:
+                completed = updated
+        fields = {}
+        for field in TIME_FIELDS:
+            cases = [
+                When(container_ref=sid, then=Value(values[field]))
+                for sid, values in times.items() if values.get(field)
+            ]
+            if cases:
+                fields[field] = Case(*cases, default=F(field), output_field=DateTimeField())
+        if fields:
+            AsyncJob.objects.filter(container_ref__in=list(times)).update(**fields)
+    return completed, lost
+
+
+class WatchExpired(Exception):
+    '''
+    The resource version of the watch is too old (410 Gone).
+    '''
+    pass
+
+
+class PodWatcher:
+    '''
+    Watches the grading pods and passes their events to `handle` in
+    batches of at most `batch_size` events, or the events of
+    `batch_interval` seconds.
+    '''
+
+    def __init__(self, list_pods, watch_pods, handle, state_path=None,
+            batch_size=100, batch_interval=1.0, retry_delay=5.0):
+        '''
+        @type list_pods: C{callable}
+        @param list_pods: a coroutine function that returns the pods and
+            the resource version of the list
+        @type watch_pods: C{callable}
+        @param watch_pods: a function of a resource version that returns an
+            async iterator of the watch events ({'type', 'object'})
+        @type handle: C{callable}
+        @param handle: a function that records a list of PodEvents
+        @type state_path: C{str}
+        @param state_path: a file for the resource version, None to not keep it
+        '''
+        self.list_pods = list_pods
+        self.watch_pods = watch_pods
+        self.handle = handle
+        self.state_path = state_path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.retry_delay = retry_delay
+        self.resource_version = self.load_version()
+        self.stopped = False
+        self.gave_up = False
+        self.queue = None
+        self.executor = None
+
+    def load_version(self):
+        if not self.state_path:
+            return None
+        try:
+            with open(self.state_path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def save_version(self, version):
+        if not self.state_path or version is None:
+            return
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(version)
+        os.replace(tmp_path, self.state_path)
+
+    def stop(self):
+        self.stopped = True
+
+    async def run(self):
+        '''
+        Watches the pods until stop is called.
+        '''
+        self.queue = asyncio.Queue(maxsize=10 * self.batch_size)
+        # The events are recorded in one thread with its own database
+        # connection, so that the ORM does not block the watch stream.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        consumer = asyncio.ensure_future(self._consume())
+        try:
+            await self._produce()
+        finally:
+            # The consumer records the queued events also when the watcher
+            # is cancelled, but no longer waits for the database.
+            self.stopped = True
+            await self.queue.put(None)
+            await consumer
+            self.executor.shutdown(wait=False)
+
+    async def _produce(self):
+        version = self.resource_version
+        while not self.stopped:
+            try:
+                if version is None:
+                    pods, version = await self.list_pods()
+                    logger.info("Listed %d pods at version %s", len(pods), version)
+                    for pod in pods:
+                        await self.queue.put((pod_event('ADDED', pod), version))
+                    await self.queue.put((None, version))
+                async for event in self.watch_pods(version):
+                    event_type, obj = event['type'], event['object']
+                    if event_type == 'ERROR':
+                        code = obj.get('code') if isinstance(obj, dict) else getattr(obj, 'code', None)
+                        if code == 410:
+                            raise WatchExpired()
+                        raise RuntimeError("Watch error: %s" % (obj,))
+                    if event_type == 'BOOKMARK':
+                        version = obj.metadata.resource_version
+                        await self.queue.put((None, version))
+                        continue
+                    version = obj.metadata.resource_version
+                    await self.queue.put((pod_event(event_type, obj), version))
+                    if self.stopped:
+                        break
+            except WatchExpired:
+                logger.warning("The watch version %s has expired, listing the pods again", version)
+                version = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if getattr(e, 'status', None) == 410:
+                    logger.warning("The watch version %s has expired, listing the pods again",
+                        version)
+                    version = None
+                    continue
+                logger.exception("Watching the pods failed, retrying in %s s", self.retry_delay)
+                await asyncio.sleep(self.retry_delay)
+
+    async def _consume(self):
+        batch = []
+        version = self.resource_version
+        done = False
+        while not done:
+            pending = batch or version != self.resource_version
+            try:
+                item = await asyncio.wait_for(self.queue.get(),
+                    self.batch_interval if pending else None)
+            except asyncio.TimeoutError:
+                item = ()
+            if item is None:
+                done = True
+            elif item:
+                event, version = item
+                if event is not None:
+                    batch.append(event)
+                if len(batch) < self.batch_size:
+                    continue
+            await self._flush(batch, version)
+            batch = []
+
+    async def _flush(self, events, version):
+        if self.gave_up:
+            return
+        while True:
+            try:
+                if events:
+                    await asyncio.get_event_loop().run_in_executor(
+                        self.executor, self._record, events)
+                    logger.debug("Recorded %d pod events", len(events))
+                self.resource_version = version
+                self.save_version(version)
+                return
+            except Exception:
+                if self.stopped:
+                    # The saved version does not move past these events, so
+                    # they are replayed when the watcher starts again.
+                    logger.exception("Recording %d pod events failed, stopping", len(events))
+                    self.gave_up = True
+                    return
+                # The events are kept until the database is back.
+                logger.exception("Recording %d pod events failed, retrying in %s s",
+                    len(events), self.retry_delay)
+                await asyncio.sleep(self.retry_delay)
+
+    def _record(self, events):
+        close_old_connections()
+        self.handle(events)
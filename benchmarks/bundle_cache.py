@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+'''
+Simulates the init containers of pods on one grading node, with and without
+the node-local bundle cache of docker/init-container/init.sh, and reports
+the requests and bytes that the grader serves.
+
+The grader runs in a thread behind a WSGI server, and each pod runs init.sh
+with its own SID and ROOT directory. The pods of a run share one
+BUNDLE_CACHE directory like the hostPath volume of a node.
+
+Usage: python benchmarks/bundle_cache.py [--pods 200] [--parallel 40] [--files 400] [--size 50000]
+'''
+import argparse
+import os
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+TMP = tempfile.mkdtemp()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "grader.settings")
+os.environ["GRADER_SUBMISSION_PATH"] = '"%s"' % os.path.join(TMP, "uploads")
+os.environ["GRADER_CONTAINER_ARCHIVE_PATH"] = '"%s"' % os.path.join(TMP, "archives")
+import django
+django.setup()
+
+from django.core.wsgi import get_wsgi_application
+import access.config
+import asyncjob.views
+from util.files import write_submission_meta
+
+INIT_SH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "docker", "init-container", "init.sh")
+
+
+class ThreadingServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Counting:
+    # Counts the requests and response bytes by path.
+
+    def __init__(self, application):
+        self.application = application
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = Counter()
+        self.bytes = Counter()
+
+    def __call__(self, environ, start_response):
+        path = environ["PATH_INFO"]
+        for data in self.application(environ, start_response):
+            with self.lock:
+                self.bytes[path] += len(data)
+            yield data
+        with self.lock:
+            self.requests[path] += 1
+
+
+def make_course(files, size):
+    rng = random.Random(1)
+    course_dir = os.path.join(TMP, "courses", "bench_course")
+    mount = os.path.join(course_dir, "exercise")
+    words = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+        for _ in range(200)]
+    for n in range(files):
+        d = os.path.join(mount, "dir%d" % (n % 10))
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, "file%d.py" % (n)), "w") as f:
+            f.write(" ".join(rng.choice(words) for _ in range(size // 6))[:size])
+    with open(os.path.join(course_dir, "index.yaml"), "w") as f:
+        f.write("name: Benchmark course\nmodules:\n  - key: m1\n    name: Module\n"
+            "    children:\n      - key: exercise\n        config: exercise.yaml\n")
+    with open(os.path.join(course_dir, "exercise.yaml"), "w") as f:
+        f.write("title: Exercise\nview_type: access.types.stdasync.acceptFiles\n"
+            "files:\n  - field: file1\n    name: file1.py\n"
+            "container:\n  image: grader/stub\n  mount: exercise\n  cmd: /exercise/run.sh\n")
+    access.config.DIR = asyncjob.views.DIR = os.path.join(TMP, "courses")
+    return files
+
+
+def run_pod(rec, n, cache):
+    sid = "pod%d" % n
+    submission = os.path.join(TMP, "uploads", sid)
+    os.makedirs(submission, exist_ok=True)
+    with open(os.path.join(submission, "file1.py"), "w") as f:
+        f.write("print(%d)\n" % n)
+    write_submission_meta(sid, {
+        "url": "http://localhost/", "dir": submission,
+        "course_key": "bench_course", "exercise_key": "exercise", "lang": "en",
+    })
+    root = os.path.join(TMP, "pods", sid)
+    os.makedirs(os.path.join(root, "run"))
+    env = dict(os.environ, REC=rec, SID=sid, ROOT=root)
+    if cache:
+        env["BUNDLE_CACHE"] = cache
+    result = subprocess.run(["sh", INIT_SH], env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    files = sum(len(f) for _, _, f in os.walk(os.path.join(root, "exercise")))
+    shutil.rmtree(root)
+    return result.returncode, files, result.stderr.decode()
+
+
+def run_node(rec, pods, parallel, cache):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(parallel) as pool:
+        results = list(pool.map(lambda n: run_pod(rec, n, cache), range(pods)))
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pods", type=int, default=200)
+    parser.add_argument("--parallel", type=int, default=40,
+            help="Pods starting at the same time")
+    parser.add_argument("--files", type=int, default=400)
+    parser.add_argument("--size", type=int, default=50000,
+            help="Bytes per exercise file")
+    args = parser.parse_args()
+
+    counting = Counting(get_wsgi_application())
+    server = make_server("127.0.0.1", 0, counting,
+        server_class=ThreadingServer, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    rec = "http://127.0.0.1:%d" % server.server_port
+    try:
+        files = make_course(args.files, args.size)
+        print("%d pods, %d at a time, exercise of %d files, %.1f MB" % (
+            args.pods, args.parallel, files, files * args.size / 1e6))
+        print("%-13s %6s %10s %10s %11s %8s %8s" % (
+            "", "failed", "exercise", "manifest", "exercise MB", "total MB", "time s"))
+        for name, cache in (
+                ("no cache", None),
+                ("bundle cache", os.path.join(TMP, "node-cache")),
+                ("warm cache", os.path.join(TMP, "node-cache"))):
+            if cache:
+                os.makedirs(cache, exist_ok=True)
+            counting.reset()
+            elapsed, results = run_node(rec, args.pods, args.parallel, cache)
+            failed = [r for r in results if r[0] != 0 or r[1] != files]
+            for r in failed[:3]:
+                print(r[2], file=sys.stderr)
+            print("%-13s %6d %10d %10d %11.1f %8.1f %8.1f" % (
+                name, len(failed),
+                counting.requests["/container/exercise.tar.gz"],
+                counting.requests["/container/manifest.txt"],
+                counting.bytes["/container/exercise.tar.gz"] / 1e6,
+                sum(counting.bytes.values()) / 1e6, elapsed))
+    finally:
+        server.shutdown()
+        shutil.rmtree(TMP)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+'''
+Measures the load time and memory of a bilingual questionnaire exercise
+with 200 questions, when only one language version is requested and when
+all language versions are requested (e.g. aplus-json).
+
+Memory is the peak and the retained size of the Python allocations during
+the load (tracemalloc). The RST cache is cleared before each round.
+
+Usage: python benchmarks/config_languages.py [--questions 200] [--rounds 3]
+'''
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "grader.settings")
+import django
+django.setup()
+
+import access.config
+from access.config import ConfigParser
+import util.dict
+
+
+COURSE_KEY = "bench_course"
+
+EXERCISE = """\
+title|i18n:
+  en: Questionnaire
+  fi: Kyselylomake
+description|rst: |
+  Answer the **questions** below. See ``the material`` for help.
+max_points: {questions}
+view_type: access.types.stdsync.createForm
+fieldgroups:
+  - title|i18n:
+      en: Questions
+      fi: Kysymykset
+    fields:
+{fields}
+"""
+
+FIELD = """\
+      - title|i18n:
+          en: Question {m}
+          fi: Kysymys {m}
+        more|rst|i18n:
+          en: |
+            Select the *correct* option for case ``{m}``.
+          fi: |
+            Valitse *oikea* vaihtoehto tapaukselle ``{m}``.
+        help|rst: |
+          Only **one** option is correct in question {m}.
+        type: radio
+        points: 1
+        options:
+          - label|i18n:
+              en: "Yes"
+              fi: "Kyllä"
+            correct: true
+          - label|i18n:
+              en: "No"
+              fi: "Ei"
+            hint|i18n:
+              en: Read the material again.
+              fi: Lue materiaali uudestaan.
+"""
+
+
+def generate_course(courses_dir, questions):
+    course_dir = os.path.join(courses_dir, COURSE_KEY)
+    os.makedirs(course_dir)
+    with open(os.path.join(course_dir, "index.yaml"), "w", encoding="utf-8") as f:
+        f.write("name: Benchmark course\nlanguage: [en, fi]\nmodules:\n")
+        f.write("  - key: m1\n    name: Module\n    children:\n")
+        f.write("      - key: questionnaire\n        config: questionnaire.yaml\n")
+    with open(os.path.join(course_dir, "questionnaire.yaml"), "w", encoding="utf-8") as f:
+        f.write(EXERCISE.format(questions=questions, fields="".join(
+            FIELD.format(m=m) for m in range(questions))))
+
+
+def measure(langs):
+    clear = getattr(util.dict, "_rst_to_html", None)
+    if clear is not None:
+        clear.cache_clear()
+    config = ConfigParser(use_snapshots=False)
+    config.course_entry(COURSE_KEY)
+    tracemalloc.start()
+    start = time.perf_counter()
+    for lang in langs:
+        config.exercise_entry(COURSE_KEY, "questionnaire", lang=lang)
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, retained, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="grader-bench-")
+    try:
+        courses_dir = os.path.join(tmp, "courses")
+        generate_course(courses_dir, args.questions)
+        access.config.DIR = courses_dir
+
+        print("%-12s %10s %14s %14s" % ("requested", "load (s)", "retained (KiB)", "peak (KiB)"))
+        for name, langs in (("fi", ["fi"]), ("en+fi", ["en", "fi"])):
+            results = [measure(langs) for _ in range(args.rounds)]
+            print("%-12s %10.3f %14.0f %14.0f" % (
+                name,
+                min(r[0] for r in results),
+                min(r[1] for r in results) / 1024,
+                min(r[2] for r in results) / 1024,
+            ))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+'''
+Reports the memory use of worker processes holding the course configuration
+of a synthetic course tree (40 courses by default).
+
+Modes:
+    yaml      every worker parses the YAML files
+    snapshot  every worker loads the compiled snapshots in one go
+    shared    workers memory map the compiled snapshots (CONFIG_SHARED_SNAPSHOTS)
+
+Each worker is forked from the same parent, like preforked application
+server workers, and requests every exercise of every course once. RSS counts
+the mapped shared pages in every worker, PSS divides them between workers.
+
+Usage: python benchmarks/config_memory.py [--courses 40] [--workers 4]
+'''
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "grader.settings")
+import django
+django.setup()
+
+from django.conf import settings
+import access.config
+from access.config import ConfigParser
+
+
+EXERCISE = """\
+title|i18n:
+  en: Exercise {n}
+  fi: Tehtävä {n}
+max_points: 10
+view_type: access.types.stdsync.createForm
+fieldgroups:
+  - fields:
+{fields}
+"""
+
+FIELD = """\
+      - title|i18n:
+          en: Question {m} of exercise {n} with some longer text to be realistic
+          fi: Tehtävän {n} kysymys {m} hieman pidemmällä tekstillä
+        type: radio
+        points: 1
+        options:
+          - label: "A {m}"
+            correct: true
+          - label: "B {m}"
+            hint|i18n:
+              en: Not B, read the material again.
+              fi: Ei B, lue materiaali uudestaan.
+"""
+
+
+def generate_courses(courses_dir, courses, exercises, fields):
+    for c in range(courses):
+        course_dir = os.path.join(courses_dir, "course%d" % c)
+        os.makedirs(course_dir)
+        with open(os.path.join(course_dir, "index.yaml"), "w", encoding="utf-8") as f:
+            f.write("name: Course %d\nlanguage: [en, fi]\nmodules:\n" % c)
+            f.write("  - key: m1\n    name: Module\n    children:\n")
+            for n in range(exercises):
+                f.write("      - key: ex{0}\n        config: ex{0}.yaml\n".format(n))
+        for n in range(exercises):
+            with open(os.path.join(course_dir, "ex%d.yaml" % n), "w", encoding="utf-8") as f:
+                f.write(EXERCISE.format(n=n, fields="".join(
+                    FIELD.format(n=n, m=m) for m in range(fields))))
+
+
+def memory():
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "RssAnon", "RssFile"):
+                values[key] = int(value.split()[0])
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    values["Pss"] = int(line.split()[1])
+    except OSError:
+        values["Pss"] = 0
+    return values
+
+
+def worker(use_snapshots, course_keys, results):
+    before = memory()
+    config = ConfigParser(use_snapshots=use_snapshots)
+    for course_key in course_keys:
+        _, exercises = config.exercises(course_key)
+        for exercise in exercises:
+            config.exercise_entry(course_key, exercise["key"], lang="fi")
+    after = memory()
+    results.put((before, after))
+    # Stay alive so that the shared pages are divided between all workers.
+    os.read(READY[0], 1)
+
+
+def run(mode, course_keys, workers):
+    settings.CONFIG_SHARED_SNAPSHOTS = mode == "shared"
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(mode != "yaml", course_keys, results))
+        for _ in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    measured = [results.get() for _ in processes]
+    os.write(READY[1], b"x" * workers)
+    for p in processes:
+        p.join()
+    return measured
+
+
+READY = os.pipe()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--courses", type=int, default=40)
+    parser.add_argument("--exercises", type=int, default=50)
+    parser.add_argument("--fields", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="grader-bench-")
+    try:
+        courses_dir = os.path.join(tmp, "courses")
+        generate_courses(courses_dir, args.courses, args.exercises, args.fields)
+        access.config.DIR = courses_dir
+        settings.COMPILED_COURSES_PATH = os.path.join(tmp, "compiled")
+        course_keys = sorted(os.listdir(courses_dir))
+        compiler = ConfigParser(use_snapshots=False)
+        for course_key in course_keys:
+            compiler.compile_snapshot(course_key)
+        del compiler
+
+        print("%d courses x %d exercises, %d workers, values in MiB per worker" % (
+            args.courses, args.exercises, args.workers))
+        print("%-10s %12s %12s %12s %12s" % ("mode", "RSS before", "RSS after", "anon after", "PSS after"))
+        for mode in ("yaml", "snapshot", "shared"):
+            measured = run(mode, course_keys, args.workers)
+            avg = lambda key, i: sum(m[i][key] for m in measured) / len(measured) / 1024
+            print("%-10s %12.1f %12.1f %12.1f %12.1f" % (
+                mode, avg("VmRSS", 0), avg("VmRSS", 1), avg("RssAnon", 1), avg("Pss", 1)))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
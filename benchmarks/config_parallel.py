@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+'''
+Compares loading every course and exercise of a synthetic course tree
+serially and in parallel worker processes (ConfigParser.load_courses, as
+used by `manage.py exercises --jobs N` and CONFIG_LOAD_JOBS).
+
+The RST caches are disabled, so every run parses and renders everything,
+including every language version.
+
+Usage: python benchmarks/config_parallel.py [--courses 12] [--jobs 4]
+'''
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "grader.settings")
+import django
+django.setup()
+
+from django.conf import settings
+import access.config
+from access.config import ConfigParser
+import util.dict
+
+
+EXERCISE = """\
+title|i18n:
+  en: Exercise {n}
+  fi: Tehtävä {n}
+description|rst: |
+  Answer the **questions** below in course {c}.
+max_points: 10
+view_type: access.types.stdsync.createForm
+fieldgroups:
+  - fields:
+{fields}
+"""
+
+FIELD = """\
+      - title|i18n:
+          en: Question {n}.{m}
+          fi: Kysymys {n}.{m}
+        more|rst: |
+          Select the *correct* option for case ``{c}.{n}.{m}``.
+        type: radio
+        points: 1
+        options:
+          - label: "A"
+            correct: true
+          - label: "B"
+"""
+
+
+def generate_courses(courses_dir, courses, exercises, fields):
+    for c in range(courses):
+        course_dir = os.path.join(courses_dir, "course%d" % c)
+        os.makedirs(course_dir)
+        with open(os.path.join(course_dir, "index.yaml"), "w", encoding="utf-8") as f:
+            f.write("name: Course %d\nlanguage: [en, fi]\nmodules:\n" % c)
+            f.write("  - key: m1\n    name: Module\n    children:\n")
+            for n in range(exercises):
+                f.write("      - key: ex{0}\n        config: ex{0}.yaml\n".format(n))
+        for n in range(exercises):
+            with open(os.path.join(course_dir, "ex%d.yaml" % n), "w", encoding="utf-8") as f:
+                f.write(EXERCISE.format(c=c, n=n, fields="".join(
+                    FIELD.format(c=c, n=n, m=m) for m in range(fields))))
+
+
+def measure(course_keys, jobs):
+    util.dict._rst_to_html.cache_clear()
+    config = ConfigParser(use_snapshots=False)
+    start = time.perf_counter()
+    errors = config.load_courses(course_keys, jobs)
+    # Workers return every language version, create them in serial mode too.
+    for course_key in course_keys:
+        for exercise in config.exercises(course_key, lang="_root")[1]:
+            list(exercise.values())
+    elapsed = time.perf_counter() - start
+    assert not errors, errors
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--courses", type=int, default=12)
+    parser.add_argument("--exercises", type=int, default=20)
+    parser.add_argument("--fields", type=int, default=5)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="grader-bench-")
+    try:
+        courses_dir = os.path.join(tmp, "courses")
+        generate_courses(courses_dir, args.courses, args.exercises, args.fields)
+        access.config.DIR = courses_dir
+        settings.RST_CACHE_PATH = None
+        course_keys = sorted(os.listdir(courses_dir))
+
+        print("%d courses x %d exercises on %d CPUs" % (
+            args.courses, args.exercises, os.cpu_count()))
+        for jobs in sorted(set((1, args.jobs))):
+            print("jobs=%-3d %8.2f s" % (jobs, measure(course_keys, jobs)))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+'''
+Compares the configuration load time of a cold grader process with and
+without a compiled course snapshot (`manage.py compile_courses`).
+
+A synthetic course with bilingual questionnaire exercises is generated
+into a temporary directory. For both modes a new ConfigParser is created
+and the time of the first single exercise request and the time of the
+first request listing all exercises (e.g. aplus-json) are measured.
+
+Usage: python benchmarks/config_startup.py [--exercises 500] [--rounds 3]
+'''
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "grader.settings")
+import django
+django.setup()
+
+from django.conf import settings
+import access.config
+from access.config import ConfigParser
+
+
+COURSE_KEY = "bench_course"
+
+EXERCISE = """\
+title|i18n:
+  en: Exercise {n}
+  fi: Tehtävä {n}
+description|rst: |
+  Answer the **questions** below. See ``the material`` for help.
+max_points: 10
+view_type: access.types.stdsync.createForm
+fieldgroups:
+  - title|i18n:
+      en: Questions
+      fi: Kysymykset
+    fields:
+{fields}
+"""
+
+FIELD = """\
+      - title|i18n:
+          en: Question {n}.{m}
+          fi: Kysymys {n}.{m}
+        more|rst: |
+          Select the *correct* option for case ``{m}``.
+        type: radio
+        points: 1
+        options:
+          - label: "A"
+            correct: true
+          - label: "B"
+            hint|i18n:
+              en: Not B.
+              fi: Ei B.
+"""
+
+
+def generate_course(courses_dir, exercises, fields):
+    course_dir = os.path.join(courses_dir, COURSE_KEY)
+    os.makedirs(course_dir)
+    with open(os.path.join(course_dir, "index.yaml"), "w", encoding="utf-8") as f:
+        f.write("name: Benchmark course\nlanguage: [en, fi]\nmodules:\n")
+        f.write("  - key: m1\n    name: Module\n    children:\n")
+        for n in range(exercises):
+            f.write("      - key: ex{0}\n        config: ex{0}.yaml\n".format(n))
+    for n in range(exercises):
+        with open(os.path.join(course_dir, "ex%d.yaml" % n), "w", encoding="utf-8") as f:
+            f.write(EXERCISE.format(n=n, fields="".join(
+                FIELD.format(n=n, m=m) for m in range(fields))))
+
+
+def measure(use_snapshots):
+    config = ConfigParser(use_snapshots=use_snapshots)
+    start = time.perf_counter()
+    config.exercise_entry(COURSE_KEY, "ex0")
+    first = time.perf_counter() - start
+    config = ConfigParser(use_snapshots=use_snapshots)
+    start = time.perf_counter()
+    config.exercises(COURSE_KEY, lang="_root")
+    listing = time.perf_counter() - start
+    return first, listing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--exercises", type=int, default=500)
+    parser.add_argument("--fields", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="grader-bench-")
+    try:
+        courses_dir = os.path.join(tmp, "courses")
+        generate_course(courses_dir, args.exercises, args.fields)
+        access.config.DIR = courses_dir
+        settings.COMPILED_COURSES_PATH = os.path.join(tmp, "compiled")
+
+        start = time.perf_counter()
+        ConfigParser(use_snapshots=False).compile_snapshot(COURSE_KEY)
+        print("compile_courses: %.3f s" % (time.perf_counter() - start))
+
+        print("%-10s %20s %20s" % ("mode", "first exercise (s)", "all exercises (s)"))
+        for mode, use_snapshots in (("yaml", False), ("snapshot", True)):
+            results = [measure(use_snapshots) for _ in range(args.rounds)]
+            print("%-10s %20.3f %20.3f" % (
+                mode,
+                min(r[0] for r in results),
+                min(r[1] for r in results),
+            ))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
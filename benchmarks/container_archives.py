@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+'''
+Compares the exercise downloads of the grading containers when every
+download compresses the exercise directory (CONTAINER_ARCHIVE_PATH = None)
+and when the archive is built once and served from the disk.
+
+A course with an exercise directory of generated grader files is created
+into a temporary directory, and the downloads go through the
+container-download-exercise view like those of the pods.
+
+Usage: python benchmarks/container_archives.py [--downloads 50] [--files 400] [--size 50000]
+'''
+import argparse
+import os
+import random
+import shutil
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+
+TMP = tempfile.mkdtemp()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "grader.settings")
+os.environ["GRADER_SUBMISSION_PATH"] = '"%s"' % os.path.join(TMP, "uploads")
+import django
+django.setup()
+
+from django.test import Client, override_settings
+import access.config
+import asyncjob.views
+from util.files import write_submission_meta
+
+
+def make_course(files, size):
+    rng = random.Random(1)
+    course_dir = os.path.join(TMP, "courses", "bench_course")
+    mount = os.path.join(course_dir, "exercise")
+    for n in range(files):
+        d = os.path.join(mount, "dir%d" % (n % 10))
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, "file%d.py" % (n)), "w") as f:
+            words = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+                for _ in range(200)]
+            f.write(" ".join(rng.choice(words) for _ in range(size // 6))[:size])
+    with open(os.path.join(course_dir, "index.yaml"), "w") as f:
+        f.write("name: Benchmark course\nmodules:\n  - key: m1\n    name: Module\n"
+            "    children:\n      - key: exercise\n        config: exercise.yaml\n")
+    with open(os.path.join(course_dir, "exercise.yaml"), "w") as f:
+        f.write("title: Exercise\nview_type: access.types.stdasync.acceptFiles\n"
+            "files:\n  - field: file1\n    name: file1.py\n"
+            "container:\n  image: grader/stub\n  mount: exercise\n  cmd: /exercise/run.sh\n")
+    access.config.DIR = asyncjob.views.DIR = os.path.join(TMP, "courses")
+
+
+def download(client, downloads):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = 0
+    for _ in range(downloads):
+        response = client.get("/container/exercise.tar.gz", HTTP_AUTHORIZATION="Bearer benchsid")
+        assert response.status_code == 200, response.status_code
+        size = sum(len(chunk) for chunk in response.streaming_content)
+        response.close()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed / downloads, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--downloads", type=int, default=50)
+    parser.add_argument("--files", type=int, default=400)
+    parser.add_argument("--size", type=int, default=50000,
+            help="Bytes per file")
+    args = parser.parse_args()
+
+    try:
+        make_course(args.files, args.size)
+        write_submission_meta("benchsid", {
+            "url": "http://localhost/", "dir": os.path.join(TMP, "uploads"),
+            "course_key": "bench_course", "exercise_key": "exercise", "lang": "en",
+        })
+        client = Client()
+        print("%d downloads of %d files, %.1f MB" % (
+            args.downloads, args.files, args.files * args.size / 1e6))
+        with override_settings(CONTAINER_ARCHIVE_PATH=None):
+            per, peak, size = download(client, args.downloads)
+            print("compressed per download: %7.1f ms per download  peak %6.1f MB  (%.1f MB archive)"
+                % (per * 1000, peak / 1e6, size / 1e6))
+        with override_settings(CONTAINER_ARCHIVE_PATH=os.path.join(TMP, "archives")):
+            start = time.perf_counter()
+            download(client, 1)
+            first = time.perf_counter() - start
+            per, peak, size = download(client, args.downloads)
+            print("cached archive:          %7.1f ms per download  peak %6.1f MB  (first %.0f ms)"
+                % (per * 1000, peak / 1e6, first * 1000))
+    finally:
+        shutil.rmtree(TMP)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+'''
+Compares the memory use of the A+ export (aplus-json) of a synthetic course
+with 2000 exercises, when the document is built and encoded as a whole and
+when it is streamed one module at a time (APLUS_JSON_STREAM).
+
+The course configuration is loaded before the measurements, so only the
+export itself is measured: the peak of the Python allocations (tracemalloc),
+the time to the first byte and the total time.
+
+Usage: python benchmarks/export_memory.py [--modules 40] [--exercises 50]
+'''
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "grader.settings")
+import django
+django.setup()
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+import access.config
+from access.config import ConfigParser
+from util import export
+
+
+COURSE_KEY = "bench_course"
+
+EXERCISE = """\
+title|i18n:
+  en: Exercise {n}
+  fi: Tehtävä {n}
+max_points: 5
+view_type: access.types.stdsync.createForm
+fieldgroups:
+  - fields:
+{fields}
+"""
+
+FIELD = """\
+      - title|i18n:
+          en: Question {n}.{m}
+          fi: Kysymys {n}.{m}
+        type: radio
+        points: 1
+        options:
+          - label|i18n:
+              en: "Yes"
+              fi: "Kyllä"
+            correct: true
+          - label|i18n:
+              en: "No"
+              fi: "Ei"
+"""
+
+
+def generate_course(courses_dir, modules, exercises, fields):
+    course_dir = os.path.join(courses_dir, COURSE_KEY)
+    os.makedirs(course_dir)
+    with open(os.path.join(course_dir, "index.yaml"), "w", encoding="utf-8") as f:
+        f.write("name: Benchmark course\nlanguage: [en, fi]\nmodules:\n")
+        for i in range(modules):
+            f.write("  - key: m{0}\n    name: Module {0}\n    children:\n".format(i))
+            for j in range(exercises):
+                f.write("      - key: ex{0}_{1}\n        config: ex{0}_{1}.yaml\n".format(i, j))
+                f.write("        max_submissions: 10\n")
+    fields = "".join(FIELD.format(n="{n}", m=m) for m in range(fields))
+    for i in range(modules):
+        for j in range(exercises):
+            with open(os.path.join(course_dir, "ex%d_%d.yaml" % (i, j)), "w", encoding="utf-8") as f:
+                n = "%d.%d" % (i, j)
+                f.write(EXERCISE.format(n=n, fields=fields.replace("{n}", n)))
+
+
+def measure(chunks):
+    tracemalloc.start()
+    start = time.perf_counter()
+    first = None
+    size = 0
+    for chunk in chunks():
+        if first is None:
+            first = time.perf_counter() - start
+        size += len(chunk.encode("utf-8"))
+    total = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first, total, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--modules", type=int, default=40)
+    parser.add_argument("--exercises", type=int, default=50)
+    parser.add_argument("--fields", type=int, default=5)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="grader-bench-")
+    try:
+        courses_dir = os.path.join(tmp, "courses")
+        generate_course(courses_dir, args.modules, args.exercises, args.fields)
+        access.config.DIR = courses_dir
+        settings.RST_CACHE_PATH = None
+        config = ConfigParser(use_snapshots=False)
+        course, exercises = config.exercises(COURSE_KEY, lang="_root")
+        for exercise in exercises:
+            list(exercise.values())
+        request = export.BaseUrlRequest("https://grader.example.com/")
+
+        def document():
+            yield json.dumps(export.course_document(request, config, course), cls=DjangoJSONEncoder)
+
+        def stream():
+            return export.course_json_chunks(request, config, course)
+
+        print("%d exercises" % (len(exercises)))
+        print("%-10s %12s %10s %10s %10s" % ("mode", "first (s)", "total (s)", "peak (MiB)", "size (MiB)"))
+        for mode, chunks in (("document", document), ("stream", stream)):
+            first, total, peak, size = measure(chunks)
+            print("%-10s %12.3f %10.3f %10.1f %10.1f" % (
+                mode, first, total, peak / 1024 / 1024, size / 1024 / 1024))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+'''
+Measures the per-request cost of the questionnaire form (GradedForm) of an
+exercise with 50 questions: constructing the form for a GET request, and
+constructing, validating and grading it for a POST request. Grading alone is
+measured on a validated form.
+
+Usage: python benchmarks/form_construction.py [--questions 50] [--rounds 200]
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "grader.settings")
+import django
+django.setup()
+
+from django.test import RequestFactory
+from access.types.forms import GradedForm
+
+
+def make_exercise(questions):
+    fields = []
+    for n in range(questions):
+        kind = n % 5
+        if kind in (0, 1):
+            fields.append({
+                "type": "radio",
+                "title": "Question {#}: pick the right one",
+                "more": "<p>Some extra instructions for question %d.</p>" % (n),
+                "points": 1,
+                "options": [
+                    {"label": "Option %d" % (o), "correct": o == 2, "hint": "Not %d" % (o)}
+                    for o in range(5)
+                ],
+            })
+        elif kind == 2:
+            fields.append({
+                "type": "checkbox",
+                "title": "Question {#}: pick all that apply",
+                "points": 2,
+                "partial_points": True,
+                "options": [
+                    {"label": "Option %d" % (o), "correct": o % 2 == 0}
+                    for o in range(6)
+                ],
+            })
+        elif kind == 3:
+            fields.append({
+                "type": "text",
+                "title": "Question {#}: type the word",
+                "points": 1,
+                "correct": "answer%d" % (n),
+                "compare_method": "string-ignorews-ignorequotes",
+                "feedback": [
+                    {"value": "wrong", "label": "Not that one."},
+                    {"value": "^a", "compare_regexp": True, "label": "Starts well."},
+                ],
+            })
+        else:
+            fields.append({
+                "type": "text",
+                "title": "Question {#}: a number",
+                "points": 1,
+                "correct": str(n),
+                "compare_method": "int",
+            })
+    return {
+        "key": "questionnaire",
+        "lang": "en",
+        "max_points": questions,
+        "view_type": "access.types.stdsync.createForm",
+        "fieldgroups": [{"title": "Questions", "fields": fields}],
+    }
+
+
+def post_data(exercise):
+    data = {"__grader_lang": "en"}
+    for n, field in enumerate(exercise["fieldgroups"][0]["fields"]):
+        name = "field_%d" % (n)
+        if field["type"] == "radio":
+            data[name] = "option_2"
+        elif field["type"] == "checkbox":
+            data[name] = ["option_0", "option_1"]
+        else:
+            data[name] = field["correct"]
+    return data
+
+
+def measure(rounds, function):
+    function()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    exercise = make_exercise(args.questions)
+    factory = RequestFactory()
+    get_request = factory.get("/?uid=1&ordinal_number=1")
+    post_request = factory.post("/?uid=1&ordinal_number=1", post_data(exercise))
+
+    def get():
+        GradedForm(None, exercise=exercise, request=get_request)
+
+    def post():
+        form = GradedForm(post_request.POST, exercise=exercise, request=post_request)
+        assert form.is_valid(), form.errors
+        form.grade()
+
+    graded = GradedForm(post_request.POST, exercise=exercise, request=post_request)
+    assert graded.is_valid(), graded.errors
+
+    print("%d questions, %d rounds" % (args.questions, args.rounds))
+    print("GET  construct:              %7.2f ms" % measure(args.rounds, get))
+    print("POST construct+validate+grade: %5.2f ms" % measure(args.rounds, post))
+    print("POST grade:                  %7.2f ms" % measure(args.rounds, graded.grade))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+'''
+Simulates a deadline rush of asynchronous grading with a fake executor and
+reports the waiting time percentiles of each priority lane, with all jobs
+in one lane (submission order), with the lanes, and with the lanes and
+aging (asyncjob.admission.AdmissionController).
+
+Practice resubmissions (low), normal submissions and exam submissions
+(high) arrive at random during the rush, slightly faster than the
+containers can grade them, so a queue builds up.
+
+Usage: python benchmarks/priority_lanes.py [--containers 20] [--duration 20] [--rush 1800] [--aging 300]
+'''
+import argparse
+import heapq
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "grader.settings")
+import django
+django.setup()
+
+from asyncjob.admission import AdmissionController
+from asyncjob.models import JobPriority
+
+
+LANES = [
+    # lane, share of the capacity
+    (JobPriority.LOW.value, 0.8),
+    (JobPriority.NORMAL.value, 0.3),
+    (JobPriority.HIGH.value, 0.05),
+]
+
+
+def arrivals(rng, capacity, rush):
+    jobs = []
+    for lane, share in LANES:
+        t = 0.0
+        while True:
+            t += rng.expovariate(share * capacity)
+            if t > rush:
+                break
+            jobs.append((t, lane))
+    jobs.sort()
+    return [(t, n, 'course%d' % (n % 3), 'e', lane) for n, (t, lane) in enumerate(jobs)]
+
+
+def simulate(controller, jobs, duration, lanes=True):
+    # Returns the waiting times by lane.
+    running = []
+    arrived = {}
+    lane_of = {}
+    waits = {lane: [] for lane, _ in LANES}
+    pending = list(jobs)
+    pending.reverse()
+
+    def start(admitted, now):
+        for job in admitted:
+            waits[lane_of[job[0]]].append(now - arrived[job[0]])
+            heapq.heappush(running, (now + duration, job))
+
+    while pending or running:
+        if pending and (not running or pending[-1][0] <= running[0][0]):
+            now, job_id, course_key, exercise_key, lane = pending.pop()
+            arrived[job_id] = now
+            lane_of[job_id] = lane
+            controller.enqueue(job_id, course_key, exercise_key,
+                lane if lanes else JobPriority.NORMAL.value, now)
+            start(controller.admit(now), now)
+        else:
+            now, job = heapq.heappop(running)
+            start(controller.complete(job[1], job[2], now), now)
+    return waits
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--containers", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20,
+            help="Seconds that a container takes")
+    parser.add_argument("--rush", type=float, default=1800,
+            help="Seconds that the submissions arrive")
+    parser.add_argument("--aging", type=float, default=300,
+            help="Seconds of waiting that raise a job by a lane")
+    args = parser.parse_args()
+
+    jobs = arrivals(random.Random(1), args.containers / args.duration, args.rush)
+    print("%d jobs, %d containers, %.0f s per job" % (len(jobs), args.containers, args.duration))
+    print("%-22s %-7s %6s %8s %8s %8s" % ("", "lane", "jobs", "p50 s", "p95 s", "p99 s"))
+    for name, lanes, aging in (
+            ("submission order", False, None),
+            ("lanes", True, None),
+            ("lanes and aging", True, args.aging)):
+        controller = AdmissionController(total=args.containers, aging=aging)
+        waits = simulate(controller, jobs, args.duration, lanes)
+        for lane, _ in reversed(LANES):
+            print("%-22s %-7s %6d %8.0f %8.0f %8.0f" % (
+                name, JobPriority(lane).name.lower(), len(waits[lane]),
+                percentile(waits[lane], 0.5),
+                percentile(waits[lane], 0.95),
+                percentile(waits[lane], 0.99)))
+            name = ""
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+'''
+Compares regrading stored questionnaire answers one submission at a time,
+i.e. constructing, validating and grading GradedForm as for a POST, with
+`manage.py regrade_form` that grades each distinct answer once.
+
+A course with a 50 question exercise (see form_construction.py) is
+generated into a temporary directory, and the answers of the submissions
+are picked from a few typical alternatives per question.
+
+Usage: python benchmarks/regrade_form.py [--submissions 100000] [--sample 1000]
+'''
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "grader.settings")
+import django
+django.setup()
+
+from django.core.management import call_command
+from django.http import QueryDict
+import access.config
+from access.types.forms import GradedForm
+from form_construction import make_exercise
+
+
+def random_answers(rng, exercise):
+    answers = {}
+    for n, field in enumerate(exercise["fieldgroups"][0]["fields"]):
+        name = "field_%d" % (n)
+        if field["type"] == "radio":
+            answers[name] = "option_%d" % (rng.choice([2, 2, 2, 0, 1]))
+        elif field["type"] == "checkbox":
+            answers[name] = rng.choice([["option_0", "option_2", "option_4"], ["option_0"], ["option_1", "option_2"]])
+        elif field.get("compare_method") == "int":
+            answers[name] = rng.choice([field["correct"], "0", "100"])
+        else:
+            answers[name] = rng.choice([field["correct"], "wrong", " answer ", "aaa"])
+    return answers
+
+
+def query_dict(answers):
+    data = QueryDict(mutable=True)
+    for name, value in answers.items():
+        if isinstance(value, list):
+            data.setlist(name, value)
+        else:
+            data[name] = value
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--submissions", type=int, default=100000)
+    parser.add_argument("--sample", type=int, default=1000,
+            help="Submissions graded one at a time to estimate the total")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    exercise = make_exercise(50)
+    tmp = tempfile.mkdtemp()
+    try:
+        course_dir = os.path.join(tmp, "courses", "bench_course")
+        os.makedirs(course_dir)
+        with open(os.path.join(course_dir, "index.yaml"), "w") as f:
+            f.write("name: Benchmark course\nmodules:\n  - key: m1\n    name: Module\n"
+                "    children:\n      - key: questionnaire\n        config: questionnaire.yaml\n")
+        with open(os.path.join(course_dir, "questionnaire.yaml"), "w") as f:
+            json.dump(dict(exercise, title="Questionnaire"), f)
+        access.config.DIR = os.path.join(tmp, "courses")
+
+        answers_path = os.path.join(tmp, "answers.jsonl")
+        with open(answers_path, "w") as f:
+            for n in range(args.submissions):
+                f.write(json.dumps({"id": n, "answers": random_answers(rng, exercise)}) + "\n")
+
+        start = time.perf_counter()
+        for _ in range(args.sample):
+            form = GradedForm(query_dict(random_answers(rng, exercise)), exercise=exercise)
+            assert form.is_valid(), form.errors
+            form.grade()
+        single = (time.perf_counter() - start) / args.sample
+
+        output = os.path.join(tmp, "results.jsonl")
+        start = time.perf_counter()
+        call_command("regrade_form", "bench_course/questionnaire", answers_path,
+            output=output, stderr=io.StringIO())
+        bulk = time.perf_counter() - start
+
+        print("%d submissions of 50 answers" % (args.submissions))
+        print("one at a time (estimated): %8.1f s" % (single * args.submissions))
+        print("regrade_form:              %8.1f s" % (bulk))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
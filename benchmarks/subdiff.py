@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+'''
+Measures the subdiff hints shown for a wrong free-text answer
+(get_subdiff_hints) over answer lengths and numbers of accepted solutions,
+for answers of natural words and for repetitive answers that are the worst
+case of the sequence matching.
+
+Usage: python benchmarks/subdiff.py [--lengths 100,1000,10000,50000] [--solutions 1,3,10]
+'''
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "grader.settings")
+import django
+django.setup()
+
+from access.types.forms import get_subdiff_hints
+
+
+WORDS = "the cat sat on a mat with some data and more words here".split()
+
+
+def words(rng, length):
+    return ' '.join(rng.choice(WORDS) for _ in range(length // 3 + 1))[:length]
+
+
+def answers(rng, length, count):
+    solutions = '|'.join(words(rng, rng.randint(20, 80)) for _ in range(count))
+    yield "words", words(rng, length), solutions
+    solutions = '|'.join(('xa' if n % 2 else 'ab') * 50 for n in range(count))
+    yield "repetitive", 'ab' * (length // 2), solutions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lengths", default="100,1000,10000,50000")
+    parser.add_argument("--solutions", default="1,3,10")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    print("%-10s %8s %9s %10s" % ("answer", "length", "solutions", "time"))
+    for length in (int(n) for n in args.lengths.split(",")):
+        for count in (int(n) for n in args.solutions.split(",")):
+            for kind, value, solutions in answers(rng, length, count):
+                start = time.perf_counter()
+                get_subdiff_hints(value, solutions)
+                elapsed = time.perf_counter() - start
+                print("%-10s %8d %9d %8.1f ms" % (kind, length, count, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
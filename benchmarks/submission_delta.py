@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+'''
+Measures the bytes that the grader sends for the submissions of a student
+who resubmits a project 20 times and changes one file between the
+attempts, with the whole submission archive and with the delta download
+of docker/init-container/init.sh (a node-local BUNDLE_CACHE).
+
+The grader runs in a thread behind a WSGI server. The submissions are
+saved with util.files like the intake does, and each attempt runs init.sh
+with its own SID and ROOT directory. The files that init.sh produces are
+compared to the submitted ones.
+
+Usage: python benchmarks/submission_delta.py [--attempts 20] [--files 30] [--data 5]
+'''
+import argparse
+import filecmp
+import os
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import Counter
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+TMP = tempfile.mkdtemp()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "grader.settings")
+os.environ["GRADER_SUBMISSION_PATH"] = '"%s"' % os.path.join(TMP, "uploads")
+os.environ["GRADER_CONTAINER_ARCHIVE_PATH"] = '"%s"' % os.path.join(TMP, "archives")
+import django
+django.setup()
+
+from django.core.wsgi import get_wsgi_application
+import access.config
+import asyncjob.views
+from util.files import create_submission_dir, submission_file_path, \
+    sync_submission_dir, write_submission_meta
+
+INIT_SH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "docker", "init-container", "init.sh")
+COURSE = {"key": "bench_course"}
+EXERCISE = {"key": "exercise"}
+
+
+class ThreadingServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Counting:
+    # Counts the response bytes by path.
+
+    def __init__(self, application):
+        self.application = application
+        self.lock = threading.Lock()
+        self.bytes = Counter()
+
+    def __call__(self, environ, start_response):
+        path = environ["PATH_INFO"]
+        for data in self.application(environ, start_response):
+            with self.lock:
+                self.bytes[path] += len(data)
+            yield data
+
+
+def make_course():
+    course_dir = os.path.join(TMP, "courses", COURSE["key"])
+    os.makedirs(os.path.join(course_dir, "exercise"))
+    with open(os.path.join(course_dir, "exercise", "run.sh"), "w") as f:
+        f.write("#!/bin/sh\n")
+    with open(os.path.join(course_dir, "index.yaml"), "w") as f:
+        f.write("name: Benchmark course\nmodules:\n  - key: m1\n    name: Module\n"
+            "    children:\n      - key: exercise\n        config: exercise.yaml\n")
+    with open(os.path.join(course_dir, "exercise.yaml"), "w") as f:
+        f.write("title: Exercise\nview_type: access.types.stdasync.acceptFiles\n"
+            "files:\n  - field: file1\n    name: file1.py\n"
+            "container:\n  image: grader/stub\n  mount: exercise\n  cmd: /exercise/run.sh\n")
+    access.config.DIR = asyncjob.views.DIR = os.path.join(TMP, "courses")
+
+
+def make_project(rng, files, data_mb):
+    # A project of source files and a dataset, as file name -> bytes.
+    words = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+        for _ in range(300)]
+    project = {}
+    for n in range(files):
+        lines = [" ".join(rng.choice(words) for _ in range(rng.randint(3, 12)))
+            for _ in range(rng.randint(50, 500))]
+        project["src/module%d.py" % n] = "\n".join(lines).encode()
+    rows = "".join("%d,%.6f,%.6f\n" % (n, rng.random(), rng.gauss(0, 1))
+        for n in range(data_mb * 30000)).encode()
+    project["data/train.csv"] = rows
+    return project
+
+
+def edit(rng, project):
+    # Changes a few lines of one source file.
+    name = rng.choice(sorted(n for n in project if n.endswith(".py")))
+    lines = project[name].split(b"\n")
+    for _ in range(3):
+        lines[rng.randrange(len(lines))] = b"    return result  # fixed"
+    project[name] = b"\n".join(lines)
+
+
+def submit(project):
+    sdir = create_submission_dir(COURSE, EXERCISE)
+    for name, content in project.items():
+        with open(submission_file_path(sdir, name), "wb") as f:
+            f.write(content)
+    sync_submission_dir(sdir)
+    sid = os.path.basename(sdir)
+    write_submission_meta(sid, {
+        "url": "http://localhost/", "dir": sdir,
+        "course_key": COURSE["key"], "exercise_key": EXERCISE["key"], "lang": "en",
+    })
+    return sid, sdir
+
+
+def same_tree(a, b):
+    cmp = filecmp.dircmp(a, b)
+    if cmp.left_only or cmp.right_only or cmp.funny_files:
+        return False
+    if filecmp.cmpfiles(a, b, cmp.common_files, shallow=False)[1:] != ([], []):
+        return False
+    return all(same_tree(os.path.join(a, d), os.path.join(b, d)) for d in cmp.common_dirs)
+
+
+def run_attempts(rec, counting, args, cache):
+    rng = random.Random(1)
+    project = make_project(rng, args.files, args.data)
+    sent = []
+    failed = 0
+    for attempt in range(args.attempts):
+        if attempt:
+            edit(rng, project)
+        sid, sdir = submit(project)
+        root = os.path.join(TMP, "pods", sid)
+        os.makedirs(os.path.join(root, "run"))
+        env = dict(os.environ, REC=rec, SID=sid, ROOT=root)
+        if cache:
+            env["BUNDLE_CACHE"] = cache
+        before = sum(v for k, v in counting.bytes.items() if k.startswith("/container/submission"))
+        result = subprocess.run(["sh", INIT_SH], env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        after = sum(v for k, v in counting.bytes.items() if k.startswith("/container/submission"))
+        sent.append(after - before)
+        if result.returncode != 0 or not same_tree(sdir, os.path.join(root, "submission")):
+            failed += 1
+            print(result.stderr.decode(), file=sys.stderr)
+        shutil.rmtree(root)
+    return sent, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--attempts", type=int, default=20)
+    parser.add_argument("--files", type=int, default=30,
+            help="Source files in the project")
+    parser.add_argument("--data", type=int, default=5,
+            help="Megabytes of data in the project")
+    args = parser.parse_args()
+
+    counting = Counting(get_wsgi_application())
+    server = make_server("127.0.0.1", 0, counting,
+        server_class=ThreadingServer, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    rec = "http://127.0.0.1:%d" % server.server_port
+    try:
+        make_course()
+        print("%d attempts of %d source files and %d MB of data, one file changed per attempt"
+            % (args.attempts, args.files, args.data))
+        print("%-16s %6s %12s %12s %12s" % ("", "failed", "first MB", "later kB", "total MB"))
+        for name, cache in (
+                ("whole archive", None),
+                ("delta", os.path.join(TMP, "node-cache"))):
+            if cache:
+                os.makedirs(cache)
+            sent, failed = run_attempts(rec, counting, args, cache)
+            print("%-16s %6d %12.2f %12.1f %12.2f" % (name, failed, sent[0] / 1e6,
+                sum(sent[1:]) / max(1, len(sent) - 1) / 1e3, sum(sent) / 1e6))
+    finally:
+        server.shutdown()
+        shutil.rmtree(TMP)
+
+
+if __name__ == '__main__':
+    main()
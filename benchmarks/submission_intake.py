@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+'''
+Load tests the intake of asynchronously graded submissions (acceptAsync)
+with many concurrent submitters, with the container ordered before the
+response (the default) and in the background (CONTAINER_ORDER_ASYNC).
+
+The grader runs in a subprocess as a WSGI server with a fixed number of
+worker threads, like a deployment with synchronous workers. A course with
+one exercise is generated into a temporary directory and the
+CONTAINER_SCRIPT is a stub that sleeps like `docker run -d` would.
+
+Usage: python benchmarks/submission_intake.py [--submitters 1000] [--workers 8] [--order-time 0.2]
+'''
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INDEX = """\
+name: Benchmark course
+modules:
+  - key: m1
+    name: Module
+    children:
+      - key: intake
+        config: intake.yaml
+"""
+
+EXERCISE = """\
+title: Intake
+max_points: 10
+view_type: access.types.stdasync.acceptPost
+fields:
+  - name: answer
+    title: Answer
+    required: true
+container:
+  image: grader/stub
+  mount: intake
+  cmd: /exercise/run.sh
+"""
+
+SERVER = """\
+import os, sys
+sys.path.insert(0, {base_dir!r})
+os.environ["DJANGO_SETTINGS_MODULE"] = "grader.settings"
+import django
+django.setup()
+import access.config
+access.config.DIR = {courses!r}
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+class PoolServer(WSGIServer):
+    request_queue_size = 2048
+    pool = ThreadPoolExecutor(max_workers={workers})
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+server = PoolServer(("127.0.0.1", {port}), QuietHandler)
+server.set_app(get_wsgi_application())
+print("ready", flush=True)
+server.serve_forever()
+"""
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def submit(port, results, barrier):
+    body = urllib.parse.urlencode({"answer": "42"})
+    barrier.wait()
+    start = time.perf_counter()
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+        conn.request("POST", "/bench_course/intake?submission_url=http://localhost/result", body,
+            {"Content-Type": "application/x-www-form-urlencoded"})
+        ok = conn.getresponse().status == 200
+        conn.close()
+    except OSError:
+        ok = False
+    results.append((ok, time.perf_counter() - start))
+
+
+def run(tmp, args, async_order):
+    port = free_port()
+    env = dict(os.environ,
+        LC_ALL="C.UTF-8",
+        GRADER_AJAX_KEY="bench",
+        GRADER_SECRET_KEY="bench",
+        GRADER_DEBUG="false",
+        GRADER_SUBMISSION_PATH=json.dumps(os.path.join(tmp, "uploads-%d" % (async_order))),
+        GRADER_CONTAINER_SCRIPT=json.dumps(os.path.join(tmp, "container.sh")),
+        GRADER_CONTAINER_ORDER_ASYNC=json.dumps(async_order),
+        GRADER_LOGGING=json.dumps({"version": 1}),
+    )
+    script = SERVER.format(base_dir=BASE_DIR, courses=os.path.join(tmp, "courses"),
+        workers=args.workers, port=port)
+    server = subprocess.Popen([sys.executable, "-c", script], env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    try:
+        server.stdout.readline()
+        results = []
+        barrier = threading.Barrier(args.submitters + 1)
+        threads = [threading.Thread(target=submit, args=(port, results, barrier))
+            for _ in range(args.submitters)]
+        for t in threads:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(latency for ok, latency in results)
+    failed = sum(1 for ok, latency in results if not ok)
+    print("%-28s %7.1f /s   p50 %6.2f s   p99 %6.2f s   failed %d" % (
+        "background container order" if async_order else "container order in request",
+        len(results) / elapsed,
+        latencies[len(latencies) // 2],
+        latencies[int(len(latencies) * 0.99) - 1],
+        failed,
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--submitters", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=8,
+            help="Request worker threads of the grader")
+    parser.add_argument("--order-time", type=float, default=0.2,
+            help="Seconds that the stub container script takes")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        course_dir = os.path.join(tmp, "courses", "bench_course")
+        os.makedirs(os.path.join(course_dir, "intake"))
+        with open(os.path.join(course_dir, "index.yaml"), "w") as f:
+            f.write(INDEX)
+        with open(os.path.join(course_dir, "intake.yaml"), "w") as f:
+            f.write(EXERCISE)
+        script = os.path.join(tmp, "container.sh")
+        with open(script, "w") as f:
+            f.write("#!/bin/sh\nsleep %s\n" % (args.order_time))
+        os.chmod(script, 0o755)
+
+        print("%d concurrent submitters, %d workers, container order %.2f s" % (
+            args.submitters, args.workers, args.order_time))
+        run(tmp, args, False)
+        run(tmp, args, True)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
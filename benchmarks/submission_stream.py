@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+'''
+Compares the submission downloads of the grading containers when the
+archive is built in a BytesIO before it is sent (the old behaviour) and
+when it is streamed as the files are read, with each compression.
+
+Each case runs in its own process for a submission directory of generated
+CSV data, and the download goes through the container-download-submission
+view like those of the pods. The peak RSS of the process is reported.
+
+Usage: python benchmarks/submission_stream.py [--sizes 10 100 400]
+'''
+import argparse
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "grader.settings")
+
+
+def make_submission(path, megabytes):
+    rng = random.Random(1)
+    os.makedirs(path)
+    rows = "".join("%d,%.6f,%.6f,%s\n" % (n, rng.random(), rng.gauss(0, 1),
+        rng.choice(("train", "test", "validate"))) for n in range(20000))
+    rows = rows.encode("ascii")
+    for n in range(max(1, megabytes // 50)):
+        with open(os.path.join(path, "data%d.csv" % n), "wb") as f:
+            for _ in range(min(50, megabytes) * 1000000 // len(rows)):
+                f.write(rows)
+
+
+def buffered(request, path, name):
+    # The download before the archives were streamed.
+    from django.http.response import FileResponse
+    data = BytesIO()
+    with tarfile.open(fileobj=data, mode='w:gz') as tar:
+        tar.add(path, arcname='.')
+    data.seek(0)
+    response = FileResponse(data, content_type='application/gzip')
+    response['Content-Disposition'] = 'attachment; filename="%s.tar.gz"' % (name,)
+    return response
+
+
+def run_case(case, path):
+    import django
+    django.setup()
+    from django.test import RequestFactory
+    import asyncjob.views
+    from util.files import write_submission_meta
+
+    write_submission_meta("benchsid", {
+        "url": "http://localhost/", "dir": path,
+        "course_key": "c", "exercise_key": "e", "lang": "en",
+    })
+    if case == "buffered":
+        asyncjob.views._container_download_sendtar = buffered
+        encoding = "gzip"
+    else:
+        encoding = case
+    request = RequestFactory().get("/container/submission.tar.gz",
+        HTTP_AUTHORIZATION="Bearer benchsid", HTTP_ACCEPT_ENCODING=encoding)
+    start = time.perf_counter()
+    response = asyncjob.views.container_download_submission(request)
+    first = None
+    size = 0
+    for chunk in response.streaming_content:
+        if first is None:
+            first = time.perf_counter() - start
+        size += len(chunk)
+    elapsed = time.perf_counter() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print("%f %f %d %d" % (elapsed, first, size, rss))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 400],
+            help="Submission sizes in MB")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.case:
+        run_case(args.case, args.path)
+        return
+
+    from asyncjob.archives import zstandard
+    cases = ["buffered", "gzip", "identity"] + (["zstd"] if zstandard else [])
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ, GRADER_SUBMISSION_PATH='"%s"' % os.path.join(tmp, "uploads"))
+    print("%6s %-9s %9s %10s %9s %10s %9s" % (
+        "MB", "case", "total s", "first ms", "MB/s", "archive MB", "RSS MB"))
+    try:
+        for megabytes in args.sizes:
+            path = os.path.join(tmp, "submission%d" % megabytes)
+            make_submission(path, megabytes)
+            for case in cases:
+                out = subprocess.check_output([sys.executable, __file__,
+                    "--case", case, "--path", path], env=env)
+                elapsed, first, size, rss = out.decode().split()[-4:]
+                print("%6d %-9s %9.2f %10.0f %9.1f %10.1f %9.1f" % (
+                    megabytes, case, float(elapsed), float(first) * 1000,
+                    megabytes / float(elapsed), int(size) / 1e6, int(rss) / 1e6))
+            shutil.rmtree(path)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
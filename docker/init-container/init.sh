@@ -5,34 +5,150 @@ if [ -z "$REC" -o -z "$SID" ]; then
     exit 1
 fi
 
-download() {
-    # download <url> <tmp file> <dest path>
+# BUNDLE_CACHE is a directory shared by the pods of the node (hostPath). The
+# exercise archives are kept there by their SHA-256 digest, so only the
+# first pod of an exercise version downloads it from the grader.
+# The chunks of the submissions (see util.files.write_submission_manifest)
+# are kept in BUNDLE_CACHE/chunks, so that a resubmission downloads only
+# the chunks that have changed. Bundles and chunks unused for
+# BUNDLE_CACHE_DAYS are removed.
+# ROOT relocates the directories of the pod for testing.
+ROOT=${ROOT:-}
+LOCK_WAIT=${BUNDLE_LOCK_WAIT:-30}
+CACHE_DAYS=${BUNDLE_CACHE_DAYS:-7}
+
+fetch() {
+    # fetch <url> <file> [<file to post>]
     if ! curl \
         --fail --silent --show-error --http1.0 \
         --retry 10 --retry-delay 3 --connect-timeout 20 --max-time 60 --retry-connrefused \
         -H "Authorization: Bearer $SID" \
+        ${3:+--data-binary} ${3:+"@$3"} \
         "$1" -o "$2"
     then
         echo "Failed to download $1" >&2
         return 1
     fi
+}
 
-    mkdir -p "$3"
-    tar -C "$3" -zxf "$2"
+extract() {
+    # extract <archive> <dest path>
+    mkdir -p "$2"
+    tar -C "$2" -zxf "$1"
+}
+
+download() {
+    # download <url> <tmp file> <dest path>
+    fetch "$1" "$2" && extract "$2" "$3"
+}
+
+cached_download() {
+    # cached_download <name> <tmp file> <dest path>
+    digest=$(sed -n "s/^$1 \([0-9a-f]\{64\}\)$/\1/p" "$ROOT/run/manifest.txt" 2>/dev/null)
+    if [ -z "$BUNDLE_CACHE" -o -z "$digest" -o ! -d "$BUNDLE_CACHE" ]; then
+        download "$REC/container/$1.tar.gz" "$2" "$3"
+        return
+    fi
+
+    bundle="$BUNDLE_CACHE/$digest.tar.gz"
+    if [ ! -f "$bundle" ]; then
+        # One pod downloads while the others of the node wait for it.
+        if mkdir "$bundle.lock" 2>/dev/null; then
+            if ! fetch "$REC/container/$1.tar.gz" "$2"; then
+                rmdir "$bundle.lock"
+                return 1
+            fi
+            if [ "$(sha256sum "$2" | cut -d ' ' -f 1)" = "$digest" ]; then
+                cp "$2" "$bundle.$$" && mv -f "$bundle.$$" "$bundle"
+            fi
+            rmdir "$bundle.lock"
+            extract "$2" "$3"
+            return
+        fi
+        waited=0
+        while [ ! -f "$bundle" -a -d "$bundle.lock" -a $waited -lt $LOCK_WAIT ]; do
+            sleep 1
+            waited=$((waited + 1))
+        done
+        if [ ! -f "$bundle" ]; then
+            download "$REC/container/$1.tar.gz" "$2" "$3"
+            return
+        fi
+    fi
+    touch "$bundle"
+    extract "$bundle" "$3"
 }
 
-download "$REC/container/exercise.tar.gz" "/run/exercise.tar.gz" "/exercise/" &
-download "$REC/container/submission.tar.gz" "/run/submission.tar.gz" "/submission/" &
-if [ -d /personalized_exercise/ ]; then
-    download "$REC/container/personalized.tar.gz" "/run/personalized.tar.gz" "/personalized_exercise/" &
+delta_download() {
+    # delta_download <tmp dir> <dest path>
+    manifest="$ROOT/run/submission.manifest"
+    chunks="$BUNDLE_CACHE/chunks"
+    if [ -z "$BUNDLE_CACHE" -o ! -d "$BUNDLE_CACHE" ]; then
+        return 1
+    fi
+    fetch "$REC/container/submission.manifest" "$manifest" || return 1
+    mkdir -p "$chunks" "$1" "$2" || return 1
+
+    sed -n 's/^C \([0-9a-f]\{64\}\)$/\1/p' "$manifest" | sort -u | while read -r digest; do
+        [ -f "$chunks/$digest" ] || echo "$digest"
+    done > "$1/missing"
+    if [ -s "$1/missing" ]; then
+        fetch "$REC/container/submission-chunks.tar.gz" "$1/chunks.tar.gz" "$1/missing" || return 1
+        tar -C "$1" -zxf "$1/chunks.tar.gz" || return 1
+        for digest in $(cat "$1/missing"); do
+            [ "$(sha256sum "$1/$digest" | cut -d ' ' -f 1)" = "$digest" ] || return 1
+            cp "$1/$digest" "$chunks/$digest.$$" && mv -f "$chunks/$digest.$$" "$chunks/$digest" || return 1
+        done
+    fi
+
+    # The files are written before the modes are set.
+    while read -r kind a b path; do
+        case "$kind" in
+            D) mkdir -p "$2/$path" || return 1 ;;
+            F) file="$2/$path"; : > "$file" || return 1 ;;
+            C) cat "$chunks/$a" >> "$file" || return 1 ;;
+        esac
+    done < "$manifest"
+    while read -r kind a b path; do
+        case "$kind" in
+            D|F) chmod "$a" "$2/$path" ;;
+        esac
+    done < "$manifest"
+    sed -n "s|^C |$chunks/|p" "$manifest" | xargs -r touch
+}
+
+submission_download() {
+    # submission_download <tmp dir> <dest path>
+    if ! delta_download "$1" "$2"; then
+        find "$2" -mindepth 1 -delete 2>/dev/null
+        download "$REC/container/submission.tar.gz" "$ROOT/run/submission.tar.gz" "$2"
+    fi
+}
+
+if [ -n "$BUNDLE_CACHE" -a -d "$BUNDLE_CACHE" ]; then
+    # The locks of the pods that died while downloading and the old bundles
+    find "$BUNDLE_CACHE" -maxdepth 1 -name '*.lock' -mmin +10 -exec rmdir {} \; 2>/dev/null
+    find "$BUNDLE_CACHE" -maxdepth 1 -name '*.tar.gz' -mtime +$CACHE_DAYS -exec rm -f {} \; 2>/dev/null
+    find "$BUNDLE_CACHE/chunks" -type f -mtime +$CACHE_DAYS -exec rm -f {} + 2>/dev/null
+    fetch "$REC/container/manifest.txt" "$ROOT/run/manifest.txt" || rm -f "$ROOT/run/manifest.txt"
+fi
+
+# The pids are collected because $(jobs -p) runs in a subshell in some shells.
+cached_download exercise "$ROOT/run/exercise.tar.gz" "$ROOT/exercise/" &
+pids="$!"
+submission_download "$ROOT/run/chunks" "$ROOT/submission/" &
+pids="$pids $!"
+if [ -d "$ROOT/personalized_exercise/" ]; then
+    cached_download personalized "$ROOT/run/personalized.tar.gz" "$ROOT/personalized_exercise/" &
+    pids="$pids $!"
 fi
 
 errors=0
-for job in $(jobs -p); do
+for job in $pids; do
     wait $job || errors=$((errors + 1))
 done
 
-ls -Rl /submission/ /exercise/
+ls -Rl "$ROOT/submission/" "$ROOT/exercise/"
 
-rm -f /run/*.tar.gz
+rm -rf "$ROOT"/run/*.tar.gz "$ROOT/run/manifest.txt" "$ROOT/run/submission.manifest" "$ROOT/run/chunks"
 exit $errors
@@ -69,3 +69,6 @@ if [ "$static_dir" != "" ]; then
   fi
   cd ..
 fi
+
+# Compile course configuration snapshot for the grader processes.
+python manage.py compile_courses $key
@@ -0,0 +1,6 @@
+"""
+Automatically generated file.
+This needs to be unique and SECRET. It is also installation specific.
+This file should be included from settings.py
+"""
+AJAX_KEY = 'ec+(20kj4#1bph828ttc2it_2@em%!=f(j%l!1h*a!y$#pja(s'
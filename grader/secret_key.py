@@ -0,0 +1,6 @@
+"""
+Automatically generated file.
+This needs to be unique and SECRET. It is also installation specific.
+This file should be included from settings.py
+"""
+SECRET_KEY = 'yr4euqa!2q5&8ex9q434k5qy5sndhq7(m13#+^662hmu9esv5#'
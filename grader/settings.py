@@ -146,10 +146,153 @@ DEFAULT_EXPIRY_MINUTES = 15
 # access/config.py contains hardcoded version of this value.
 COURSES_PATH = join(BASE_DIR, 'courses')
 
+# Compiled course configuration path:
+# `manage.py compile_courses` writes a binary snapshot of each parsed course
+# here. Workers load an up to date snapshot instead of parsing the YAML files.
+COMPILED_COURSES_PATH = join(BASE_DIR, 'courses-compiled')
+
+# Course configuration freshness checks:
+# Cached course and exercise configuration is checked against the file
+# modification times at most once per CONFIG_REVALIDATE_INTERVAL seconds
+# (0 checks on every request). With CONFIG_GENERATION_CHECK the files are only
+# checked after the course generation number has been bumped by
+# `manage.py compile_courses`, and the interval limits how often the number
+# is read. Then courses must not be edited without running compile_courses.
+CONFIG_REVALIDATE_INTERVAL = 0
+CONFIG_GENERATION_CHECK = False
+
+# Shared course configuration:
+# With CONFIG_SHARED_SNAPSHOTS the compiled snapshots are memory mapped and the
+# exercises are unpickled on demand, so the parsed configuration is shared by
+# all worker processes through the page cache instead of being copied to each.
+# A process keeps at most CONFIG_SHARED_CACHE_SIZE unpickled exercises per course.
+CONFIG_SHARED_SNAPSHOTS = False
+CONFIG_SHARED_CACHE_SIZE = 20
+
+# Course configuration file watching:
+# With CONFIG_WATCH_FILES each process watches the course files, including
+# the files pulled in with `include`, using inotify (Linux only). Cached
+# configuration is then dropped when its files change and the files are not
+# checked on requests. Other platforms fall back to the checks above.
+CONFIG_WATCH_FILES = False
+
+# Parallel course configuration loading:
+# On a cold start, the course list parses all courses and their exercises in
+# this many worker processes. With 1, courses are parsed on demand.
+CONFIG_LOAD_JOBS = 1
+
+# Rendered RST cache:
+# HTML rendered from the `|rst` configuration values is stored here, keyed by
+# the content hash, and shared by all processes. The least recently used
+# fragments are removed when the total size exceeds RST_CACHE_SIZE bytes.
+# The fragments with directives that read files (include, or the :file: and
+# :url: options) are not cached. The directory is ignored by git. Set the
+# path to None to disable the cache.
+RST_CACHE_PATH = join(BASE_DIR, 'rst-cache')
+RST_CACHE_SIZE = 64 * 1024 * 1024
+
+# A+ export cache:
+# The aplus-json export is built once per course version and base URL and kept
+# in the Django cache (see CACHES) for APLUS_JSON_CACHE_TIMEOUT seconds (None
+# keeps it until evicted). With a cache shared by the processes, e.g.
+# memcached, `manage.py compile_courses` pre-warms the export for the base
+# URLs in APLUS_JSON_PREWARM_URLS, e.g. ['https://grader.example.com/'].
+APLUS_JSON_CACHE_TIMEOUT = None
+APLUS_JSON_PREWARM_URLS = []
+
+# With APLUS_JSON_STREAM the export is encoded and sent one module at a time,
+# so the whole document is never in memory. It is then only cached when it is
+# at most APLUS_JSON_CACHE_MAX_SIZE bytes (the memcached default item limit).
+APLUS_JSON_STREAM = False
+APLUS_JSON_CACHE_MAX_SIZE = 1024 * 1024
+
+# Regular expressions from the course configuration, e.g. questionnaire answers
+# compared with `regexp` and submission field patterns, are matched within
+# REGEX_TIMEOUT seconds. A match that takes longer fails the answer. If the
+# optional `re2` module is installed, the patterns that it supports are matched
+# in linear time instead. `manage.py exercises` warns about risky patterns.
+REGEX_TIMEOUT = 0.5
+
 # Exercise files submission path:
 # Django process requires write access to this directory.
 SUBMISSION_PATH = join(BASE_DIR, 'uploads')
 
+# Submission intake:
+# Submitted files and the submission meta are flushed to the disk (fsync)
+# before the submission is accepted, unless SUBMISSION_FSYNC is False. With
+# CONTAINER_ORDER_ASYNC the response is sent without waiting for the
+# CONTAINER_SCRIPT: containers are ordered by at most
+# BACKGROUND_INVOKE_WORKERS threads per process, and a failed order is only
+# logged. The threads require `enable-threads` in uWSGI. The orders that a
+# process leaves pending when it exits, e.g. in a reload, are kept next to
+# the submission meta and ordered again by the next process of the host
+# that accepts a submission. With CONTAINER_ORDER_CELERY the submission is stored as an
+# asyncjob.models.AsyncJob and the container is ordered by a Celery worker,
+# which requires PostgreSQL and a Celery broker (CELERY_BROKER_URL).
+SUBMISSION_FSYNC = True
+CONTAINER_ORDER_ASYNC = False
+CONTAINER_ORDER_CELERY = False
+BACKGROUND_INVOKE_WORKERS = 4
+
+# Grading queue estimates (asyncjob.tracker):
+# The queue drains at the rate the jobs completed during the last
+# QUEUE_ESTIMATE_WINDOW seconds, and a container takes the median time of
+# the last QUEUE_ESTIMATE_SAMPLES jobs of the exercise.
+QUEUE_ESTIMATE_WINDOW = 600
+QUEUE_ESTIMATE_SAMPLES = 50
+
+# Admission control of the grading containers (asyncjob.admission), with
+# CONTAINER_ORDER_CELERY: at most CONTAINER_LIMIT_TOTAL containers run at a
+# time, CONTAINER_LIMIT_COURSE per course and CONTAINER_LIMIT_EXERCISE per
+# exercise (None for no limit). The jobs over the limits wait in the queue,
+# and free containers go to the course with the least running containers
+# relative to its weight in CONTAINER_COURSE_WEIGHTS (course key -> weight,
+# 1 by default). A job that has held a container for
+# CONTAINER_ADMISSION_TIMEOUT seconds without completing is considered lost,
+# and a job whose order has not reached a Celery worker by then is ordered
+# again.
+CONTAINER_LIMIT_TOTAL = None
+CONTAINER_LIMIT_COURSE = None
+CONTAINER_LIMIT_EXERCISE = None
+CONTAINER_COURSE_WEIGHTS = {}
+CONTAINER_ADMISSION_TIMEOUT = 3600
+
+# Priority lanes of the limited containers (asyncjob.admission): the lane
+# is set with `container.priority` (low/normal/high) in the exercise.
+# Submissions after PRIORITY_RESUBMISSIONS attempts drop a lane and the
+# submissions during the last PRIORITY_DEADLINE_WINDOW seconds before the
+# module closes rise a lane. A waiting job rises a lane every
+# PRIORITY_AGING seconds, so the lower lanes are not starved.
+PRIORITY_RESUBMISSIONS = 5
+PRIORITY_DEADLINE_WINDOW = 3600
+PRIORITY_AGING = 300
+
+# Container download archives:
+# The archives of the exercise and personalized exercise directories that
+# the grading containers download are built once per content version and
+# kept here. Set the path to None to build an archive for every download.
+# The version of a course directory that is a git checkout (gitmanager) is
+# its commit and the generation that `manage.py compile_courses` bumps, so
+# run it after changing the files. The other directories are scanned for
+# changes on every download. The archives that have not been downloaded for
+# CONTAINER_ARCHIVE_MAX_AGE seconds are removed (None to keep them).
+CONTAINER_ARCHIVE_PATH = join(BASE_DIR, 'container-archives')
+CONTAINER_ARCHIVE_MAX_AGE = 7 * 24 * 3600
+
+# Delta submission downloads:
+# The init containers that have a node-local bundle cache download a chunk
+# manifest with the SHA-256 digest of every SUBMISSION_CHUNK_SIZE bytes of
+# the submitted files, and then only the chunks missing from the earlier
+# submissions. The manifest is written next to the submission directory on
+# the first download, not when the submission is accepted. Set to None to
+# always send the whole submission.
+SUBMISSION_CHUNK_SIZE = 1024 * 1024
+
+# Kubernetes pod watcher (manage.py kube_watcher):
+# The watcher keeps the resource version of the last recorded pod event
+# here, so that it resumes from it after a restart.
+KUBE_WATCHER_STATE = join(BASE_DIR, 'kube-watcher.state')
+
 # Personalized exercises and user files are kept here.
 # Django process requires write access to this directory.
 PERSONALIZED_CONTENT_PATH = join(BASE_DIR, 'exercises-meta')
@@ -62,6 +62,7 @@ async def watch_pods():
                 'reason': obj.status.reason,
                 'pod_name': obj.metadata.name,
                 'pod_id': obj.metadata.uid,
+                'sid': (obj.metadata.labels or {}).get('sid'),
             }
 
             times = {
@@ -36,6 +36,7 @@ def kubernetes_run(arguments):
     EXERCISE_LABEL = makeValidLabel(exercise_config.get('title', ''))
     DEFAULT_CPU = 1
     DEFAULT_MEM = "1Gi"
+    BUNDLE_CACHE = "/var/cache/grader-bundles"
     
     # Setup volumes & mounts
     volumes = [
@@ -54,6 +55,11 @@ def kubernetes_run(arguments):
         volumes.append( c.V1Volume(name='personalized', empty_dir=c.V1EmptyDirVolumeSource()) )
         volume_mounts.append( c.V1VolumeMount(name='personalized', mount_path='/personalized_exercise') )
 
+    # Node-local cache of the exercise archives, only for the init container
+    volumes.append( c.V1Volume(name='bundle-cache', host_path=c.V1HostPathVolumeSource(
+        path=BUNDLE_CACHE, type='DirectoryOrCreate')) )
+    init_volume_mounts = volume_mounts + [ c.V1VolumeMount(name='bundle-cache', mount_path='/bundle-cache') ]
+
     # Prepare pod & pod metadata
     namespace = 'grader'
     #-if DOCKER_IMAGE.startswith("cse4100/mccdind"):
@@ -66,6 +72,7 @@ def kubernetes_run(arguments):
             'mooc-grader': GRADER_NAME,
             'course': COURSE_LABEL,
             'exercise': EXERCISE_LABEL,
+            'sid': SID,
         }
     )
 
@@ -105,10 +112,14 @@ def kubernetes_run(arguments):
         init_containers=[c.V1Container(
             name='download',
             image='init-container',
-            volume_mounts=volume_mounts,
+            volume_mounts=init_volume_mounts,
             image_pull_policy="IfNotPresent",
             resources=resources,
-            env=[c.V1EnvVar(name="SID", value=SID), c.V1EnvVar(name="REC", value=GRADER_HOST)],
+            env=[
+                c.V1EnvVar(name="SID", value=SID),
+                c.V1EnvVar(name="REC", value=GRADER_HOST),
+                c.V1EnvVar(name="BUNDLE_CACHE", value="/bundle-cache"),
+            ],
             #-security_context=securityContext
         )],
         containers=[c.V1Container(
@@ -1,4 +1,11 @@
 from collections import OrderedDict
+import logging
+import os
+import tempfile
+import time
+
+
+LOGGER = logging.getLogger('main')
 
 
 class InProcessCache(OrderedDict):
@@ -11,3 +18,116 @@ class InProcessCache(OrderedDict):
         super().__setitem__(key, value)
         if len(self) > self.limit:
             self.popitem(last=False)
+
+
+class FileCache:
+    '''
+    A text cache in a directory shared by processes. Keys are hex digests,
+    e.g. content hashes. Each entry is a file that is written atomically.
+    The modification time of an entry is refreshed on use, and the least
+    recently used entries are removed when the total size exceeds a limit.
+    '''
+    # Refresh the modification time of a used entry at most this often.
+    TOUCH_INTERVAL = 3600
+    # Check the total size after this many writes.
+    PRUNE_INTERVAL = 64
+
+    def __init__(self, path, max_size):
+        '''
+        @type path: C{str}
+        @param path: the cache directory
+        @type max_size: C{int}
+        @param max_size: the limit for the total size of the entries in bytes
+        '''
+        self.path = path
+        self.max_size = max_size
+        self._writes = 0
+        self._failed = False
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        '''
+        @type key: C{str}
+        @param key: a hex digest
+        @rtype: C{str}
+        @return: the cached text or None
+        '''
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = f.read()
+                mtime = os.fstat(f.fileno()).st_mtime
+        except (OSError, ValueError):
+            return None
+        if time.time() - mtime > self.TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return value
+
+    def set(self, key, value):
+        '''
+        Stores a text. Failures are logged once and otherwise ignored.
+
+        @type key: C{str}
+        @param key: a hex digest
+        @type value: C{str}
+        @param value: the text to store
+        '''
+        path = self._entry_path(key)
+        try:
+            directory = os.path.dirname(path)
+            if not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(value)
+                os.replace(tmp_path, path)
+            except:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            if not self._failed:
+                self._failed = True
+                LOGGER.warning("Failed to write to cache %s: %s", self.path, e)
+            return
+        self._writes += 1
+        if self._writes % self.PRUNE_INTERVAL == 0:
+            self.prune()
+
+    def prune(self):
+        '''
+        Removes the least recently used entries until the total size is
+        below 80 % of the limit, if the limit is exceeded.
+        '''
+        entries = []
+        total = 0
+        try:
+            for d in os.scandir(self.path):
+                if not d.is_dir():
+                    continue
+                for e in os.scandir(d.path):
+                    try:
+                        stat = e.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, e.path))
+                    total += stat.st_size
+        except OSError:
+            return
+        if total <= self.max_size:
+            return
+        entries.sort()
+        target = self.max_size * 0.8
+        for _mtime, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
@@ -2,8 +2,16 @@
 Utility functions for dictionaries.
 
 '''
+from collections.abc import Mapping
+from django.conf import settings
+from functools import lru_cache
+import docutils
 import docutils.core
+import hashlib
 import re
+import threading
+
+from .cache import FileCache
 
 
 def iterate_kvp_with_dfs(node, key_regex=None):
@@ -42,6 +50,10 @@ def iterate_kvp_with_dfs(node, key_regex=None):
 def get_rst_as_html(rst_str):
     '''
     Return a string with RST formatting as HTML.
+    Results are memoized per source string and stored to the rendered RST
+    cache in settings.RST_CACHE_PATH shared by processes. The strings with
+    directives that read files, such as include, are rendered every time,
+    as the source string does not tell when the files change.
 
     @type rst_str: C{str}
     @param rst_str: the RST string to convert
@@ -50,8 +62,93 @@ def get_rst_as_html(rst_str):
     '''
     if not rst_str:
         return rst_str
+    if isinstance(rst_str, str) and not _READS_FILES.search(rst_str):
+        return _rst_to_html(rst_str)
+    return _render_rst(rst_str)[0]
+
+
+# the include directive and the :file: and :url: options of raw and csv-table
+_READS_FILES = re.compile(r'^\s*(\.\.\s+include::|:(file|url):)', re.MULTILINE)
+
+_rst_cache = None
+
+def _get_rst_cache():
+    global _rst_cache
+    path = settings.RST_CACHE_PATH
+    if not path:
+        return None
+    if _rst_cache is None or _rst_cache.path != path:
+        _rst_cache = FileCache(path, settings.RST_CACHE_SIZE)
+    return _rst_cache
+
+
+@lru_cache(maxsize=4096)
+def _rst_to_html(rst_str):
+    cache = _get_rst_cache()
+    if cache is None:
+        return _render_rst(rst_str)[0]
+    # The docutils version is included as it may change the output.
+    key = hashlib.sha256(
+        (docutils.__version__ + '\0' + rst_str).encode('utf-8')
+    ).hexdigest()
+    html = cache.get(key)
+    if html is None:
+        html, ok = _render_rst(rst_str)
+        if ok:
+            cache.set(key, html)
+    return html
+
+
+def _render_rst(rst_str):
     try:
         parts = docutils.core.publish_parts(source=rst_str, writer_name='html')
-        return parts['fragment']
+        return parts['fragment'], True
     except Exception as e:
-        return str(e)
+        return str(e), False
+
+
+class LazyDict(Mapping):
+    '''
+    A read only dictionary with known keys whose values are created on the
+    first access. Pickling or copying creates a normal dictionary with all
+    values created.
+    '''
+
+    def __init__(self, keys, factory):
+        '''
+        @type keys: C{iterable}
+        @param keys: the keys of the dictionary
+        @type factory: C{function}
+        @param factory: a function that creates the value for a key
+        '''
+        self._keys = list(keys)
+        self._values = {}
+        self._factory = factory
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            if key not in self._keys:
+                raise
+        # The threads of a process share the dictionary.
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = self._factory(key)
+                if len(self._values) == len(self._keys):
+                    # Release the data referenced by the factory.
+                    self._factory = None
+            return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __reduce__(self):
+        return (dict, (dict(self.items()),))
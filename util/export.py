@@ -1,6 +1,48 @@
 from itertools import zip_longest
+from urllib.parse import urljoin
 from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.urlresolvers import reverse
+import hashlib
+import json
+
+
+COURSE_FIELDS = [
+    "archive_time",
+    "assistants",
+    "categories",
+    "contact",
+    "content_numbering",
+    "course_description",
+    "course_footer",
+    "description",
+    "end",
+    "enrollment_audience",
+    "enrollment_end",
+    "enrollment_start",
+    "head_urls",
+    "index_mode",
+    "lifesupport_time",
+    "module_numbering",
+    "name",
+    "numerate_ignoring_modules",
+    "start",
+    "view_content_to",
+]
+
+
+class BaseUrlRequest:
+    '''
+    Builds absolute URLs like a request to a base URL would.
+    Used to export outside of requests, e.g. to pre-warm the cache.
+    '''
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def build_absolute_uri(self, location='/'):
+        return urljoin(self.base_url, location)
 
 
 def url_to_exercise(request, course_key, exercise_key):
@@ -26,6 +68,169 @@ def url_to_static(request, course_key, path):
         '{}{}/{}'.format(settings.STATIC_URL, course_key, path))
 
 
+def course_document(request, config, course):
+    '''
+    Exports course data for A+.
+
+    @type config: C{ConfigParser}
+    @param config: the course configuration
+    @type course: C{dict}
+    @param course: a course configuration
+    @rtype: C{dict}
+    @return: the export document
+    '''
+    data = _course_head(course)
+    data["modules"] = [
+        module(request, config, course, m)
+        for m in course.get("modules", [])
+    ]
+    data.update(_course_tail(request, course))
+    return data
+
+
+def course_json_chunks(request, config, course):
+    '''
+    Exports course data for A+ as JSON text built one module at a time.
+    The result equals the JSON encoded course_document.
+
+    @type config: C{ConfigParser}
+    @param config: the course configuration
+    @type course: C{dict}
+    @param course: a course configuration
+    @rtype: C{generator}
+    @return: JSON text chunks
+    '''
+    encoder = DjangoJSONEncoder()
+    head = encoder.encode(_course_head(course))[:-1]
+    yield head + (', ' if head != '{' else '') + '"modules": ['
+    for n, m in enumerate(course.get("modules", [])):
+        yield (', ' if n > 0 else '') + encoder.encode(module(request, config, course, m))
+    tail = encoder.encode(_course_tail(request, course))[1:]
+    yield ']' + (', ' if tail != '}' else '') + tail
+
+
+def module(request, config, course, m):
+    '''
+    Exports module data with the exercises and chapters in it.
+
+    @type config: C{ConfigParser}
+    @param config: the course configuration
+    @type course: C{dict}
+    @param course: a course configuration
+    @type m: C{dict}
+    @param m: a module configuration
+    @rtype: C{dict}
+    @return: the module export
+    '''
+    def children_recursion(parent):
+        if not "children" in parent:
+            return []
+        result = []
+        for o in [o for o in parent["children"] if "key" in o]:
+            of = _type_dict(o, course.get("exercise_types", {}))
+            if "config" in of:
+                _, exercise_root = config.exercise_entry(course["key"], str(of["key"]), '_root')
+                of = exercise(request, course, exercise_root, of)
+            elif "static_content" in of:
+                of = chapter(request, course, of)
+            of["children"] = children_recursion(o)
+            result.append(of)
+        return result
+
+    mf = _type_dict(m, course.get("module_types", {}))
+    mf["children"] = children_recursion(m)
+    return mf
+
+
+def _course_head(course):
+    data = _copy_fields(course, COURSE_FIELDS)
+    data['lang'] = course['languages']
+    return data
+
+
+def _course_tail(request, course):
+    data = {}
+    if "gitmanager" in settings.INSTALLED_APPS:
+        data["build_log_url"] = request.build_absolute_uri(reverse("build-log-json", args=(course['key'], )))
+    return data
+
+
+def course_etag(request, config, course):
+    '''
+    Gets an entity tag for the A+ export of a course. It changes with the
+    course configuration and the base URL of the request.
+
+    @type config: C{ConfigParser}
+    @param config: the course configuration
+    @type course: C{dict}
+    @param course: a course configuration
+    @rtype: C{str}
+    @return: an entity tag
+    '''
+    version = config.course_version(course['key'])
+    base_url = request.build_absolute_uri('/')
+    return hashlib.sha1((version + '\0' + base_url).encode('utf-8')).hexdigest()
+
+
+def cached_course_json(request, config, course, etag=None):
+    '''
+    Gets the A+ export of a course as JSON. The export is built once per
+    course version and base URL, and kept in the Django cache.
+
+    @type config: C{ConfigParser}
+    @param config: the course configuration
+    @type course: C{dict}
+    @param course: a course configuration
+    @type etag: C{str}
+    @param etag: the entity tag if already known
+    @rtype: C{tuple}
+    @return: an entity tag, the JSON document as bytes
+    '''
+    if etag is None:
+        etag = course_etag(request, config, course)
+    key = 'aplus-json:%s:%s' % (course['key'], etag)
+    content = cache.get(key)
+    if content is None:
+        content = json.dumps(course_document(request, config, course), cls=DjangoJSONEncoder).encode('utf-8')
+        cache.set(key, content, settings.APLUS_JSON_CACHE_TIMEOUT)
+    return etag, content
+
+
+def streamed_course_json(request, config, course, etag):
+    '''
+    Streams the A+ export of a course as JSON. A cached export is used if
+    available. Otherwise, the export is built one module at a time and
+    cached when it is at most settings.APLUS_JSON_CACHE_MAX_SIZE bytes.
+
+    @type config: C{ConfigParser}
+    @param config: the course configuration
+    @type course: C{dict}
+    @param course: a course configuration
+    @type etag: C{str}
+    @param etag: the entity tag from course_etag
+    @rtype: C{generator}
+    @return: JSON document chunks as bytes
+    '''
+    key = 'aplus-json:%s:%s' % (course['key'], etag)
+    content = cache.get(key)
+    if content is not None:
+        yield content
+        return
+    chunks = []
+    size = 0
+    for chunk in course_json_chunks(request, config, course):
+        chunk = chunk.encode('utf-8')
+        if chunks is not None:
+            size += len(chunk)
+            if size <= settings.APLUS_JSON_CACHE_MAX_SIZE:
+                chunks.append(chunk)
+            else:
+                chunks = None
+        yield chunk
+    if chunks is not None:
+        cache.set(key, b''.join(chunks), settings.APLUS_JSON_CACHE_TIMEOUT)
+
+
 def chapter(request, course, of):
     ''' Exports chapter data '''
     path = of.pop('static_content')
@@ -161,7 +366,7 @@ def form_fields(languages, exercises):
 
         if 'extra_info' in f:
             es = list_get(fs, 'extra_info', {})
-            extra = es[0]
+            extra = dict(es[0])
             for key in ['validationMessage']:
                 if key in extra:
                     extra[key] = i18n_map(list_get(es, key, ''))
@@ -262,3 +467,42 @@ def list_get(dicts, key, default):
 
 def list_enumerate(lists, default):
     return zip_longest(*lists, fillvalue=default)
+
+
+def _copy_fields(dict_item, pick_fields):
+    '''
+    Copies picked fields from a dictionary.
+
+    @type dict_item: C{dict}
+    @param dict_item: a dictionary
+    @type pick_fields: C{list}
+    @param pick_fields: a list of field names
+    @rtype: C{dict}
+    @return: a dictionary of picked fields
+    '''
+    result = {}
+    for name in pick_fields:
+        if name in dict_item:
+            result[name] = dict_item[name]
+    return result
+
+
+def _type_dict(dict_item, dict_types):
+    '''
+    Extends dictionary with a type reference. The export only replaces
+    top level keys, so the nested values are shared with the configuration.
+
+    @type dict_item: C{dict}
+    @param dict_item: a dictionary
+    @type dict_types: C{dict}
+    @param dict_types: a dictionary of type dictionaries
+    @rtype: C{dict}
+    @return: an extended dictionary
+    '''
+    base = {}
+    if "type" in dict_item and dict_item["type"] in dict_types:
+        base.update(dict_types[dict_item["type"]])
+    base.update(dict_item)
+    if "type" in base:
+        del base["type"]
+    return base
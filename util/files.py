@@ -3,7 +3,7 @@ Utility functions for exercise files.
 
 '''
 from django.conf import settings
-import datetime, random, string, os, shutil, json
+import datetime, random, string, os, shutil, json, hashlib, stat, socket
 
 
 META_PATH = os.path.join(settings.SUBMISSION_PATH, "meta")
@@ -11,6 +11,21 @@ if not os.path.exists(META_PATH):
     os.makedirs(META_PATH)
 
 
+def _sync_file(f):
+    f.flush()
+    if settings.SUBMISSION_FSYNC:
+        os.fsync(f.fileno())
+
+
+def _sync_dir(dir_path):
+    if settings.SUBMISSION_FSYNC and os.path.isdir(dir_path):
+        fd = os.open(dir_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
 def random_ascii(length, rng=None):
     if not rng:
         # Use the functions in the random module without manually creating
@@ -42,6 +57,20 @@ def create_submission_dir(course, exercise):
     return submission_dir
 
 
+def sync_submission_dir(submission_dir):
+    '''
+    Makes the files written to a submission directory durable, i.e. flushes
+    the directory entries to the disk. The file contents are flushed when
+    they are written.
+
+    @type submission_dir: C{str}
+    @param submission_dir: directory path
+    '''
+    _sync_dir(os.path.join(submission_dir, 'user'))
+    _sync_dir(submission_dir)
+    _sync_dir(os.path.dirname(submission_dir))
+
+
 def clean_submission_dir(submission_dir):
     '''
     Cleans a submission directory after grading.
@@ -51,6 +80,102 @@ def clean_submission_dir(submission_dir):
     '''
     if submission_dir.startswith(settings.SUBMISSION_PATH):
         shutil.rmtree(submission_dir)
+        try:
+            os.unlink(submission_manifest_path(submission_dir))
+        except FileNotFoundError:
+            pass
+
+
+def submission_manifest_path(submission_dir):
+    '''
+    @type submission_dir: C{str}
+    @param submission_dir: directory path
+    @rtype: C{str}
+    @return: the path of the chunk manifest of a submission directory
+    '''
+    return os.path.normpath(submission_dir) + ".manifest"
+
+
+def write_submission_manifest(submission_dir):
+    '''
+    Writes the chunk manifest of a submission directory, so that the
+    grading containers can download only the chunks that they do not have
+    from the earlier submissions. The manifest has a line for each entry:
+    "S <chunk size>", "D <mode> 0 <path>" for a directory and
+    "F <mode> <size> <path>" for a file, which is followed by a
+    "C <SHA-256>" line for each settings.SUBMISSION_CHUNK_SIZE bytes of it.
+    The paths are relative to the submission directory.
+
+    No manifest is written if SUBMISSION_CHUNK_SIZE is None or the
+    directory is missing or has other than regular files and directories.
+
+    @type submission_dir: C{str}
+    @param submission_dir: directory path
+    @rtype: C{bool}
+    @return: True if the manifest was written
+    '''
+    chunk_size = settings.SUBMISSION_CHUNK_SIZE
+    if not chunk_size or not os.path.isdir(submission_dir):
+        return False
+    lines = ["S %d\n" % (chunk_size,)]
+    for root, dirs, files in os.walk(submission_dir):
+        dirs.sort()
+        for name in [root] + sorted(os.path.join(root, f) for f in files):
+            if name == root and root == submission_dir:
+                continue
+            path = os.path.relpath(name, submission_dir)
+            st = os.lstat(name)
+            # The manifest is read by lines in a shell script.
+            if "\n" in path or path != path.strip():
+                return False
+            if stat.S_ISDIR(st.st_mode):
+                lines.append("D %o 0 %s\n" % (stat.S_IMODE(st.st_mode), path))
+            elif stat.S_ISREG(st.st_mode):
+                lines.append("F %o %d %s\n" % (stat.S_IMODE(st.st_mode), st.st_size, path))
+                with open(name, "rb") as f:
+                    for chunk in iter(lambda: f.read(chunk_size), b""):
+                        lines.append("C %s\n" % (hashlib.sha256(chunk).hexdigest(),))
+            else:
+                return False
+    manifest_path = submission_manifest_path(submission_dir)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8", errors="surrogateescape") as f:
+        f.writelines(lines)
+        _sync_file(f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return True
+
+
+def read_submission_chunks(submission_dir):
+    '''
+    Reads the chunks of a submission directory from its manifest, see
+    write_submission_manifest.
+
+    @type submission_dir: C{str}
+    @param submission_dir: directory path
+    @rtype: C{dict}
+    @return: (file path, offset, size) by the SHA-256 hex digests of the
+        chunks, or None if the directory has no manifest
+    '''
+    chunks = {}
+    try:
+        f = open(submission_manifest_path(submission_dir), "r",
+            encoding="utf-8", errors="surrogateescape")
+    except FileNotFoundError:
+        return None
+    with f:
+        for line in f:
+            kind, _, rest = line.rstrip("\n").partition(" ")
+            if kind == "S":
+                chunk_size = int(rest)
+            elif kind == "F":
+                _, size, path = rest.split(" ", 2)
+                file_path = os.path.join(submission_dir, path)
+                size = int(size)
+                offset = 0
+            elif kind == "C":
+                chunks[rest] = (file_path, offset, min(chunk_size, size - offset))
+                offset += chunk_size
+    return chunks
 
 
 def save_submitted_file(submission_dir, file_name, post_file):
@@ -68,6 +193,7 @@ def save_submitted_file(submission_dir, file_name, post_file):
     with open(file_path, "wb+") as f:
         for chunk in post_file.chunks():
             f.write(chunk)
+        _sync_file(f)
 
 
 def write_submission_file(submission_dir, file_name, content):
@@ -84,6 +210,7 @@ def write_submission_file(submission_dir, file_name, content):
     file_path = submission_file_path(submission_dir, file_name)
     with open(file_path, "w+") as f:
         f.write(content)
+        _sync_file(f)
 
 def read_submission_file(submission_dir, file_name):
     file_path = submission_file_path(submission_dir, file_name)
@@ -147,9 +274,14 @@ def _meta_dir(sid):
 
 
 def write_submission_meta(sid, data):
-    with open(_meta_dir(sid), "w") as f:
+    # Replace atomically, so that a reader never sees a partial file.
+    path = _meta_dir(sid)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
         f.write(json.dumps(data))
-        f.close()
+        _sync_file(f)
+    os.replace(tmp_path, path)
+    _sync_dir(META_PATH)
 
 def read_submission_meta(sid):
     p = _meta_dir(sid)
@@ -167,3 +299,82 @@ def read_and_remove_submission_meta(sid):
         data = json.loads(f.read())
     os.unlink(p)
     return data
+
+
+def _order_path(sid):
+    return _meta_dir(sid) + ".order"
+
+
+def write_pending_order(sid, cmd):
+    '''
+    Records a container order that runs in the background of this process,
+    so that another process can order the container again if this one
+    exits before the order completes, see claim_pending_orders.
+
+    @type sid: C{str}
+    @param sid: the submission id
+    @type cmd: C{list}
+    @param cmd: the CONTAINER_SCRIPT command line
+    '''
+    path = _order_path(sid)
+    with open(path + ".tmp", "w") as f:
+        f.write(json.dumps({"host": socket.gethostname(), "pid": os.getpid(), "cmd": cmd}))
+        _sync_file(f)
+    os.replace(path + ".tmp", path)
+    _sync_dir(META_PATH)
+
+
+def remove_pending_order(sid):
+    try:
+        os.unlink(_order_path(sid))
+    except FileNotFoundError:
+        pass
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def claim_pending_orders():
+    '''
+    Takes over the pending container orders of the processes of this host
+    that have exited, e.g. in a reload or a crash.
+
+    @rtype: C{list}
+    @return: (submission id, command line) of the claimed orders
+    '''
+    host = socket.gethostname()
+    pid = os.getpid()
+    claimed = []
+    for name in os.listdir(META_PATH):
+        if not name.endswith(".order"):
+            continue
+        path = os.path.join(META_PATH, name)
+        claim_path = "%s.%d" % (path, pid)
+        try:
+            with open(path, "r") as f:
+                order = json.loads(f.read())
+            if order["host"] != host or _process_exists(order["pid"]):
+                continue
+            # Only one process can move the file away.
+            os.rename(path, claim_path)
+            with open(claim_path, "r") as f:
+                if json.loads(f.read())["pid"] != order["pid"]:
+                    # Another process claimed it between the reads.
+                    os.rename(claim_path, path)
+                    continue
+        except (FileNotFoundError, ValueError, KeyError):
+            continue
+        order["pid"] = pid
+        with open(claim_path, "w") as f:
+            f.write(json.dumps(order))
+            _sync_file(f)
+        os.replace(claim_path, path)
+        claimed.append((name[:-len(".order")], order["cmd"]))
+    return claimed
@@ -0,0 +1,305 @@
+'''
+Regular expressions from the course configuration, e.g. the questionnaire
+answers compared with `regexp` and the `pattern` of the submission fields.
+
+Python regular expressions backtrack, and a careless pattern can take
+exponential time on a crafted answer. Patterns are checked for the usual
+causes of catastrophic backtracking when they are compiled, and matching
+runs within a time budget (settings.REGEX_TIMEOUT). If the optional `re2`
+module is installed, patterns that it supports are matched in linear time
+without a budget.
+
+'''
+from django.conf import settings
+from functools import lru_cache
+import logging
+import re
+import signal
+import sre_constants as sre
+import sre_parse
+import threading
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+
+LOGGER = logging.getLogger('main')
+
+# Characters used to check whether two parts of a pattern may match the same text.
+SAMPLE_CHARS = [chr(i) for i in range(32, 127)] + ['\t', '\n', 'ä', '€']
+CATEGORIES = {
+    sre.CATEGORY_DIGIT: str.isdigit,
+    sre.CATEGORY_SPACE: str.isspace,
+    sre.CATEGORY_WORD: lambda c: c.isalnum() or c == '_',
+}
+CATEGORIES.update({
+    sre.CATEGORY_NOT_DIGIT: lambda c: not c.isdigit(),
+    sre.CATEGORY_NOT_SPACE: lambda c: not c.isspace(),
+    sre.CATEGORY_NOT_WORD: lambda c: not (c.isalnum() or c == '_'),
+})
+
+
+class RegexTimeout(Exception):
+    '''
+    Matching a regular expression exceeded the time budget.
+    '''
+    pass
+
+
+def _alarm(signum, frame):
+    raise RegexTimeout()
+
+
+_handler_installed = None
+
+
+def _time_budget_available():
+    global _handler_installed
+    if not hasattr(signal, 'setitimer'):
+        return False
+    # Signal handlers can only be set in the main thread.
+    if threading.current_thread() is not threading.main_thread():
+        return False
+    # Do not override a timer that someone else has set.
+    if signal.getitimer(signal.ITIMER_REAL)[0] != 0:
+        return False
+    # The handler is installed once per process, unless someone else has
+    # already set one.
+    if _handler_installed is None:
+        _handler_installed = signal.getsignal(signal.SIGALRM) in (signal.SIG_DFL, _alarm)
+        if _handler_installed:
+            signal.signal(signal.SIGALRM, _alarm)
+    return _handler_installed
+
+
+class SafePattern:
+    '''
+    A compiled regular expression that is matched in linear time or within
+    a time budget.
+    '''
+
+    def __init__(self, pattern, flags=0):
+        '''
+        @type pattern: C{str}
+        @param pattern: a regular expression
+        @type flags: C{int}
+        @param flags: the re module flags
+        @raises re.error: if the pattern is invalid
+        '''
+        self.pattern = pattern
+        self.regex = re.compile(pattern, flags)
+        self.risk = backtracking_risk(pattern, flags)
+        self.linear = None
+        if re2 is not None and flags == 0:
+            try:
+                self.linear = re2.compile(pattern)
+            except Exception:
+                # The pattern uses features that re2 does not support.
+                pass
+
+    def search(self, string, timeout=None):
+        '''
+        Scans a string for a match.
+
+        @type string: C{str}
+        @param string: the string to search
+        @type timeout: C{float}
+        @param timeout: the time budget in seconds, settings.REGEX_TIMEOUT by default
+        @rtype: C{object}
+        @return: a match object or None
+        @raises RegexTimeout: if the search took too long
+        '''
+        return self._run('search', string, timeout)
+
+    def match(self, string, timeout=None):
+        '''
+        Matches the beginning of a string, see search.
+        '''
+        return self._run('match', string, timeout)
+
+    def _run(self, method, string, timeout):
+        if self.linear is not None:
+            return getattr(self.linear, method)(string)
+        if timeout is None:
+            timeout = settings.REGEX_TIMEOUT
+        if not timeout or not _time_budget_available():
+            return getattr(self.regex, method)(string)
+        try:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+            return getattr(self.regex, method)(string)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+@lru_cache(maxsize=1024)
+def compile_safe(pattern, flags=0):
+    '''
+    Compiles a regular expression from the configuration. A warning is
+    logged once per process if the pattern risks catastrophic backtracking.
+
+    @type pattern: C{str}
+    @param pattern: a regular expression
+    @type flags: C{int}
+    @param flags: the re module flags
+    @rtype: C{SafePattern}
+    @return: the compiled pattern
+    @raises re.error: if the pattern is invalid
+    '''
+    compiled = SafePattern(pattern, flags)
+    if compiled.risk and compiled.linear is None:
+        LOGGER.warning("Regular expression %r may backtrack catastrophically: %s", pattern, compiled.risk)
+    return compiled
+
+
+def backtracking_risk(pattern, flags=0):
+    '''
+    Checks a regular expression for the usual causes of catastrophic
+    backtracking: a repeated part that contains another repeat matching the
+    same text, e.g. (a+)+ or (\\w+\\s?)*, and a repeated alternation whose
+    alternatives match the same text, e.g. (a|ab)*. The check is a
+    heuristic and does not find every slow pattern.
+
+    @type pattern: C{str}
+    @param pattern: a regular expression
+    @type flags: C{int}
+    @param flags: the re module flags
+    @rtype: C{str}
+    @return: a description of the risk or None
+    @raises re.error: if the pattern is invalid
+    '''
+    return _risk(sre_parse.parse(pattern, flags))
+
+
+def _is_unbounded(op, av):
+    # Bounded repeats are polynomial, only long ones are a problem.
+    return op in (sre.MAX_REPEAT, sre.MIN_REPEAT) and av[1] >= 10
+
+
+def _items(op, av):
+    # The subpatterns nested in a pattern item.
+    if op in (sre.MAX_REPEAT, sre.MIN_REPEAT):
+        return [av[2]]
+    if op is sre.SUBPATTERN:
+        return [av[-1]]
+    if op is sre.BRANCH:
+        return av[1]
+    if op in (sre.ASSERT, sre.ASSERT_NOT):
+        return [av[1]]
+    if op is sre.GROUPREF_EXISTS:
+        return [p for p in av[1:] if p is not None]
+    return []
+
+
+def _risk(items):
+    for op, av in items:
+        if _is_unbounded(op, av):
+            risk = _repeat_risk(av[2])
+            if risk:
+                return risk
+        for sub in _items(op, av):
+            risk = _risk(sub)
+            if risk:
+                return risk
+    return None
+
+
+def _repeats(items):
+    # The unbounded repeats of a sequence, also inside groups, and the
+    # indexes of the top level items that hold them.
+    found = []
+    for index, (op, av) in enumerate(items):
+        if _is_unbounded(op, av):
+            found.append((index, av[2]))
+        elif op is sre.SUBPATTERN:
+            found.extend((index, sub) for _, sub in _repeats(av[-1]))
+    return found
+
+
+def _repeat_risk(body):
+    while len(body) == 1 and body[0][0] is sre.SUBPATTERN:
+        body = body[0][1][-1]
+    repeats = _repeats(body)
+    for n, (index, inner) in enumerate(repeats):
+        rest = [item for i, item in enumerate(body) if i != index]
+        if _min_width(rest) == 0 or _first_chars(inner) & _first_chars(rest):
+            return "a repeat nested in a repeat, e.g. (a+)+"
+        for other_index, other in repeats[n + 1:]:
+            if other_index != index and _first_chars(inner) & _first_chars(other):
+                return "adjacent repeats of the same text nested in a repeat, e.g. (a+a+)+"
+    for op, av in body:
+        if op is sre.BRANCH:
+            alternatives = av[1]
+            if any(_min_width(alt) == 0 for alt in alternatives):
+                return "a repeated alternation with an empty alternative, e.g. (a|ab)*"
+            firsts = [_first_chars(alt) for alt in alternatives]
+            for i in range(len(firsts)):
+                for j in range(i + 1, len(firsts)):
+                    if firsts[i] & firsts[j]:
+                        return "a repeated alternation of overlapping alternatives, e.g. (a|a?)+"
+    return None
+
+
+def _min_width(items):
+    width = 0
+    for op, av in items:
+        if op in (sre.MAX_REPEAT, sre.MIN_REPEAT):
+            width += av[0] and av[0] * _min_width(av[2])
+        elif op is sre.SUBPATTERN:
+            width += _min_width(av[-1])
+        elif op is sre.BRANCH:
+            width += min(_min_width(alt) for alt in av[1])
+        elif op in (sre.LITERAL, sre.NOT_LITERAL, sre.ANY, sre.IN):
+            width += 1
+    return width
+
+
+def _first_chars(items):
+    # The sample characters that a sequence may start with.
+    chars = set()
+    for op, av in items:
+        if op in (sre.MAX_REPEAT, sre.MIN_REPEAT):
+            chars |= _first_chars(av[2])
+            if av[0] > 0 and _min_width(av[2]) > 0:
+                return chars
+        elif op is sre.SUBPATTERN:
+            chars |= _first_chars(av[-1])
+            if _min_width(av[-1]) > 0:
+                return chars
+        elif op is sre.BRANCH:
+            for alt in av[1]:
+                chars |= _first_chars(alt)
+            if min(_min_width(alt) for alt in av[1]) > 0:
+                return chars
+        elif op in (sre.LITERAL, sre.NOT_LITERAL, sre.ANY, sre.IN):
+            return chars | set(c for c in SAMPLE_CHARS if _char_matches(op, av, c))
+        elif op in (sre.AT, sre.ASSERT, sre.ASSERT_NOT):
+            continue
+        else:
+            # Back references and others may match anything.
+            return chars | set(SAMPLE_CHARS)
+    return chars
+
+
+def _char_matches(op, av, c):
+    if op is sre.LITERAL:
+        return ord(c) == av
+    if op is sre.NOT_LITERAL:
+        return ord(c) != av
+    if op is sre.ANY:
+        return c != '\n'
+    negate = False
+    found = False
+    for set_op, set_av in av:
+        if set_op is sre.NEGATE:
+            negate = True
+        elif set_op is sre.LITERAL:
+            found = found or ord(c) == set_av
+        elif set_op is sre.RANGE:
+            found = found or set_av[0] <= ord(c) <= set_av[1]
+        elif set_op is sre.CATEGORY:
+            found = found or CATEGORIES.get(set_av, lambda c: True)(c)
+        else:
+            found = True
+    return found != negate
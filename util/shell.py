@@ -2,14 +2,19 @@
 Utility functions to handle shell processes.
 
 '''
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
 from access.config import ConfigError
 import subprocess
 import logging
 import os.path
+import threading
 
 
 LOGGER = logging.getLogger('main')
+_background = {}
+_background_lock = threading.Lock()
+_background_pending = 0
 
 
 def invoke(cmd_list, cwd=None):
@@ -30,6 +35,51 @@ def invoke(cmd_list, cwd=None):
     return {"code": p.returncode, "out": out.strip(), "err": err.strip()}
 
 
+def invoke_background(cmd_list, cwd=None):
+    '''
+    Invokes a shell command in a background thread of this process. At most
+    settings.BACKGROUND_INVOKE_WORKERS commands run at a time and the rest
+    wait in a queue.
+
+    @type cmd_list: C{list}
+    @param cmd_list: command line arguments
+    @type cwd: C{str}
+    @param cwd: set current working directory for the command, None if not used
+    @rtype: C{concurrent.futures.Future}
+    @return: a future of the invoke result
+    '''
+    global _background_pending
+    pid = os.getpid()
+    with _background_lock:
+        # A forked process must not use the threads of its parent.
+        executor = _background.get(pid)
+        if executor is None:
+            _background.clear()
+            _background_pending = 0
+            executor = _background[pid] = ThreadPoolExecutor(
+                max_workers=settings.BACKGROUND_INVOKE_WORKERS)
+        _background_pending += 1
+    future = executor.submit(invoke, cmd_list, cwd)
+    future.add_done_callback(_background_done)
+    return future
+
+
+def _background_done(future):
+    global _background_pending
+    with _background_lock:
+        _background_pending -= 1
+
+
+def background_queue_length():
+    '''
+    Counts the background commands of this process that have not completed.
+
+    @rtype: C{int}
+    @return: the number of commands
+    '''
+    return _background_pending
+
+
 def invoke_script(script, arguments, dirarg=None):
     '''
     Invokes a named shell script.